@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import botocore.exceptions
+
+import extract_findings
+import get_all_findings
+import summarise_findings
+from findings_io import is_sharded, iter_findings, open_writer, shard_paths, snapshot_size
+from rate_limiter import MAX_RATE, RateLimiter
+from run_metrics import RunMetrics
+
+NOW = datetime.now().strftime("%Y%m%d-%H%M")
+MAX_LEN = 20 # Max title length
+
+SIZES = "1000,10000" # Synthetic snapshot sizes (also e.g. 100000, 1000000)
+FETCH_SIZE = 2000 # Findings fetched per fetch strategy (fetching is latency bound, so kept small)
+WORKERS = "1,8,16" # Worker counts to compare when fetching
+SHARDS = "8" # Shard counts to compare when summarising and extracting (get_all_findings.py --shards)
+LATENCY = 0.05 # Seconds per stubbed get_finding_v2 call
+UNBOUNDED_RATE = 1e6 # Calls/s for a rate limiter that never holds calls back, so strategies are compared on concurrency alone
+SEED = 42
+
+ARN = "arn:aws:access-analyzer:eu-west-1:112233445566:analyzer/Benchmark"
+
+# Rough mix seen on a real org analyzer
+RESOURCE_TYPES = {
+    "AWS::IAM::Role": 64,
+    "AWS::SQS::Queue": 16,
+    "AWS::S3::Bucket": 14,
+    "AWS::EC2::Snapshot": 3,
+    "AWS::SNS::Topic": 2,
+    "AWS::KMS::Key": 0.3,
+    "AWS::RDS::DBSnapshot": 0.2,
+    "AWS::ECR::Repository": 0.1,
+    "AWS::Lambda::Function": 0.2,
+    "AWS::SecretsManager::Secret": 0.1,
+    "AWS::DynamoDB::Table": 0.05,
+    "AWS::DynamoDB::Stream": 0.05,
+}
+STATUSES = {"ACTIVE": 82, "RESOLVED": 18, "ARCHIVED": 0.1}
+PUBLIC_RATE = 0.16
+OWNERS = 56
+PRINCIPALS = 40
+
+ACTIONS = {
+    "AWS::IAM::Role": ["sts:AssumeRole"],
+    "AWS::SQS::Queue": ["sqs:SendMessage", "sqs:ReceiveMessage", "sqs:DeleteMessage"],
+    "AWS::S3::Bucket": ["s3:GetObject", "s3:ListBucket", "s3:PutObject"],
+    "AWS::KMS::Key": ["kms:Decrypt", "kms:Encrypt", "kms:GenerateDataKey"],
+}
+
+
+def main(sizes, fetch_size, workers_list, latency, throttle_rate, rate_ceiling, limiter_rate, output_path, keep, shards_list=()):
+    work_dir = tempfile.mkdtemp(prefix="iaa-benchmark-")
+    results = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "parameters": {
+            "sizes": sizes,
+            "fetch_size": fetch_size,
+            "workers": workers_list,
+            "latency": latency,
+            "throttle_rate": throttle_rate,
+            "rate_ceiling": rate_ceiling,
+            "limiter_rate": limiter_rate,
+            "shards": list(shards_list),
+            "seed": SEED,
+        },
+        "fetch": [],
+        "snapshots": [],
+    }
+
+    t = "Work directory"
+    print(f"{t.ljust(MAX_LEN)} : {work_dir}\n")
+
+    try:
+        # Fetching: the same synthetic analyzer behind a stubbed client, with each strategy
+        # The strategies are compared without the client rate limiter; the last row is the most workers behind it,
+        # as get_all_findings.py runs them (starting at --limiter_rate if given)
+        findings = list(generate_findings(fetch_size, SEED))
+        print(f"Fetch ({fetch_size} findings, {latency * 1000:.0f} ms latency):")
+        strategies = [(f"workers={workers}", workers, False, False) for workers in workers_list]
+        strategies.append((f"workers={max(workers_list)},pipeline", max(workers_list), True, False))
+        strategies.append((f"workers={max(workers_list)},limiter", max(workers_list), False, True))
+        for name, workers, pipeline, limited in strategies:
+            client = StubAccessAnalyzer(findings, latency, throttle_rate, rate_ceiling)
+            result = bench_fetch(client, os.path.join(work_dir, f"fetch-{name}.details.ndjson"), workers, pipeline, limiter_rate, limited)
+            result["strategy"] = name
+            results["fetch"].append(result)
+            print(f"  {name.ljust(MAX_LEN)} : {result['total']:.2f}s ({result['findings_per_second']:.1f} findings/s, {result['throttles']} throttled)")
+        print()
+
+        # Summarise and extract: synthetic snapshots at each size, in each format, and sharded
+        for size in sizes:
+            layouts = [("json", None), ("ndjson", None)] + [(f"{shards} shards", shards) for shards in shards_list]
+            for layout, shards in layouts:
+                if shards:
+                    path = os.path.join(work_dir, f"synthetic-{size}-{shards}.details.shards.json")
+                else:
+                    path = os.path.join(work_dir, f"synthetic-{size}.details.{layout}")
+                generated = time.perf_counter()
+                write_snapshot(generate_findings(size, SEED), path, shards)
+                generated = time.perf_counter() - generated
+
+                result = {"size": size, "format": layout, "bytes": snapshot_size(path), "generate": round(generated, 4)}
+                result["summarise"] = bench_summarise(path)
+                result["extract"] = bench_extract(path)
+                results["snapshots"].append(result)
+
+                print(f"Snapshot ({size} findings, {layout}, {result['bytes'] / 1e6:.1f} MB):")
+                print(f"  {'summarise'.ljust(MAX_LEN)} : {result['summarise']['total']:.2f}s")
+                print(f"  {'extract'.ljust(MAX_LEN)} : {result['extract']['total']:.2f}s"
+                      f" (hash {result['extract']['hash_groups']:.2f}s, write {result['extract']['write_groups']:.2f}s, link {result['extract']['link_outputs']:.2f}s)")
+                print()
+
+                # Snapshots can be large, so don't keep them around between sizes
+                if not keep:
+                    for file in os.listdir(work_dir):
+                        if file.startswith(f"synthetic-{size}"):
+                            os.remove(os.path.join(work_dir, file))
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=4)
+    t = "Results written to"
+    print(f"{t.ljust(MAX_LEN)} : {output_path}")
+
+
+def bench_fetch(client, path, workers, pipeline, limiter_rate=None, limited=False):
+    # Time listing, then fetching and writing, the way get_all_findings.main does.
+    # Unless limited, the rate limiter lets every call through (but still retries throttled ones)
+    if limited:
+        limiter = RateLimiter(rate=limiter_rate, max_rate=max(limiter_rate or 0, MAX_RATE), workers=workers)
+    else:
+        limiter = RateLimiter(rate=UNBOUNDED_RATE, max_rate=UNBOUNDED_RATE)
+    timings = {}
+    start = time.perf_counter()
+
+    if pipeline:
+        listed = get_all_findings.list_findings_pipelined(client, ARN, limiter)
+        timings["list"] = None # overlapped with fetching
+    else:
+        listed = get_all_findings.list_all_findings(client, ARN, limiter)['findings']
+        timings["list"] = round(time.perf_counter() - start, 4)
+
+    fetch_start = time.perf_counter()
+    items = ((finding['id'], None) for finding in listed)
+    findings = get_all_findings.fetch_in_order(client, ARN, items, limiter, workers, progress=False)
+    failed = get_all_findings.write_results(findings, path, quiet=True)
+    timings["fetch_and_write"] = round(time.perf_counter() - fetch_start, 4)
+
+    total = time.perf_counter() - start
+    stats = limiter.stats()
+    written = client.findings_count - len(failed)
+    return {
+        "workers": workers,
+        "pipeline": pipeline,
+        "limiter": limited,
+        "findings": written,
+        "failed": len(failed),
+        "total": round(total, 4),
+        "phases": timings,
+        "findings_per_second": round(written / total, 2) if total else 0.0,
+        "calls": stats["calls"],
+        "calls_per_second": stats["calls_per_second"],
+        "throttles": stats["throttles"],
+        "retries": stats["retries"],
+        "api_calls_received": client.calls,
+    }
+
+
+def bench_summarise(path):
+    start = time.perf_counter()
+    if is_sharded(path):
+        summary = summarise_findings.summarise_shards(shard_paths(path))
+    else:
+        summary = summarise_findings.summarise(iter_findings(path))
+    return {"total": round(time.perf_counter() - start, 4), "findings": summary.total}
+
+
+def bench_extract(path):
+    filename_pre = path.split(".")[0]
+    metrics = RunMetrics("benchmark_findings")
+
+    start = time.perf_counter()
+    findings_qty, groups, contents, paths = extract_findings.extract_groups(path, filename_pre, False, False, metrics)
+    done = time.perf_counter()
+
+    phases = metrics.to_dict()["phases"]
+    return {
+        "total": round(done - start, 4),
+        "hash_groups": phases["hash_groups"]["wall"],
+        "write_groups": phases["write_groups"]["wall"],
+        "link_outputs": phases["link_outputs"]["wall"],
+        "findings": findings_qty,
+        "groups_written": sum(1 for name in contents if not contents[name]['same_as']),
+    }
+
+
+class StubAccessAnalyzer:
+    '''
+    Stands in for boto3.client('accessanalyzer'), serving synthetic findings with injected latency
+    and throttling. Throttles randomly (throttle_rate) and whenever calls exceed rate_ceiling per second.
+    '''
+
+    PAGE_SIZE = 100
+
+    def __init__(self, findings, latency=LATENCY, throttle_rate=0.0, rate_ceiling=None, seed=SEED):
+        self.findings = {finding['id']: finding for finding in findings}
+        self.ids = [finding['id'] for finding in findings]
+        self.findings_count = len(self.ids)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.rate_ceiling = rate_ceiling
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.calls = 0
+
+    def list_findings(self, analyzerArn, nextToken=None, filter=None, maxResults=None):
+        self.call("ListFindings")
+        start = int(nextToken or 0)
+        ids = self.ids[start:start + self.PAGE_SIZE]
+        page = {"findings": [list_entry(self.findings[finding_id]) for finding_id in ids]}
+        if filter:
+            page["findings"] = [entry for entry in page["findings"] if matches_filter(self.findings[entry['id']], filter)]
+        if start + self.PAGE_SIZE < len(self.ids):
+            page["nextToken"] = str(start + self.PAGE_SIZE)
+        return page
+
+    def get_finding_v2(self, id, analyzerArn):
+        self.call("GetFindingV2")
+        response = dict(self.findings[id])
+        response["ResponseMetadata"] = {"HTTPStatusCode": 200}
+        return response
+
+    def call(self, operation):
+        with self.lock:
+            self.calls += 1
+            now = time.monotonic()
+            self.recent.append(now)
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            throttled = self.random.random() < self.throttle_rate
+            throttled = throttled or (self.rate_ceiling is not None and len(self.recent) > self.rate_ceiling)
+        time.sleep(self.latency)
+        if throttled:
+            raise botocore.exceptions.ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, operation
+            )
+
+
+def list_entry(finding):
+    # What list_findings returns for a finding (no findingDetails)
+    return {key: value for key, value in finding.items() if key != "findingDetails"}
+
+
+def matches_filter(finding, criteria):
+    for key, condition in criteria.items():
+        value = finding.get(key)
+        if key == "isPublic":
+            value = str(finding['findingDetails'][0]['externalAccessDetails']['isPublic']).lower()
+        if "eq" in condition and value not in condition["eq"]:
+            return False
+    return True
+
+
+def generate_findings(count, seed=SEED):
+    # Reproducible synthetic findings, shaped like get_finding_v2 responses, yielded one at a time
+    # so that large snapshots are written as they're generated
+    rng = random.Random(seed)
+    resource_types = list(RESOURCE_TYPES)
+    resource_weights = list(RESOURCE_TYPES.values())
+    statuses = list(STATUSES)
+    status_weights = list(STATUSES.values())
+    owners = [f"{rng.randrange(10**11, 10**12)}" for i in range(OWNERS)]
+    principals = [f"{rng.randrange(10**11, 10**12)}" for i in range(PRINCIPALS)]
+    epoch = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    for i in range(count):
+        resource_type = rng.choices(resource_types, resource_weights)[0]
+        status = rng.choices(statuses, status_weights)[0]
+        owner = rng.choice(owners)
+        is_public = rng.random() < PUBLIC_RATE
+        created = epoch + timedelta(minutes=rng.randrange(0, 60 * 24 * 180))
+        updated = created + timedelta(minutes=rng.randrange(0, 60 * 24 * 30))
+        principal = {"AWS": "*"} if is_public else (
+            {"Federated": f"arn:aws:iam::{owner}:saml-provider/AzureAD"} if resource_type == "AWS::IAM::Role" and rng.random() < 0.3
+            else {"AWS": rng.choice(principals)}
+        )
+        condition = {"aws:PrincipalOrgID": "o-abc123def4"} if rng.random() < 0.2 else {}
+        name = f"resource-{i}"
+        yield {
+            "id": "{0:08x}-{1:04x}-{2:04x}-{3:04x}-{4:012x}".format(
+                rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(48)),
+            "resource": f"arn:aws:{resource_type.split('::')[1].lower()}::{owner}:{name}",
+            "resourceType": resource_type,
+            "resourceOwnerAccount": owner,
+            "status": status,
+            "findingType": "ExternalAccess",
+            "createdAt": created,
+            "updatedAt": updated,
+            "analyzedAt": updated,
+            "findingDetails": [{
+                "externalAccessDetails": {
+                    "action": ACTIONS.get(resource_type, ["*"]),
+                    "condition": condition,
+                    "isPublic": is_public,
+                    "principal": principal,
+                    "sources": [{"type": "POLICY"}],
+                }
+            }],
+        }
+
+
+def write_snapshot(findings, path, shards=None):
+    writer = open_writer(path, shards=shards)
+    for finding in findings:
+        writer.write(finding)
+    writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark fetching, summarising and extracting findings, offline.')
+    parser.add_argument('--sizes', dest='sizes', default=SIZES, help=f'Comma separated snapshot sizes (default: {SIZES})')
+    parser.add_argument('--fetch_size', dest='fetch_size', type=int, default=FETCH_SIZE, help=f'Findings fetched per fetch strategy (default: {FETCH_SIZE})')
+    parser.add_argument('--workers', dest='workers', default=WORKERS, help=f'Comma separated worker counts to compare (default: {WORKERS})')
+    parser.add_argument('--shards', dest='shards', default=SHARDS, help=f'Comma separated shard counts to compare for summarise and extract, or "" for none (default: {SHARDS})')
+    parser.add_argument('--latency', dest='latency', type=float, default=LATENCY, help=f'Seconds per stubbed API call (default: {LATENCY})')
+    parser.add_argument('--throttle_rate', dest='throttle_rate', type=float, default=0.0, help='Fraction of stubbed calls throttled at random (default: 0)')
+    parser.add_argument('--rate_ceiling', dest='rate_ceiling', type=float, default=None, help='Stubbed API throttles above this many calls/s (default: none)')
+    parser.add_argument('--limiter_rate', dest='limiter_rate', type=float, default=None, help='Starting rate for the client rate limiter, in the limiter row (default: workers / latency of the first call)')
+    parser.add_argument('-o', dest='output', default=f"{NOW}-benchmark.json", help='Where to write the results (default: <date>-benchmark.json)')
+    parser.add_argument('--keep', dest='keep', action='store_true', help='Keep the generated files')
+    args = parser.parse_args()
+
+    main(
+        sizes=[int(size) for size in args.sizes.split(",")],
+        fetch_size=args.fetch_size,
+        workers_list=[int(workers) for workers in args.workers.split(",")],
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        rate_ceiling=args.rate_ceiling,
+        limiter_rate=args.limiter_rate,
+        output_path=args.output,
+        keep=args.keep,
+        shards_list=[int(shards) for shards in args.shards.split(",") if shards],
+    )
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import hashlib
+import os
+from extract_findings import flatten
+from finding_model import intern_str
+import findings_io
+from findings_io import CsvWriter, JsonWriter, iter_findings
+from run_metrics import RunMetrics
+
+TRIMMED = True # Set to True to exclude metadata (get_all_findings.py)
+MAX_LEN = 20 # Max title length
+
+CSV_COLUMNS = "change,previousStatus," + findings_io.CSV_COLUMNS # Default CSV columns: the change, then the usual ones
+METRICS_FILE = None # Write the run metrics here as json
+PROMETHEUS_FILE = None # Write the run metrics here in Prometheus textfile format
+
+# (name, title) of each kind of change, in the order they're reported
+CHANGES = [
+    ("NEW", "New findings"),
+    ("RESOLVED", "Resolved findings"),
+    ("STATUS_CHANGED", "Status changed"),
+    ("POLICY_CHANGED", "Policy changed"),
+    ("REMOVED", "Removed findings"),
+]
+
+
+def main(old_filename, new_filename, columns=None, compression=None):
+    # Name the output after the newer snapshot, e.g. <new>-diff-NEW.json
+    filename_pre = f"{new_filename.split('.')[0]}-diff"
+
+    fn = "Old filename"
+    print(f"{fn.ljust(MAX_LEN)} : {old_filename}")
+    fn = "New filename"
+    print(f"{fn.ljust(MAX_LEN)} : {new_filename}")
+
+    metrics = RunMetrics("diff_findings")
+    writers = open_writers(filename_pre, columns or CSV_COLUMNS, compression)
+    try:
+        # Index the old snapshot by id, keeping only its status and a digest of its policy details
+        with metrics.phase("index_old"):
+            index = index_snapshot(iter_findings(old_filename))
+        old_qty = len(index)
+
+        # Stream the new snapshot past the index; whatever is left in the index afterwards was removed
+        with metrics.phase("diff_new"):
+            new_qty, counts = diff_snapshot(iter_findings(new_filename), index, writers)
+
+        # Second pass over the old snapshot, only if anything was removed, to write those findings out
+        with metrics.phase("removed"):
+            counts["REMOVED"] = write_removed(iter_findings(old_filename), index, writers) if index else 0
+    finally:
+        for json_writer, csv_writer in writers.values():
+            json_writer.close()
+            csv_writer.close()
+
+    t = "\nFindings before"
+    print(f"{t.ljust(MAX_LEN)}  : {old_qty}")
+    t = "Findings after"
+    print(f"{t.ljust(MAX_LEN)} : {new_qty}")
+    t = "Unchanged"
+    print(f"{t.ljust(MAX_LEN)} : {counts['UNCHANGED']}")
+
+    for name, title in CHANGES:
+        json_writer, csv_writer = writers[name]
+        print(f"\n{title.ljust(MAX_LEN)} : {counts[name]}")
+        ext = "  json"
+        print(f"{ext.ljust(MAX_LEN)} : {json_writer.path}")
+        ext = "  csv"
+        print(f"{ext.ljust(MAX_LEN)} : {csv_writer.path}")
+
+    manifest_path = write_manifest(old_filename, new_filename, filename_pre, old_qty, new_qty, counts, writers)
+    mf = "\nManifest"
+    print(f"{mf.ljust(MAX_LEN)}  : {manifest_path}")
+
+    if METRICS_FILE:
+        metrics.write_json(METRICS_FILE)
+    if PROMETHEUS_FILE:
+        metrics.write_prometheus(PROMETHEUS_FILE)
+
+
+def open_writers(filename_pre, columns=None, compression=None):
+    # JSON and CSV writer for each kind of change
+    return {
+        name: (JsonWriter(f"{filename_pre}-{name}.json"), CsvWriter(f"{filename_pre}-{name}.csv", columns, compression))
+        for name, title in CHANGES
+    }
+
+
+def index_snapshot(data):
+    # {id: (status, policy digest)}. Statuses are interned, so the index costs little more than the ids
+    index = {}
+    for finding in data:
+        finding = finding['finding'] if not TRIMMED else finding
+        index[finding['id']] = (intern_str(finding.get('status')), policy_digest(finding))
+    return index
+
+
+def policy_digest(finding):
+    # Digest of everything Access Analyzer found about the policy (actions, principal, condition, isPublic, sources...)
+    details = json.dumps(finding.get('findingDetails'), sort_keys=True, default=str)
+    return hashlib.blake2b(details.encode(), digest_size=16).digest()
+
+
+def diff_snapshot(data, index, writers):
+    # Classify each finding of the new snapshot against the index of the old one, writing the changes.
+    # Matched ids are removed from the index. Returns the number of findings and the count of each change
+    findings_qty = 0
+    counts = {name: 0 for name, title in CHANGES}
+    counts["UNCHANGED"] = 0
+    for finding in data:
+        findings_qty += 1
+        finding = finding['finding'] if not TRIMMED else finding
+        old = index.pop(finding['id'], None)
+        status = finding.get('status')
+
+        previous_status = None
+        if old is None:
+            change = "NEW"
+        elif status != old[0]:
+            change = "RESOLVED" if status == "RESOLVED" else "STATUS_CHANGED"
+            previous_status = old[0]
+        elif policy_digest(finding) != old[1]:
+            change = "POLICY_CHANGED"
+        else:
+            counts["UNCHANGED"] += 1
+            continue
+
+        counts[change] += 1
+        write_change(writers, change, finding, previous_status)
+    return findings_qty, counts
+
+
+def write_removed(data, removed, writers):
+    # Write the findings of the old snapshot whose ids are in removed (no longer in the new snapshot)
+    count = 0
+    for finding in data:
+        finding = finding['finding'] if not TRIMMED else finding
+        if finding['id'] in removed:
+            count += 1
+            write_change(writers, "REMOVED", finding, finding.get('status'))
+    return count
+
+
+def write_change(writers, change, finding, previous_status=None):
+    record = flatten(finding)
+    record['change'] = change
+    record['previousStatus'] = previous_status
+    json_writer, csv_writer = writers[change]
+    json_writer.write(record)
+    csv_writer.write(record)
+
+
+def write_manifest(old_filename, new_filename, filename_pre, old_qty, new_qty, counts, writers):
+    # How many findings changed in each way, and where they were written
+    manifest_path = f"{filename_pre}-manifest.json"
+    manifest = {
+        "old": old_filename,
+        "new": new_filename,
+        "old_count": old_qty,
+        "new_count": new_qty,
+        "unchanged": counts["UNCHANGED"],
+        "changes": [
+            {
+                "name": name,
+                "count": counts[name],
+                "json": writers[name][0].path,
+                "csv": writers[name][1].path,
+            }
+            for name, title in CHANGES
+        ],
+    }
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=4)
+    return manifest_path
+
+
+def usage(message):
+    print(message)
+    print("Usage: python diff_findings.py --old <details file> --new <details file>")
+    exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare two snapshots of findings.')
+    parser.add_argument( '--old', dest='old', help='The earlier details file (json, ndjson or findings store)')
+    parser.add_argument( '--new', dest='new', help='The later details file (json, ndjson or findings store)')
+    parser.add_argument( '--columns', dest='columns', help='Comma separated finding keys to write to the CSV files (default: change, previousStatus and the usual columns)')
+    parser.add_argument( '--compress', dest='compress', choices=['gzip', 'zstd'], help='Compress the CSV files (.csv.gz or .csv.zst)')
+    parser.add_argument( '--metrics', dest='metrics', help='Write the run metrics (timings) here as json')
+    parser.add_argument( '--prometheus', dest='prometheus', help='Write the run metrics here in Prometheus textfile format')
+    args = parser.parse_args()
+
+    if not args.old or not args.new:
+        usage("Both --old and --new are needed")
+    for filename in [args.old, args.new]:
+        if not os.path.exists(filename):
+            usage(f"No such file: {filename}")
+
+    METRICS_FILE = args.metrics or METRICS_FILE
+    PROMETHEUS_FILE = args.prometheus or PROMETHEUS_FILE
+
+    main(args.old, args.new, args.columns, args.compress)
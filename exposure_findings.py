@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import os
+import re
+import time
+from collections import Counter
+from finding_model import Finding, from_dicts, intern_str
+from findings_io import has_changes, iter_findings
+
+MAX_LEN = 20 # Max title length
+TOP = 10 # How many owners to show with --top-owners
+INDEX_VERSION = 1
+
+ACCOUNT_ID = re.compile(r"(?<!\d)\d{12}(?!\d)") # An account id on its own or in an ARN
+
+# Finding fields kept in the index, in the order they're saved
+FIELDS = ["id", "status", "resource_type", "resource", "owner", "is_public", "principal_type", "principal", "actions"]
+
+
+class ExposureIndex:
+    '''
+    Who can reach what, for one snapshot: findings by external principal (and by the account in it),
+    by resource and by owner. Built once and saved next to the snapshot, so each question is a lookup
+    rather than another pass over the findings.
+    '''
+
+    def __init__(self):
+        self.findings = [] # Findings (without their data); the maps below hold positions in this list
+        self.by_principal = {}
+        self.by_account = {}
+        self.by_resource = {}
+        self.by_owner = {}
+
+    def add(self, finding):
+        position = len(self.findings)
+        self.findings.append(finding)
+        if finding.principal is not None:
+            self.by_principal.setdefault(finding.principal, []).append(position)
+            account = account_of(finding.principal)
+            if account:
+                self.by_account.setdefault(account, []).append(position)
+        self.by_resource.setdefault(finding.resource, []).append(position)
+        self.by_owner.setdefault(finding.owner, []).append(position)
+
+    @classmethod
+    def build(cls, data):
+        index = cls()
+        for finding in from_dicts(data):
+            index.add(finding)
+        return index
+
+    def reachable(self, principal, statuses=None):
+        # Findings a principal can reach: an exact principal (e.g. an ARN, "*" or a service),
+        # or every principal in an account if given an account id
+        positions = self.by_account.get(principal) if ACCOUNT_ID.fullmatch(principal) else None
+        if positions is None:
+            positions = self.by_principal.get(principal, [])
+        return self.select(positions, statuses)
+
+    def resource(self, resource, statuses=None):
+        # The findings for a resource, its principals and their actions
+        findings = self.select(self.by_resource.get(resource, []), statuses)
+        principals = sorted(set(f"{finding.principal_type}: {finding.principal}" for finding in findings))
+        actions = sorted(set(action for finding in findings for action in finding.actions))
+        return findings, principals, actions
+
+    def top_owners(self, n=TOP, statuses=None):
+        # Owners with the most findings: [(owner, findings, public findings, distinct principals)]
+        owners = []
+        for owner, positions in self.by_owner.items():
+            findings = self.select(positions, statuses)
+            if findings:
+                owners.append((
+                    owner,
+                    len(findings),
+                    sum(1 for finding in findings if finding.is_public),
+                    len(set(finding.principal for finding in findings)),
+                ))
+        owners.sort(key=lambda owner: (owner[1], owner[2]), reverse=True)
+        return owners[:n]
+
+    def top_principals(self, n=TOP, statuses=None):
+        # Principals that can reach the most resources: [(principal, resources)]
+        counts = Counter()
+        for principal, positions in self.by_principal.items():
+            counts[principal] = len(set(finding.resource for finding in self.select(positions, statuses)))
+        return [(principal, count) for principal, count in counts.most_common(n) if count]
+
+    def select(self, positions, statuses=None):
+        findings = [self.findings[position] for position in positions]
+        if statuses:
+            findings = [finding for finding in findings if finding.status in statuses]
+        return findings
+
+    def to_dict(self):
+        return {"fields": FIELDS, "findings": [[getattr(finding, field) for field in FIELDS] for finding in self.findings]}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        for row in data["findings"]:
+            finding = Finding(**dict(zip(data["fields"], row)))
+            for field in ["status", "resource_type", "owner", "principal_type", "principal"]:
+                setattr(finding, field, intern_str(getattr(finding, field)))
+            finding.actions = tuple(map(intern_str, finding.actions))
+            index.add(finding)
+        return index
+
+
+def account_of(principal):
+    # The account id in a principal (the id itself, or an ARN), if there is one
+    match = ACCOUNT_ID.search(principal)
+    return match.group(0) if match else None
+
+
+def index_path(filename):
+    return f"{filename}.exposure.json"
+
+
+def load_index(filename, rebuild=False):
+    # The snapshot's index, from its sidecar if that's up to date, otherwise built and saved. Returns (index, built)
+    path = index_path(filename)
+    stat = os.stat(filename)
+    if not rebuild:
+        try:
+            with open(path, "r") as file:
+                saved = json.load(file)
+            if saved.get("version") == INDEX_VERSION and saved.get("size") == stat.st_size and saved.get("mtime_ns") == stat.st_mtime_ns and not has_changes(filename):
+                return ExposureIndex.from_dict(saved), False
+        except (OSError, ValueError):
+            pass
+
+    index = ExposureIndex.build(iter_findings(filename))
+    saved = {"version": INDEX_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    saved.update(index.to_dict())
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(saved, file)
+    os.replace(f"{path}.tmp", path)
+    return index, True
+
+
+def main(filename, principal=None, resource=None, top_owners=None, top_principals=None, statuses=None, rebuild=False):
+    f = "Filename"
+    print(f"{f.ljust(MAX_LEN)} : {filename}")
+
+    start = time.perf_counter()
+    index, built = load_index(filename, rebuild)
+    t = "Index"
+    print(f"{t.ljust(MAX_LEN)} : {index_path(filename)} ({'built' if built else 'loaded'} in {time.perf_counter() - start:.2f}s)")
+    t = "Findings"
+    print(f"{t.ljust(MAX_LEN)} : {len(index.findings)}")
+    t = "Principals"
+    print(f"{t.ljust(MAX_LEN)} : {len(index.by_principal)} ({len(index.by_account)} accounts)")
+    if statuses:
+        t = "Status"
+        print(f"{t.ljust(MAX_LEN)} : {', '.join(statuses)}")
+    print()
+
+    if principal:
+        findings = index.reachable(principal, statuses)
+        print(f"Reachable by {principal}: {len(findings)} findings, {len(set(finding.resource for finding in findings))} resources")
+        for finding in findings:
+            print(f"  {str(finding.status or '').ljust(9)} {str(finding.resource_type or '').ljust(MAX_LEN + 6)} {finding.resource}  ({finding.principal_type}: {finding.principal}; {', '.join(finding.actions)})")
+        print()
+
+    if resource:
+        findings, principals, actions = index.resource(resource, statuses)
+        print(f"{resource}: {len(findings)} findings")
+        t = "  Principals"
+        print(f"{t.ljust(MAX_LEN)} : {', '.join(principals)}")
+        t = "  Actions"
+        print(f"{t.ljust(MAX_LEN)} : {', '.join(actions)}")
+        print()
+
+    if top_owners:
+        print("Most exposed owners:")
+        print(f"  {'Owner'.ljust(MAX_LEN)} : findings, public, principals")
+        for owner, count, public, principals in index.top_owners(top_owners, statuses):
+            print(f"  {str(owner).ljust(MAX_LEN)} : {count}, {public}, {principals}")
+        print()
+
+    if top_principals:
+        print("Principals reaching the most resources:")
+        for principal_value, count in index.top_principals(top_principals, statuses):
+            print(f"  {str(principal_value).ljust(MAX_LEN)} : {count}")
+        print()
+
+
+def usage(message):
+    print(message)
+    print("Usage: python exposure_findings.py -f <filename> [--principal <account id, ARN or *>] [--resource <ARN>] [--top-owners [N]] [--top-principals [N]] [--status ACTIVE]")
+    exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Who can reach what, from a snapshot of findings.')
+    parser.add_argument( '-f', dest='filename', help='The filename to use (json, ndjson or findings store)')
+    parser.add_argument( '--principal', dest='principal', help='Show everything this principal can reach: an account id (any principal in it), an ARN, * or a service')
+    parser.add_argument( '--resource', dest='resource', help='Show the principals and actions that can reach this resource ARN')
+    parser.add_argument( '--top-owners', dest='top_owners', type=int, nargs='?', const=TOP, help=f'Show the owners with the most findings (default: {TOP})')
+    parser.add_argument( '--top-principals', dest='top_principals', type=int, nargs='?', const=TOP, help=f'Show the principals reaching the most resources (default: {TOP})')
+    parser.add_argument( '--status', dest='status', help='Only count findings with these statuses, comma separated (e.g. ACTIVE)')
+    parser.add_argument( '--rebuild', dest='rebuild', action='store_true', help='Build the index again, even if it is up to date')
+    args = parser.parse_args()
+
+    # Unset env vars - read from .env file
+    os.environ.pop('FINDINGS_FILE', None)
+
+    # Load dotenv
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    filename = args.filename or os.getenv("FINDINGS_FILE")
+    if not filename:
+        usage("No filename provided")
+    if not any([args.principal, args.resource, args.top_owners, args.top_principals]):
+        args.top_owners = TOP
+
+    statuses = [status.strip().upper() for status in args.status.split(",")] if args.status else None
+    main(filename, args.principal, args.resource, args.top_owners, args.top_principals, statuses, args.rebuild)
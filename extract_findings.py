@@ -2,16 +2,28 @@
 
 import json
 import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import os
+import shutil
+from finding_filter import compile_filter
+from findings_io import CsvWriter, JsonWriter, is_sharded, iter_findings, join_csv, join_json, json_text, shard_paths
+from run_metrics import RunMetrics
 
 NOW = datetime.now().strftime("%Y%m%d-%H%M")
 
 TRIMMED = True # Set to True to exclude metadata (get_all_findings.py)
 MAX_LEN = 20 # Max title length
+STATUSES = ['ACTIVE', 'ARCHIVED', 'RESOLVED']
 
 INCL_RESOLVED = os.getenv("INCL_RESOLVED", False)
 INCL_ARCHIVED = os.getenv("INCL_ARCHIVED", False)
+CSV_COLUMNS = None # Comma separated finding keys for the CSV output (default: findings_io.CSV_COLUMNS)
+CSV_COMPRESSION = None # None, "gzip" or "zstd"
+PROCESSES = None # Processes used to write the distinct groups, or the shards of a sharded snapshot (default: one per CPU)
+METRICS_FILE = None # Write the run metrics here as json
+PROMETHEUS_FILE = None # Also write the run metrics here in Prometheus textfile format
 
 
 def main(filename):
@@ -30,164 +42,257 @@ def main(filename):
     fn = "Filename"
     print(f"{fn.ljust(MAX_LEN)} : {filename}")
 
-    # Open json file for reading
-    with open(filename, 'r') as file:
-        data = json.load(file)
+    metrics = RunMetrics("extract_findings")
+    findings_qty, groups, contents, paths = extract_groups(filename, filename_pre, incl_resolved, incl_archived, metrics, CSV_COLUMNS, CSV_COMPRESSION, PROCESSES)
+    linked = sum(1 for name in contents if contents[name]['same_as'])
+    for name, title, prefix, match in groups:
+        if not contents[name]['same_as']:
+            for path in paths[name]:
+                metrics.count("bytes_written", os.path.getsize(path))
 
-    findings_qty = len(data)
     tf = "\nTotal findings"
     print(f"{tf.ljust(MAX_LEN)}  : {findings_qty}")
 
-    # Public
-    response_public = by_public(data,incl_resolved,incl_archived)
+    for name, title, results_file_path_prefix, match in groups:
+        json_path, csv_path = paths[name]
+        print(f"{title.ljust(MAX_LEN)}  : {contents[name]['count']}")
+        ext = "  json"
+        print(f"{ext.ljust(MAX_LEN)} : {json_path}")
+        ext = "  csv"
+        print(f"{ext.ljust(MAX_LEN)} : {csv_path}")
+        if contents[name]['same_as']:
+            same = "  same as"
+            print(f"{same.ljust(MAX_LEN)} : {contents[name]['same_as']}")
+
+    manifest_path = write_manifest(filename, filename_pre, groups, contents, paths)
+    mf = "\nManifest"
+    print(f"{mf.ljust(MAX_LEN)}  : {manifest_path}")
+
+    metrics.count("findings_read", findings_qty)
+    metrics.count("groups_written", len(groups) - linked)
+    metrics.count("groups_linked", linked)
+    mt = "Metrics"
+    if METRICS_FILE:
+        print(f"{mt.ljust(MAX_LEN)} : {metrics.write_json(METRICS_FILE)}")
+    if PROMETHEUS_FILE:
+        print(f"{mt.ljust(MAX_LEN)} : {metrics.write_prometheus(PROMETHEUS_FILE)}")
+
+
+def output_groups(filename_pre, incl_resolved, incl_archived):
+    # (name, title, output file prefix, match) for each output group.
+    # Each group is an Access Analyzer filter, compiled into its match (see finding_filter)
     res_suffix = "-incl_resolved" if incl_resolved else ""
     arc_suffix = "-incl_archived" if incl_archived else ""
-    file_pre = f"{filename_pre}-PUBLIC"
-    results_file_path_prefix = f"{file_pre}{res_suffix}{arc_suffix}"
-    process_response(response_public,results_file_path_prefix)
 
-    # External
-    response_external = by_external(data,incl_resolved,incl_archived)
-    res_suffix = "-incl_resolved" if incl_resolved else ""
-    arc_suffix = "-incl_archived" if incl_archived else ""
-    file_pre = f"{filename_pre}-EXTERNAL"
-    results_file_path_prefix = f"{file_pre}{res_suffix}{arc_suffix}"
-    process_response(response_external,results_file_path_prefix)
-
-    # Per status
-    statuses = ['ACTIVE', 'ARCHIVED', 'RESOLVED']
-    for status in statuses:
-        response_by_status = by_status(data, status)
-        results_file_path_prefix = f"{filename_pre}-{status.upper()}"
-        process_response(response_by_status,results_file_path_prefix)
-
-
-def by_public(data, incl_resolved, incl_archived):
-    findings_details = []
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        try:
-            if finding['findingDetails'][0]['externalAccessDetails']['isPublic']:
-                if incl_resolved:
-                    if incl_archived:
-                        findings_details.append(finding)
-                    else:
-                        if finding['status'] != "ARCHIVED":
-                            findings_details.append(finding)
-                else:
-                    if finding['status'] != "RESOLVED":
-                        if incl_archived:
-                            findings_details.append(finding)
-                        else:
-                            if finding['status'] != "ARCHIVED":
-                                findings_details.append(finding)
-        except:
-            pass
-    len_public = len(findings_details)
-    pf = "\nPublic findings"
-    print(f"{pf.ljust(MAX_LEN)}  : {len_public}")
-    return findings_details
-
-
-def by_external(data, incl_resolved, incl_archived):
-    findings_details = []
-    for finding in data:
+    # Resolved and archived findings are left out of the PUBLIC and EXTERNAL groups unless asked for
+    excluded = [status for status, incl in [("RESOLVED", incl_resolved), ("ARCHIVED", incl_archived)] if not incl]
+    included = {"status": {"neq": excluded}} if excluded else {}
+
+    groups = [
+        ("PUBLIC", "\nPublic findings", f"{filename_pre}-PUBLIC{res_suffix}{arc_suffix}",
+            compile_filter({"isPublic": {"eq": ["true"]}, **included})),
+        ("EXTERNAL", "\nExternal findings", f"{filename_pre}-EXTERNAL{res_suffix}{arc_suffix}",
+            compile_filter({"findingType": {"eq": ["ExternalAccess"]}, **included})),
+    ]
+    for status in STATUSES:
+        groups.append((status, f"\n{status} findings", f"{filename_pre}-{status.upper()}",
+            compile_filter({"status": {"eq": [status]}})))
+    return groups
+
+
+def extract_groups(filename, filename_pre, incl_resolved, incl_archived, metrics, columns=None, compression=None, processes=None):
+    # Compare the groups first: a pass that only matches each finding and hashes the ids in each group.
+    # Groups with the same findings would have identical output, so only the distinct groups are flattened
+    # and written (in parallel), and the others are linked to their files.
+    # Returns the number of findings, the groups, {name: {"count", "hash", "same_as"}} and {name: (json path, csv path)}
+    groups = output_groups(filename_pre, incl_resolved, incl_archived)
+    # A sharded snapshot is processed a shard per process
+    shards = shard_paths(filename) if is_sharded(filename) else None
+
+    with metrics.phase("hash_groups"):
+        if shards:
+            findings_qty, contents = hash_groups_shards(shards, filename_pre, incl_resolved, incl_archived, processes)
+        else:
+            findings_qty, contents = hash_groups(filename, filename_pre, incl_resolved, incl_archived)
+    distinct = find_duplicates(groups, contents)
+
+    with metrics.phase("write_groups"):
+        if shards:
+            paths = write_groups_shards(shards, filename_pre, incl_resolved, incl_archived, distinct, columns, compression, processes)
+        else:
+            paths = write_groups(filename, filename_pre, incl_resolved, incl_archived, distinct, columns, compression, processes)
+
+    with metrics.phase("link_outputs"):
+        for name, title, results_file_path_prefix, match in groups:
+            if contents[name]['same_as']:
+                paths[name] = link_outputs(paths[contents[name]['same_as']], results_file_path_prefix)
+    return findings_qty, groups, contents, paths
+
+
+def hash_groups(filename, filename_pre, incl_resolved, incl_archived):
+    # Count the findings in each group and hash their ids, without flattening or writing anything.
+    # Groups with the same hash have the same findings, in the same order, so the same output.
+    # Returns the number of findings and {name: {"count", "hash"}}
+    groups = output_groups(filename_pre, incl_resolved, incl_archived)
+    findings_qty = 0
+    counts = {name: 0 for name, title, prefix, match in groups}
+    hashes = {name: hashlib.sha256() for name, title, prefix, match in groups}
+    for finding in iter_findings(filename):
+        findings_qty += 1
         finding = finding['finding'] if not TRIMMED else finding
+        finding_id = None
+        for name, title, prefix, match in groups:
+            if match(finding):
+                if finding_id is None:
+                    finding_id = f"{finding.get('id')}\n".encode()
+                counts[name] += 1
+                hashes[name].update(finding_id)
+    return findings_qty, {name: {"count": counts[name], "hash": hashes[name].hexdigest()} for name in hashes}
+
+
+def hash_groups_shards(paths, filename_pre, incl_resolved, incl_archived, processes=None):
+    # hash_groups for each shard, a shard per process. A group's hash is the hash of its hash in each shard
+    processes = min(processes or os.cpu_count() or 1, len(paths))
+    args = [(path, filename_pre, incl_resolved, incl_archived) for path in paths]
+    if processes <= 1:
+        parts = [hash_groups(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parts = list(executor.map(hash_groups, *zip(*args)))
+
+    contents = {}
+    for name, title, prefix, match in output_groups(filename_pre, incl_resolved, incl_archived):
+        digest = hashlib.sha256()
+        for part_qty, part_contents in parts:
+            digest.update(bytes.fromhex(part_contents[name]['hash']))
+        contents[name] = {"count": sum(part_contents[name]['count'] for part_qty, part_contents in parts), "hash": digest.hexdigest()}
+    return sum(part_qty for part_qty, part_contents in parts), contents
+
+
+def find_duplicates(groups, contents):
+    # Record in contents[name]['same_as'] the earlier group each group has the same findings as, if any.
+    # Returns the names of the distinct groups, the ones to write
+    first_with_hash = {}
+    for name, title, prefix, match in groups:
+        same_as = first_with_hash.setdefault(contents[name]['hash'], name)
+        contents[name]['same_as'] = same_as if same_as != name else None
+    return list(first_with_hash.values())
+
+
+def write_groups(filename, filename_pre, incl_resolved, incl_archived, names, columns=None, compression=None, processes=None):
+    # Write the named groups, split across processes that each write theirs in one pass over the file.
+    # Returns {name: (json path, csv path)}
+    processes = min(processes or os.cpu_count() or 1, len(names))
+    if processes <= 1:
+        return write_groups_worker(filename, filename_pre, incl_resolved, incl_archived, names, columns, compression)
+    batches = [names[i::processes] for i in range(processes)]
+    paths = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(write_groups_worker, filename, filename_pre, incl_resolved, incl_archived, batch, columns, compression) for batch in batches]
+        for future in futures:
+            paths.update(future.result())
+    return paths
+
+
+def write_groups_shards(paths, filename_pre, incl_resolved, incl_archived, names, columns=None, compression=None, processes=None):
+    # Write the named groups of a sharded snapshot: each shard is written to its own part files by its own process,
+    # in one pass, then the parts are joined. Returns {name: (json path, csv path)}
+    processes = min(processes or os.cpu_count() or 1, len(paths))
+    args = [(path, filename_pre, incl_resolved, incl_archived, names, columns, compression, f".part-{i:03d}") for i, path in enumerate(paths)]
+    if processes <= 1:
+        parts = [write_groups_worker(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parts = list(executor.map(write_groups_worker, *zip(*args)))
+
+    group_paths = {}
+    for name, title, results_file_path_prefix, match in output_groups(filename_pre, incl_resolved, incl_archived):
+        if name not in names:
+            continue
+        group_paths[name] = (
+            join_json([part_paths[name][0] for part_paths in parts], f"{results_file_path_prefix}.json"),
+            join_csv([part_paths[name][1] for part_paths in parts], f"{results_file_path_prefix}.csv", columns, compression),
+        )
+    return group_paths
+
+
+def write_groups_worker(filename, filename_pre, incl_resolved, incl_archived, names, columns=None, compression=None, part=""):
+    # Flatten and write the findings of the named groups in one pass over the file.
+    # With part (e.g. ".part-003"), write part files to be joined later, with no CSV header.
+    # Returns {name: (json path, csv path)}
+    groups = [group for group in output_groups(filename_pre, incl_resolved, incl_archived) if group[0] in names]
+    writers = open_writers(groups, columns, compression, part)
+    try:
+        partition(iter_findings(filename), groups, writers)
+    finally:
+        for json_writer, csv_writer in writers.values():
+            json_writer.close()
+            csv_writer.close()
+    return {name: (json_writer.path, csv_writer.path) for name, (json_writer, csv_writer) in writers.items()}
+
+
+def open_writers(groups, columns=None, compression=None, part=""):
+    # JSON and CSV writer for each group
+    writers = {}
+    for name, title, results_file_path_prefix, match in groups:
+        writers[name] = (
+            JsonWriter(f"{results_file_path_prefix}{part}.json"),
+            CsvWriter(f"{results_file_path_prefix}{part}.csv", columns, compression, header=not part),
+        )
+    return writers
+
+
+def link_outputs(source_paths, results_file_path_prefix):
+    # Hard link (or copy, where links aren't supported) a group's output files under another prefix
+    json_path, csv_path = source_paths
+    csv_extension = csv_path[len(json_path) - len(".json"):] # .csv, or .csv.gz etc.
+    paths = (f"{results_file_path_prefix}.json", f"{results_file_path_prefix}{csv_extension}")
+    for source, target in zip(source_paths, paths):
+        if os.path.exists(target):
+            os.remove(target)
         try:
-            if finding['findingType'] == "ExternalAccess":
-                if incl_resolved:
-                    if incl_archived:
-                        findings_details.append(finding)
-                    else:
-                        if finding['status'] != "ARCHIVED":
-                            findings_details.append(finding)
-                else:
-                    if finding['status'] != "RESOLVED":
-                        if incl_archived:
-                            findings_details.append(finding)
-                        else:
-                            if finding['status'] != "ARCHIVED":
-                                findings_details.append(finding)
-        except:
-            pass
-    len_external = len(findings_details)
-    pf = "\nExternal findings"
-    print(f"{pf.ljust(MAX_LEN)}  : {len_external}")
-    return findings_details
-
-
-def by_status(data, status):
-    findings_details = []
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        if finding['status'] == status:
-            findings_details.append(finding)
-    len_status = len(findings_details)
-    sf = f"\n{status} findings"
-    print(f"{sf.ljust(MAX_LEN)}  : {len_status}")
-    return findings_details
-
-
-def by_owner(data):
-    findings_details = []
-    owner_list = []
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        owner_value = finding['resourceOwnerAccount']
-        owner_list.append(owner_value)
-        findings_details.append(finding)
-    owner_list = list(set(owner_list))
-    len_owner_list = len(owner_list)
-
-    uo = "Unique owners"
-    print(f"{uo.ljust(MAX_LEN)} : {len_owner_list}")
-
-
-def by_principal(data):
-    findings_details = []
-    principal_list = []
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        p = None
-        p_value = None
-        try:
-            p = finding['principal']
-        except:
-            pass
-        try:
-            p_value = p['AWS']
-            key = "aws"
-        except:
-            pass
-        try:
-            p_value = p['Federated']
-            key = "federated"
-        except:
-            pass
-        principal_list.append(p_value)
-        findings_details.append(finding)
-    principal_list = list(set(principal_list))
-    len_principal_list = len(principal_list)
-    up = "Unique principals"
-    print(f"{up.ljust(MAX_LEN)} : {len_principal_list}")
-    len_principal = len(findings_details)
-
-
-def by_resource_type(data, resource_type):
-    findings_details = []
-    resource_type_list = []
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+    return paths
+
+
+def write_manifest(filename, filename_pre, groups, contents, paths):
+    # Which files each group was written to, and which groups are the same
+    manifest_path = f"{filename_pre}-manifest.json"
+    manifest = {
+        "source": filename,
+        "groups": [
+            {
+                "name": name,
+                "count": contents[name]['count'],
+                "sha256": contents[name]['hash'],
+                "same_as": contents[name]['same_as'],
+                "json": paths[name][0],
+                "csv": paths[name][1],
+            }
+            for name, title, prefix, match in groups
+        ],
+    }
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=4)
+    return manifest_path
+
+
+def partition(data, groups, writers):
+    # Flatten each finding once and write it to every group it matches, formatted once for all of them
     for finding in data:
         finding = finding['finding'] if not TRIMMED else finding
-        resource_type_value = finding['resourceType']
-        resource_type_list.append(resource_type_value)
-        # print(resource_type_value)
-        if resource_type_value == resource_type:
-            findings_details.append(finding)
-    resource_type_list = list(set(resource_type_list))
-    len_resource_type_list = len(resource_type_list)
-    len_resource_type = len(findings_details)
-    
-    return len_resource_type_list, resource_type, len_resource_type
+        names = [name for name, title, prefix, match in groups if match(finding)]
+        if not names:
+            continue
+        record = flatten(finding)
+        text = json_text(record)
+        line = writers[names[0]][1].format(record)
+        for name in names:
+            json_writer, csv_writer = writers[name]
+            json_writer.write(record, text)
+            csv_writer.write(record, line)
 
 
 def usage(message):
@@ -196,90 +301,39 @@ def usage(message):
     exit(1)
 
 
-def write_results_json(findings_details, results_file_path_prefix):
-    '''Output to JSON'''
-    results_file = f"{results_file_path_prefix}.json"
-    findings_details_json = json.dumps(findings_details, indent=4, default=str)
-    output_file = open(results_file, "w")
-    output_file.write(findings_details_json)
-    output_file.close()
-    ext = "  json"
-    print(f"{ext.ljust(MAX_LEN)} : {results_file}")
-
-
-def write_results_csv(findings_details, results_file_path_prefix):
-    '''Output to CSV'''
-    results_file = f"{results_file_path_prefix}.csv"
-    # Define header
-    # header = "analyzedAt,createdAt,id,resource,resourceType,resourceOwnerAccount,status,updatedAt,findingDetails,findingType,x_actions,x_principal,x_condition,x_isPublic"
-    header = "analyzedAt,createdAt,id,resource,resourceType,resourceOwnerAccount,status,updatedAt,findingDetails,findingType,actions,principal,condition,isPublic"
-
-    # Write data
-    with open(results_file, "w") as file:
-        file.write(header + "\n")
-        for finding in findings_details:
-            line = ""
-            for key in header.split(","):
-                try:
-                    # replace commas in values with semicolons
-                    line += f"{finding[key].replace(',', ';')},"
-                except:
-                    line += ","
-            
-            file.write(line[:-1] + "\n")
-    file.close()
-    ext = "  csv"
-    print(f"{ext.ljust(MAX_LEN)} : {results_file}")
-
-
-def process_response(response,results_file_path_prefix):
-    # Flatten the response somewhat
-    for finding in response:
-        try:
-            finding['findingDetails'] = finding['findingDetails'][0]
-        except:
-            pass
+def flatten(finding):
+    # Flatten the finding somewhat, into a new record; the finding itself is left untouched
+    record = dict(finding)
+    try:
+        details = finding['findingDetails'][0]
+    except (KeyError, IndexError, TypeError):
+        details = finding.get('findingDetails')
+    access = details.get('externalAccessDetails') if isinstance(details, dict) else None
+    access = access if isinstance(access, dict) else {}
 
-        # Make actions list a string
-        try:
-            # finding['x_actions'] = ", ".join(finding['findingDetails']['externalAccessDetails']['action'])
-            finding['actions'] = ", ".join(finding['findingDetails']['externalAccessDetails']['action'])
-        except:
-            # finding['x_actions'] = ""
-            finding['actions'] = ""
+    # Make actions list a string
+    try:
+        record['actions'] = ", ".join(access['action'])
+    except (KeyError, TypeError):
+        record['actions'] = ""
 
-        # Make principal object key and value a string
-        try:
-            # finding['x_principal'] = f"{list(finding['findingDetails']['externalAccessDetails']['principal'].keys())[0]}: {list(finding['findingDetails']['externalAccessDetails']['principal'].values())[0]}"
-            finding['principal'] = f"{list(finding['findingDetails']['externalAccessDetails']['principal'].keys())[0]}: {list(finding['findingDetails']['externalAccessDetails']['principal'].values())[0]}"
-        except:
-            # finding['x_principal'] = ""
-            finding['principal'] = ""
+    # Make principal, condition and findingDetails object key and value a string
+    record['principal'] = first_item(access.get('principal'))
+    record['condition'] = first_item(access.get('condition'))
 
-        # Make condition object key and value a string
-        try:
-            # finding['x_condition'] = f"{list(finding['findingDetails']['externalAccessDetails']['condition'].keys())[0]}: {list(finding['findingDetails']['externalAccessDetails']['condition'].values())[0]}"
-            finding['condition'] = f"{list(finding['findingDetails']['externalAccessDetails']['condition'].keys())[0]}: {list(finding['findingDetails']['externalAccessDetails']['condition'].values())[0]}"
-        except:
-            # finding['x_condition'] = ""
-            finding['condition'] = ""
+    # Make isPublic a string
+    record['isPublic'] = str(access['isPublic']) if 'isPublic' in access else ""
 
-        # Make isPublic object key and value a string
-        try:
-            # finding['x_isPublic'] = str(finding['findingDetails']['externalAccessDetails']['isPublic'])
-            finding['isPublic'] = str(finding['findingDetails']['externalAccessDetails']['isPublic'])
-        except:
-            # finding['x_isPublic'] = ""
-            finding['isPublic'] = ""
+    record['findingDetails'] = first_item(details)
+    return record
 
-        # Make findingDetails object key and value a string
-        try:
-            finding['findingDetails'] = f"{list(finding['findingDetails'].keys())[0]}: {list(finding['findingDetails'].values())[0]}"
-        except:
-            finding['findingDetails'] = ""
 
-    write_results_json(response, results_file_path_prefix)
-    write_results_csv(response, results_file_path_prefix)
+def first_item(value):
+    # "key: value" for the first item of a dict, or "" if there isn't one
+    if not isinstance(value, dict) or not value:
+        return ""
+    key = next(iter(value))
+    return f"{key}: {value[key]}"
 
 
 if __name__ == "__main__":
@@ -288,6 +342,11 @@ if __name__ == "__main__":
 
     parser.add_argument( '--include-resolved', dest='incl_resolved', help='Included resolved findings', action='store_true') 
     parser.add_argument( '--include-archived', dest='incl_archived', help='Included archived findings', action='store_true') 
+    parser.add_argument( '--columns', dest='columns', help='Comma separated finding keys to write to the CSV files (default: all the usual columns)')
+    parser.add_argument( '--processes', dest='processes', type=int, help='Processes used to write the distinct groups, or the shards of a sharded snapshot (default: one per CPU)')
+    parser.add_argument( '--compress', dest='compress', choices=['gzip', 'zstd'], help='Compress the CSV files (.csv.gz or .csv.zst)')
+    parser.add_argument( '--metrics', dest='metrics', help='Write the run metrics (timings) here as json')
+    parser.add_argument( '--prometheus', dest='prometheus', help='Write the run metrics here in Prometheus textfile format')
 
     args = parser.parse_args()
     
@@ -311,4 +370,10 @@ if __name__ == "__main__":
     if args.incl_archived or os.getenv("INCL_ARCHIVED") == "True":
         INCL_ARCHIVED = True
 
+    CSV_COLUMNS = args.columns or os.getenv("CSV_COLUMNS") or CSV_COLUMNS
+    CSV_COMPRESSION = args.compress or os.getenv("CSV_COMPRESSION") or CSV_COMPRESSION
+    PROCESSES = args.processes or PROCESSES
+    METRICS_FILE = args.metrics or METRICS_FILE
+    PROMETHEUS_FILE = args.prometheus or PROMETHEUS_FILE
+
     main(filename)
@@ -0,0 +1,174 @@
+from finding_model import external_access
+
+OPERATORS = ("eq", "neq", "contains", "exists")
+
+
+class RuleSet:
+    '''
+    Archive rules (or any Access Analyzer filters) compiled once, to be evaluated together in one pass.
+    rules is {name: filter}, each filter in the API's syntax, e.g. {"isPublic": {"eq": ["false"]}}.
+
+    A finding's value for each key is looked up (and turned into strings) once, however many rules use the key.
+    Rules with an eq criterion are filed under its values, so a finding is only checked against those rules
+    that have one of its values (and against the rules without an eq, which are checked for every finding).
+    '''
+
+    def __init__(self, rules):
+        self.names = list(rules)
+        self.rules = [] # [(key, test)] still to check for each rule, once it's a candidate
+        self.by_value = {} # key -> value -> rules with an eq criterion for it
+        self.scanned = [] # Rules without an eq criterion
+        for i, criteria in enumerate(rules.values()):
+            checks = compile_criteria(criteria)
+            key = next((key for key, criterion in criteria.items() if list(criterion) == ["eq"]), None)
+            if key is None:
+                self.scanned.append(i)
+            else:
+                by_value = self.by_value.setdefault(key, {})
+                for value in set(criterion_values(key, criteria[key]["eq"])):
+                    by_value.setdefault(value, []).append(i)
+                checks = [(check_key, test) for check_key, test in checks if check_key != key]
+            self.rules.append(checks)
+        self.getters = {key: compile_getter(key) for key in self.by_value}
+        self.getters.update({key: compile_getter(key) for checks in self.rules for key, test in checks})
+
+    def __len__(self):
+        return len(self.rules)
+
+    def matches(self, finding):
+        # Positions (in self.names) of the rules the finding matches, in order
+        values = {}
+        for key, get in self.getters.items():
+            value = get(finding)
+            values[key] = value if value is None or type(value) is str else tuple(as_strings(value))
+
+        candidates = list(self.scanned)
+        for key, by_value in self.by_value.items():
+            value = values[key]
+            if type(value) is str:
+                candidates += by_value.get(value, ())
+            elif value is not None:
+                for item in value:
+                    candidates += by_value.get(item, ())
+
+        matched = []
+        for i in sorted(set(candidates)):
+            for key, test in self.rules[i]:
+                if not test(values[key]):
+                    break
+            else:
+                matched.append(i)
+        return matched
+
+
+def compile_filter(criteria):
+    # A predicate for one filter: finding -> bool
+    checks = [(compile_getter(key), test) for key, test in compile_criteria(criteria)]
+    if len(checks) == 1:
+        (get, test), = checks
+        return lambda finding: test(get(finding))
+    if len(checks) == 2:
+        (get1, test1), (get2, test2) = checks
+        return lambda finding: test1(get1(finding)) and test2(get2(finding))
+
+    def matches(finding):
+        for get, test in checks:
+            if not test(get(finding)):
+                return False
+        return True
+    return matches
+
+
+def compile_criteria(criteria):
+    # [(key, test)] for a filter; every test has to pass
+    if not isinstance(criteria, dict) or not criteria:
+        raise ValueError(f"A filter is a dict of key: criterion, not {criteria!r}")
+    return [(key, compile_criterion(key, criterion)) for key, criterion in criteria.items()]
+
+
+def compile_criterion(key, criterion):
+    # A test of a finding's value for one key (see compile_getter), as the API applies the criterion:
+    # eq - the value (any, for a list) is one of these; neq - it's none of these; contains - it contains
+    # any of these; exists - the key is (true) or isn't (false) there. Several operators all have to pass.
+    # Strings are tested as they are; anything else is turned into strings first (see as_strings)
+    if not isinstance(criterion, dict) or not criterion:
+        raise ValueError(f"No criterion for {key}")
+    unknown = [operator for operator in criterion if operator not in OPERATORS]
+    if unknown:
+        raise ValueError(f"Unknown operator for {key}: {', '.join(unknown)} (expected {', '.join(OPERATORS)})")
+
+    tests = []
+    if "eq" in criterion:
+        eq = frozenset(criterion_values(key, criterion["eq"]))
+        def eq_test(value):
+            if type(value) is str:
+                return value in eq
+            return value is not None and not eq.isdisjoint(as_strings(value))
+        tests.append(eq_test)
+    if "neq" in criterion:
+        neq = frozenset(criterion_values(key, criterion["neq"]))
+        def neq_test(value):
+            if type(value) is str:
+                return value not in neq
+            return value is None or neq.isdisjoint(as_strings(value))
+        tests.append(neq_test)
+    if "contains" in criterion:
+        parts = tuple(criterion_values(key, criterion["contains"]))
+        def contains_test(value):
+            if value is None:
+                return False
+            values = (value,) if type(value) is str else as_strings(value)
+            return any(part in item for item in values for part in parts)
+        tests.append(contains_test)
+    if "exists" in criterion:
+        exists = criterion["exists"] in (True, "true", "True")
+        tests.append(lambda value: (value is not None) == exists)
+
+    if len(tests) == 1:
+        return tests[0]
+    return lambda value: all(test(value) for test in tests)
+
+
+def criterion_values(key, values):
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Expected a list of values for {key}, not {values!r}")
+    return [as_string(value) for value in values]
+
+
+def compile_getter(key):
+    # finding -> its value for a filter key, or None if it hasn't the key.
+    # Keys are looked up at the top level (id, status, resourceType, resourceOwnerAccount...), then in the
+    # external access details (isPublic, action, principal, condition, sources...). A dotted key looks inside
+    # a dict: principal.AWS, condition.aws:SourceVpc
+    name, dot, sub_key = key.partition(".")
+
+    def get_value(finding):
+        value = finding.get(name)
+        if value is None:
+            value = external_access(finding).get(name)
+        return value
+    if not dot:
+        return get_value
+
+    def get_sub_value(finding):
+        value = get_value(finding)
+        return value.get(sub_key) if isinstance(value, dict) else None
+    return get_sub_value
+
+
+def as_strings(value):
+    # A value as strings, one per item of a list (e.g. action) or dict. A tuple is already strings (see RuleSet)
+    if type(value) is tuple:
+        return value
+    if isinstance(value, list):
+        return [as_string(item) for item in value]
+    if isinstance(value, dict):
+        return [as_string(item) for item in value.values()]
+    return [as_string(value)]
+
+
+def as_string(value):
+    # Values compare as the API writes them: booleans as "true" and "false"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
@@ -0,0 +1,99 @@
+from sys import intern
+
+
+class Finding:
+    '''
+    Compact view of a finding: the fields the scripts filter and count on, pulled out of the
+    get_finding_v2 response once. Repeated values (status, resource type, owner, principal...) are
+    interned, so 100k findings share a handful of strings. `data` keeps the original dict, if asked for.
+    '''
+
+    __slots__ = ("id", "status", "resource_type", "resource", "owner", "finding_type", "is_public",
+                 "principal_type", "principal", "actions", "condition", "created_at", "updated_at",
+                 "analyzed_at", "data")
+
+    def __init__(self, id, status=None, resource_type=None, resource=None, owner=None, finding_type=None,
+                 is_public=False, principal_type=None, principal=None, actions=(), condition=None,
+                 created_at=None, updated_at=None, analyzed_at=None, data=None):
+        self.id = id
+        self.status = status
+        self.resource_type = resource_type
+        self.resource = resource
+        self.owner = owner
+        self.finding_type = finding_type
+        self.is_public = is_public
+        self.principal_type = principal_type
+        self.principal = principal
+        self.actions = actions
+        self.condition = condition
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.analyzed_at = analyzed_at
+        self.data = data
+
+    @classmethod
+    def from_dict(cls, finding, keep_data=False):
+        # Build from a get_finding_v2 response (or a finding read back from a details file).
+        # This runs once per finding on every load, so it sets the slots directly rather than through __init__
+        access = external_access(finding)
+        get = finding.get
+
+        self = cls.__new__(cls)
+        self.id = get('id')
+        self.status = intern_str(get('status'))
+        self.resource_type = intern_str(get('resourceType'))
+        self.resource = get('resource')
+        self.owner = intern_str(get('resourceOwnerAccount'))
+        self.finding_type = intern_str(get('findingType'))
+        self.is_public = bool(access.get('isPublic'))
+
+        self.principal_type, self.principal = principal_of(access)
+
+        action = access.get('action')
+        self.actions = tuple(map(intern_str, action)) if isinstance(action, list) else ()
+        self.condition = access.get('condition') or None
+        self.created_at = str_or_none(get('createdAt'))
+        self.updated_at = str_or_none(get('updatedAt'))
+        self.analyzed_at = str_or_none(get('analyzedAt'))
+        self.data = finding if keep_data else None
+        return self
+
+    def __repr__(self):
+        return f"Finding({self.id!r}, {self.status!r}, {self.resource_type!r})"
+
+
+def from_dicts(findings, keep_data=False):
+    for finding in findings:
+        yield Finding.from_dict(finding, keep_data)
+
+
+def external_access(finding):
+    # findingDetails[0].externalAccessDetails, or {} if there isn't one
+    try:
+        access = finding['findingDetails'][0]['externalAccessDetails']
+    except (KeyError, IndexError, TypeError):
+        return {}
+    return access if isinstance(access, dict) else {}
+
+
+def principal_of(access):
+    # (type, value) of the principal in externalAccessDetails, e.g. ("AWS", "999988887777"), or (None, None)
+    principal = access.get('principal')
+    if not principal or not isinstance(principal, dict):
+        return None, None
+    principal_type = next(iter(principal))
+    return intern_str(principal_type), intern_str(principal[principal_type])
+
+
+def intern_str(value):
+    # Intern strings; anything else (e.g. a list of principals) becomes its str() first
+    if type(value) is str:
+        return intern(value)
+    return None if value is None else intern(str(value))
+
+
+def str_or_none(value):
+    # Timestamps are datetimes straight from the API, but strings once read back from a file
+    if type(value) is str or value is None:
+        return value
+    return str(value)
@@ -0,0 +1,186 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import boto3
+import botocore.config
+from rate_limiter import RETRIED_ERRORS
+from run_metrics import eta
+
+WORKERS = 1 # Number of concurrent get_finding_v2 calls
+PIPELINE_PAGES = 10 # With --pipeline, how many listed pages can wait to be fetched
+
+
+def new_client(workers, region=None):
+    # Size the connection pool to the number of workers (botocore defaults to 10).
+    # Retries are handled by RateLimiter, so turn off botocore's own.
+    config = botocore.config.Config(
+        max_pool_connections=max(10, workers),
+        retries={'total_max_attempts': 1}
+    )
+    return boto3.client('accessanalyzer', region_name=region, config=config)
+
+
+def build_filter(filters):
+    # Turn {"status": "ACTIVE,ARCHIVED", ...} into list_findings filter criteria,
+    # so the filtering is done by Access Analyzer rather than after listing
+    criteria = {}
+    for key, value in filters.items():
+        if value is None:
+            continue
+        criteria[key] = {"eq": [v.strip() for v in str(value).split(",")]}
+    return criteria
+
+
+def filter_suffix(filters):
+    # File name suffix describing the filters, e.g. "-ACTIVE-AWS_S3_Bucket-public"
+    suffix = ""
+    for key in ["status", "resourceType", "resourceOwnerAccount"]:
+        if filters.get(key):
+            suffix += "-" + filters[key].replace("::", "_").replace(",", "+")
+    if filters.get("isPublic"):
+        suffix += "-public" if filters["isPublic"] == "true" else "-not_public"
+    return suffix
+
+
+def list_all_findings(accessanalyzer, arn, limiter, criteria=None, checkpoint=None):
+    # List all findings, with pagination
+    findings = {"findings": []}
+    for page in iter_pages(accessanalyzer, arn, limiter, criteria, checkpoint):
+        findings["findings"] += page
+    return findings
+
+
+def list_findings_pipelined(accessanalyzer, arn, limiter, criteria=None, checkpoint=None):
+    # List findings in a background thread, yielding them as each page arrives.
+    # At most PIPELINE_PAGES pages are queued, so listing waits if fetching falls behind.
+    pages = queue.Queue(maxsize=PIPELINE_PAGES)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for page in iter_pages(accessanalyzer, arn, limiter, criteria, checkpoint):
+                put(page)
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            page = pages.get()
+            if page is None:
+                return
+            if isinstance(page, BaseException):
+                raise page
+            yield from page
+    finally:
+        # Stops the listing thread if we finish early (e.g. --limit)
+        stop.set()
+
+
+def iter_pages(accessanalyzer, arn, limiter, criteria=None, checkpoint=None):
+    # Yield pages of listed findings, with pagination.
+    # With a checkpoint, start with what was already listed (and is still in its state) and record progress as we go.
+    kwargs = {"analyzerArn": arn}
+    if criteria:
+        kwargs["filter"] = criteria
+
+    state = checkpoint.state if checkpoint else {"listed": [], "next_token": None, "listing_complete": False}
+    lock = checkpoint.lock if checkpoint else threading.Lock()
+    if state["listed"]:
+        yield list(state["listed"])
+    if state["listing_complete"]:
+        return
+
+    next_token = state["next_token"]
+    while True:
+        if next_token:
+            page = limiter.call(accessanalyzer.list_findings, nextToken=next_token, **kwargs)
+        else:
+            page = limiter.call(accessanalyzer.list_findings, **kwargs)
+        # Only keep what's needed to fetch and compare findings
+        entries = [
+            {"id": f["id"], "status": f.get("status"), "updatedAt": str(f.get("updatedAt"))}
+            for f in page["findings"]
+        ]
+        next_token = page.get("nextToken")
+        with lock:
+            state["listed"] += entries
+            state["next_token"] = next_token
+        yield entries
+        if not next_token:
+            break
+        if checkpoint:
+            checkpoint.save()
+
+    state["listing_complete"] = True
+    if checkpoint:
+        checkpoint.save(force=True)
+
+
+def get_finding(accessanalyzer, arn, finding_id, position, limiter):
+    # Get a single finding, retrying per the limiter's budget. Returns None if it still fails
+    try:
+        return limiter.call(accessanalyzer.get_finding_v2, id=finding_id, analyzerArn=arn)
+    except RETRIED_ERRORS as e:
+        print(f"\nError at position {position}: {e}")
+        return None
+
+
+def fetch_in_order(accessanalyzer, arn, findings, limiter, workers=WORKERS, progress=True, total=None):
+    # Get the details of each (finding_id, previous) pair, running up to `workers` calls at once.
+    # If previous is given it's used as is, without calling the API.
+    # Yields (finding_id, result) in the same order as findings, regardless of completion order;
+    # result is None if the finding could not be fetched.
+    # Only a few calls per worker are queued ahead, so memory stays flat.
+    workers = max(1, workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    position = 0
+    of_total = f" of {total}" if total is not None else ""
+    started = time.perf_counter()
+
+    def next_result():
+        finding_id, future = pending.popleft()
+        # Print progress over the same line, with the rate so far and time left
+        if progress:
+            progress_eta = eta(position - 1, total, time.perf_counter() - started)
+            print(f"Getting finding {position}{of_total}{progress_eta}    \r", end="") # \r is carriage return, end="" to avoid newline
+        return finding_id, future.result()
+
+    try:
+        for finding_id, previous in findings:
+            if previous is not None:
+                future = Future()
+                future.set_result(previous)
+            else:
+                future = executor.submit(get_finding, accessanalyzer, arn, finding_id, len(pending) + position + 1, limiter)
+            pending.append((finding_id, future))
+            if len(pending) < workers * 4:
+                continue
+            position += 1
+            yield next_result()
+        while pending:
+            position += 1
+            yield next_result()
+    finally:
+        # Don't start queued calls if we stopped early (e.g. Ctrl-C)
+        executor.shutdown(wait=True, cancel_futures=True)
+    if position and progress:
+        print()
+
+
+def trim_response_metadata(finding):
+    finding.pop("ResponseMetadata", None)
+    return finding
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from array import array
+
+INDEX_EXTENSION = ".idx"
+MAGIC = b"IAAIDX01"
+HEADER = struct.Struct("<8sQQQQ") # magic, snapshot size, snapshot mtime_ns, findings, log2(slots)
+SLOT = struct.Struct("<QQI") # id hash, offset, length (0 for an empty slot)
+
+
+class IndexBuilder:
+    '''
+    Collects the position of each finding as a writer writes it, then saves them as the index of the file.
+    Entries are kept in arrays (20 bytes a finding), not as Python objects.
+    A file that's being continued (complete=False) is scanned instead when it's written, for the findings before.
+    '''
+
+    def __init__(self, complete=True):
+        self.complete = complete
+        self.hashes = array("Q")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+
+    def add(self, finding_id, offset, length):
+        self.hashes.append(id_hash(finding_id))
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def write(self, filename):
+        if not self.complete:
+            return write_index(filename, *scan(filename))
+        return write_index(filename, self.hashes, self.offsets, self.lengths)
+
+
+class FindingsIndex:
+    '''
+    Random access to the findings of a details file (json or ndjson) by id, through its index sidecar
+    (<details file>.idx): an open addressing hash table of id -> (offset, length), memory-mapped along
+    with the details file. A lookup reads one slot (rarely a few) and parses just that finding.
+
+    The index is built by scanning the file if it's missing or the file has changed since
+    (size or modification time). A sharded snapshot has an index per shard.
+    Changes logged for the file but not yet written into it (findings_io.read_changes) are looked up first.
+    '''
+
+    def __init__(self, filename, rebuild=False):
+        self.filename = filename
+        self.built = False
+        self.file = self.data = None
+        self.index_file = self.index = None
+        from findings_io import read_changes
+        self.changes = read_changes(filename)
+
+        stat = os.stat(filename)
+        path = index_path(filename)
+        if rebuild or not is_current(path, stat):
+            hashes, offsets, lengths = scan(filename)
+            write_index(filename, hashes, offsets, lengths)
+            self.built = True
+
+        self.index_file = open(path, "rb")
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, mtime_ns, self.count, bits = HEADER.unpack_from(self.index, 0)
+        self.mask = (1 << bits) - 1
+        self.shift = 64 - bits
+        if stat.st_size:
+            self.file = open(filename, "rb")
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def candidates(self, finding_id):
+        # (offset, length) in the file of each slot with the id's hash: one, if the id is there at all, bar collisions
+        key = id_hash(finding_id)
+        slot = key >> self.shift
+        while True:
+            slot_hash, offset, length = SLOT.unpack_from(self.index, HEADER.size + slot * SLOT.size)
+            if length == 0:
+                return
+            if slot_hash == key:
+                yield offset, length
+            slot = (slot + 1) & self.mask
+
+    def get(self, finding_id):
+        # The finding with this id, or None. Ids are compared too, in case two ids share a hash
+        if finding_id in self.changes:
+            return self.changes[finding_id]
+        for offset, length in self.candidates(finding_id):
+            finding = json.loads(self.data[offset:offset + length])
+            if finding['id'] == finding_id:
+                return finding
+        return None
+
+    def locate(self, finding_id):
+        # (offset, length) of a finding in the file, or None, for tools that read the file themselves
+        for offset, length in self.candidates(finding_id):
+            if json.loads(self.data[offset:offset + length])['id'] == finding_id:
+                return offset, length
+        return None
+
+    def get_many(self, finding_ids):
+        # {id: finding} of the ids found
+        findings = {}
+        for finding_id in finding_ids:
+            finding = self.get(finding_id)
+            if finding is not None:
+                findings[finding_id] = finding
+        return findings
+
+    def close(self):
+        for resource in [self.data, self.file, self.index, self.index_file]:
+            if resource is not None:
+                resource.close()
+
+
+class ShardedIndex:
+    '''
+    FindingsIndex over a sharded snapshot: each id is looked up in the index of its own shard.
+    '''
+
+    def __init__(self, filename, rebuild=False):
+        from findings_io import shard_paths
+        self.filename = filename
+        self.shards = [FindingsIndex(path, rebuild) for path in shard_paths(filename)]
+        self.built = any(shard.built for shard in self.shards)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, finding_id):
+        from findings_io import shard_of
+        return self.shards[shard_of(finding_id, len(self.shards))].get(finding_id)
+
+    def get_many(self, finding_ids):
+        findings = {}
+        for finding_id in finding_ids:
+            finding = self.get(finding_id)
+            if finding is not None:
+                findings[finding_id] = finding
+        return findings
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def open_index(filename, rebuild=False):
+    from findings_io import is_sharded
+    return ShardedIndex(filename, rebuild) if is_sharded(filename) else FindingsIndex(filename, rebuild)
+
+
+def id_hash(finding_id):
+    return int.from_bytes(hashlib.blake2b(finding_id.encode(), digest_size=8).digest(), "big")
+
+
+def index_path(filename):
+    return f"{filename}{INDEX_EXTENSION}"
+
+
+def is_current(path, stat):
+    # Whether an index exists and was written for the file as it is now
+    try:
+        with open(path, "rb") as file:
+            header = file.read(HEADER.size)
+    except OSError:
+        return False
+    if len(header) < HEADER.size:
+        return False
+    magic, size, mtime_ns, count, bits = HEADER.unpack(header)
+    return magic == MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+
+def write_index(filename, hashes, offsets, lengths):
+    # Save the positions of the findings in filename as its index, stamped with the file's size and modification time.
+    # Slots are found from the top bits of the hash (the shard is picked from the bottom ones), half of them left empty
+    stat = os.stat(filename)
+    count = len(hashes)
+    bits = max(4, (2 * count - 1).bit_length())
+    shift = 64 - bits
+    mask = (1 << bits) - 1
+    table = bytearray(HEADER.size + (SLOT.size << bits))
+    HEADER.pack_into(table, 0, MAGIC, stat.st_size, stat.st_mtime_ns, count, bits)
+    lengths_at = HEADER.size + 16 # Position of the length within slot 0
+    for key, offset, length in zip(hashes, offsets, lengths):
+        slot = key >> shift
+        while table[lengths_at + slot * SLOT.size:lengths_at + slot * SLOT.size + 4] != b"\0\0\0\0":
+            slot = (slot + 1) & mask
+        SLOT.pack_into(table, HEADER.size + slot * SLOT.size, key, offset, length)
+
+    path = index_path(filename)
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(table)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def scan(filename):
+    # (hashes, offsets, lengths) of the findings in a json or ndjson file, found by reading it through.
+    # Read as latin-1, so each character is one byte and positions are byte offsets
+    from findings_io import iter_json_array
+    builder = IndexBuilder()
+    with open(filename, "r", encoding="latin-1", newline="") as file:
+        start = 0
+        first = file.read(1)
+        while first.isspace():
+            start += 1
+            first = file.read(1)
+        if first == "[":
+            for finding, offset, end in iter_json_array(file, start + 1):
+                builder.add(finding['id'], offset, end - offset)
+        else:
+            file.seek(0)
+            offset = 0
+            for line in file:
+                stripped = line.strip()
+                if stripped:
+                    builder.add(json.loads(stripped)['id'], offset + len(line) - len(line.lstrip()), len(stripped))
+                offset += len(line)
+    return builder.hashes, builder.offsets, builder.lengths
@@ -0,0 +1,390 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+from findings_index import IndexBuilder, id_hash
+from findings_store import FindingsStore, is_store
+
+READ_SIZE = 1024 * 1024 # Characters read at a time when streaming a JSON array
+WRITE_BUFFER = 1024 * 1024 # Bytes buffered before writing CSV output
+GZIP_LEVEL = 3 # Half the time of level 6, for files about a fifth larger
+
+# Default CSV columns, in order
+CSV_COLUMNS = "analyzedAt,createdAt,id,resource,resourceType,resourceOwnerAccount,status,updatedAt,findingDetails,findingType,actions,principal,condition,isPublic"
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+SHARDS_EXTENSION = ".shards.json" # A sharded snapshot is read through its manifest, e.g. <...>.details.shards.json
+CHANGES_EXTENSION = ".changes.ndjson" # Changes to a details file not yet written into it (see ingest_events.SnapshotLog)
+
+
+class JsonWriter:
+    '''
+    Writes findings as a JSON array, one finding at a time.
+    The output is identical to json.dumps(findings, indent=4, default=str).
+
+    offset is the size of the file up to the end of the last finding written.
+    Pass offset and count back in to continue an interrupted file.
+    With index=True, also write the position of each finding to <path>.idx (see findings_index).
+    '''
+
+    def __init__(self, path, offset=None, count=0, index=False):
+        self.path = path
+        self.file = open_for_append(path, offset)
+        self.offset = offset or 0
+        self.count = count
+        self.index = IndexBuilder(complete=not count) if index else None
+
+    def write(self, finding, text=None):
+        # text is the finding as json_text() formats it, if it's already been formatted (e.g. to write to several files)
+        text = text or json_text(finding)
+        separator = "[\n" if self.count == 0 else ",\n"
+        self.file.write(separator + text)
+        if self.index:
+            # From the finding's opening brace, after the indent, as when the file is scanned
+            self.index.add(finding['id'], self.offset + len(separator) + 4, len(text) - 4)
+        self.offset += len(separator) + len(text) # json.dumps output is ASCII, so characters == bytes
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.write("\n]" if self.count else "[]")
+        self.file.close()
+        if self.index:
+            self.index.write(self.path)
+
+
+class NdjsonWriter:
+    '''
+    Writes findings as newline delimited JSON, one finding per line, flushed as it goes.
+    With index=True, also write the position of each finding to <path>.idx (see findings_index).
+    '''
+
+    def __init__(self, path, offset=None, count=0, index=False):
+        self.path = path
+        self.file = open_for_append(path, offset)
+        self.offset = offset or 0
+        self.count = count
+        self.index = IndexBuilder(complete=not count) if index else None
+
+    def write(self, finding):
+        text = json.dumps(finding, default=str)
+        self.file.write(text + "\n")
+        self.file.flush()
+        if self.index:
+            self.index.add(finding['id'], self.offset, len(text))
+        self.offset += len(text) + 1
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        if self.index:
+            self.index.write(self.path)
+
+
+class ShardedWriter:
+    '''
+    Writes findings to `shards` ndjson files, each finding to the shard picked by a hash of its id,
+    and a manifest listing them (path, ending .shards.json). iter_findings() reads the manifest as one file;
+    summarise_findings.py and extract_findings.py process the shards in parallel.
+
+    offset is a list of [offset, count] for each shard. Pass it and count back in to continue an interrupted run.
+    With index=True, each shard gets its own index.
+    '''
+
+    def __init__(self, path, shards, offset=None, count=0, index=False):
+        self.path = path
+        self.paths = [f"{path[:-len(SHARDS_EXTENSION)]}.{i:03d}-of-{shards:03d}.ndjson" for i in range(shards)]
+        offsets = offset or [[None, 0]] * shards
+        self.writers = [NdjsonWriter(shard_path, shard_offset, shard_count, index) for shard_path, (shard_offset, shard_count) in zip(self.paths, offsets)]
+        self.count = count
+        self.write_manifest() # Written first too, so a partial snapshot can already be read
+
+    @property
+    def offset(self):
+        return [[writer.offset, writer.count] for writer in self.writers]
+
+    def write(self, finding):
+        self.writers[shard_of(finding['id'], len(self.writers))].write(finding)
+        self.count += 1
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        self.write_manifest()
+
+    def write_manifest(self):
+        manifest = {
+            "count": self.count,
+            "shards": [{"path": os.path.basename(writer.path), "count": writer.count} for writer in self.writers],
+        }
+        with open(f"{self.path}.tmp", "w") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+class CsvWriter:
+    '''
+    Writes findings as CSV rows, quoted as csv.writer would (so commas, quotes and newlines in values survive),
+    with large buffered writes and optional gzip or zstd compression. Lines end with \n.
+    columns is a list or comma separated string of finding keys; missing keys are left empty.
+    With header=False, the column names aren't written (for parts that are joined later, see join_csv).
+    '''
+
+    def __init__(self, path, columns=None, compression=None, header=True):
+        self.path = path + COMPRESSION_EXTENSIONS[compression]
+        self.columns = (columns or CSV_COLUMNS)
+        self.columns = self.columns.split(",") if isinstance(self.columns, str) else list(self.columns)
+        self.file = open_text(self.path, compression)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+        self.separators = len(self.columns) - 1
+        if header:
+            self.file.write(self.format_row(self.columns))
+        self.count = 0
+
+    def write(self, finding, line=None):
+        # line is the finding as format() formats it, if it's already been formatted (e.g. to write to several files)
+        self.file.write(line or self.format(finding))
+        self.count += 1
+
+    def format(self, finding):
+        # The finding's CSV line. Rows of strings without quotes or newlines (nearly all of them) are joined here,
+        # quoting the values with commas, which is twice as fast as csv.writer. Anything else goes through csv.writer,
+        # which writes None as an empty string and str() of anything that isn't a string
+        values = list(map(finding.get, self.columns))
+        try:
+            line = ",".join(values)
+        except TypeError:
+            return self.format_row(values)
+        if '"' in line or "\n" in line or "\r" in line or not self.separators:
+            return self.format_row(values)
+        if line.count(",") != self.separators:
+            line = ",".join([f'"{value}"' if "," in value else value for value in values])
+        return line + "\n"
+
+    def format_row(self, values):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.writer.writerow(values)
+        return self.buffer.getvalue()
+
+    def close(self):
+        self.file.close()
+
+
+def json_text(finding):
+    # A finding as JsonWriter writes it: json.dumps(indent=4) of it, indented as an item of the array
+    text = json.dumps(finding, indent=4, default=str)
+    return "\n".join("    " + line for line in text.split("\n"))
+
+
+def open_text(path, compression=None):
+    # Buffered text file for writing, optionally compressed
+    if compression is None:
+        return open(path, "w", newline="", buffering=WRITE_BUFFER)
+    if compression == "gzip":
+        return io.TextIOWrapper(io.BufferedWriter(gzip.open(path, "wb", compresslevel=GZIP_LEVEL), WRITE_BUFFER), newline="")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit("zstd compression needs the zstandard package: pip install zstandard")
+        raw = open(path, "wb")
+        return io.TextIOWrapper(io.BufferedWriter(zstandard.ZstdCompressor().stream_writer(raw), WRITE_BUFFER), newline="")
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def open_writer(path, offset=None, count=0, shards=None, index=False):
+    if is_sharded(path):
+        return ShardedWriter(path, shards, offset, count, index)
+    writer = NdjsonWriter if path.endswith(".ndjson") else JsonWriter
+    return writer(path, offset, count, index)
+
+
+def open_for_append(path, offset):
+    # New file, or an existing one cut back to offset (dropping anything after the last complete finding)
+    if offset is None:
+        return open(path, "w")
+    file = open(path, "r+")
+    file.truncate(offset)
+    file.seek(offset)
+    return file
+
+
+def iter_findings(filename):
+    # Yield findings one at a time from a JSON array or NDJSON file (or a findings store),
+    # without reading the whole file into memory
+    if is_store(filename):
+        store = FindingsStore(filename)
+        try:
+            yield from store.iter_findings()
+        finally:
+            store.close()
+        return
+    if is_sharded(filename):
+        for shard_path in shard_paths(filename):
+            yield from iter_findings(shard_path)
+        return
+    if has_changes(filename):
+        # Findings changed since the file was written replace theirs, deleted ones are left out and new ones come last
+        changes = read_changes(filename)
+        for finding in iter_details(filename):
+            if finding['id'] in changes:
+                finding = changes.pop(finding['id'])
+                if finding is None:
+                    continue
+            yield finding
+        yield from (finding for finding in changes.values() if finding is not None)
+        return
+    yield from iter_details(filename)
+
+
+def iter_details(filename):
+    # The findings of a JSON array or NDJSON file as they are in it
+    with open(filename, 'r') as file:
+        first = file.read(1)
+        while first.isspace():
+            first = file.read(1)
+        if first == "[":
+            yield from iter_json_array(file)
+            return
+        file.seek(0)
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_json_array(file, position=None):
+    # Decode one array element at a time from a file positioned just after the opening "[".
+    # Given that position (in characters), yield (finding, start, end) with each element's place in the file
+    decoder = json.JSONDecoder()
+    buffer = ""
+    base = position or 0 # Position of buffer[0] in the file
+    pos = 0
+    eof = False
+    while True:
+        # Skip whitespace and separators between elements
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            base += len(buffer)
+            buffer, pos = file.read(READ_SIZE), 0
+            eof = not buffer
+        if pos >= len(buffer):
+            raise json.JSONDecodeError("Expecting ']' at end of file", buffer, pos)
+        if buffer[pos] == "]":
+            return
+        try:
+            finding, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Element is split across reads: read more and try again
+            if eof:
+                raise
+            more = file.read(READ_SIZE)
+            eof = not more
+            base += pos
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield finding if position is None else (finding, base + pos, base + end)
+        pos = end
+
+
+def is_sharded(filename):
+    return filename.endswith(SHARDS_EXTENSION)
+
+
+def shard_of(finding_id, shards):
+    # The same shard for an id on every run and in every process (unlike hash(), which is salted per process)
+    return id_hash(finding_id) % shards
+
+
+def shard_paths(filename):
+    # The shard files listed in a manifest, relative to the manifest
+    with open(filename, "r") as file:
+        manifest = json.load(file)
+    directory = os.path.dirname(filename)
+    return [os.path.join(directory, shard["path"]) for shard in manifest["shards"]]
+
+
+def changes_path(filename):
+    return f"{filename}{CHANGES_EXTENSION}"
+
+
+def has_changes(filename):
+    return os.path.exists(changes_path(filename))
+
+
+def read_changes(filename):
+    # {id: finding, or None if it was deleted} of the changes logged for a details file, the latest for each id
+    changes = {}
+    try:
+        file = open(changes_path(filename), "r")
+    except FileNotFoundError:
+        return changes
+    with file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # A line cut off by a crash while it was appended, or a blank one
+            changes[record['id']] = None if record.get('deleted') else record
+    return changes
+
+
+def snapshot_size(filename):
+    # Size on disk of a details file, or of all its shards
+    if is_sharded(filename):
+        return sum(os.path.getsize(shard_path) for shard_path in shard_paths(filename))
+    return os.path.getsize(filename)
+
+
+def join_json(part_paths, path):
+    # Join JSON arrays written by JsonWriter into one array, as JsonWriter would have written it, and remove the parts
+    first = True
+    with open(path, "wb") as output:
+        for part_path in part_paths:
+            size = os.path.getsize(part_path)
+            if size > len("[]"):
+                # Copy the elements, between the "[\n" and "\n]"
+                with open(part_path, "rb") as part:
+                    part.seek(2)
+                    output.write(b"[\n" if first else b",\n")
+                    copy_bytes(part, output, size - 4)
+                first = False
+            os.remove(part_path)
+        output.write(b"[]" if first else b"\n]")
+    return path
+
+
+def join_csv(part_paths, path, columns=None, compression=None):
+    # Join CSV parts written with header=False under one header row, and remove the parts.
+    # Compressed parts are joined as they are: gzip members and zstd frames can follow one another in a file
+    header = CsvWriter(path, columns, compression)
+    header.close()
+    with open(header.path, "ab") as output:
+        for part_path in part_paths:
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, output, WRITE_BUFFER)
+            os.remove(part_path)
+    return header.path
+
+
+def copy_bytes(source, target, length):
+    while length > 0:
+        chunk = source.read(min(WRITE_BUFFER, length))
+        if not chunk:
+            break
+        target.write(chunk)
+        length -= len(chunk)
@@ -0,0 +1,157 @@
+import json
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS findings (
+    id                     TEXT PRIMARY KEY,
+    status                 TEXT,
+    resourceType           TEXT,
+    resource               TEXT,
+    resourceOwnerAccount   TEXT,
+    findingType            TEXT,
+    isPublic               INTEGER,
+    principalType          TEXT,
+    principal              TEXT,
+    createdAt              TEXT,
+    updatedAt              TEXT,
+    analyzedAt             TEXT,
+    data                   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS findings_status ON findings (status);
+CREATE INDEX IF NOT EXISTS findings_resourceType ON findings (resourceType);
+CREATE INDEX IF NOT EXISTS findings_resourceOwnerAccount ON findings (resourceOwnerAccount);
+CREATE INDEX IF NOT EXISTS findings_isPublic ON findings (isPublic, status);
+CREATE INDEX IF NOT EXISTS findings_principal ON findings (principal);
+CREATE INDEX IF NOT EXISTS findings_updatedAt ON findings (updatedAt);
+"""
+
+COLUMNS = ["id", "status", "resourceType", "resource", "resourceOwnerAccount", "findingType", "isPublic",
+           "principalType", "principal", "createdAt", "updatedAt", "analyzedAt", "data"]
+
+# query() argument -> column
+QUERY_COLUMNS = {
+    "status": "status",
+    "resource_type": "resourceType",
+    "owner_account": "resourceOwnerAccount",
+    "is_public": "isPublic",
+    "principal": "principal",
+    "finding_type": "findingType",
+}
+
+
+class FindingsStore:
+    '''
+    SQLite store of findings, one row per finding id (the latest version of it).
+    After a complete run, the findings the analyzer no longer lists are removed (see remove_unlisted).
+    The full finding is kept as JSON in `data`; the fields we filter on get their own indexed columns.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def upsert(self, finding):
+        self.db.execute(
+            f"INSERT OR REPLACE INTO findings ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            to_row(finding)
+        )
+
+    def upsert_many(self, findings):
+        self.db.executemany(
+            f"INSERT OR REPLACE INTO findings ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            (to_row(finding) for finding in findings)
+        )
+        self.commit()
+
+    def delete_many(self, finding_ids):
+        self.db.executemany("DELETE FROM findings WHERE id = ?", ((finding_id,) for finding_id in finding_ids))
+        self.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def remove_unlisted(self, finding_ids):
+        # Delete the findings that aren't in finding_ids (everything a complete run listed), as the analyzer no longer has them.
+        # Returns the ids deleted
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS listed (id TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM listed")
+        self.db.executemany("INSERT OR IGNORE INTO listed (id) VALUES (?)", ((finding_id,) for finding_id in finding_ids))
+        removed = [row[0] for row in self.db.execute("SELECT id FROM findings WHERE id NOT IN (SELECT id FROM listed)")]
+        self.db.execute("DELETE FROM findings WHERE id NOT IN (SELECT id FROM listed)")
+        self.db.execute("DROP TABLE listed")
+        self.commit()
+        return removed
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM findings").fetchone()[0]
+
+    def get(self, finding_id):
+        # The finding with this id, or None
+        row = self.db.execute("SELECT data FROM findings WHERE id = ?", (finding_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, updated_since=None, limit=None, **filters):
+        # Findings matching every given filter, e.g. query(status="ACTIVE", is_public=True, owner_account="112233445566")
+        where = []
+        params = []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in QUERY_COLUMNS:
+                raise ValueError(f"Unknown filter: {key}")
+            where.append(f"{QUERY_COLUMNS[key]} = ?")
+            params.append(int(value) if key == "is_public" else value)
+        if updated_since:
+            where.append("updatedAt >= ?")
+            params.append(str(updated_since))
+
+        sql = "SELECT data FROM findings"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY rowid"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        for (data,) in self.db.execute(sql, params):
+            yield json.loads(data)
+
+    def iter_findings(self):
+        return self.query()
+
+
+def to_row(finding):
+    try:
+        access = finding['findingDetails'][0]['externalAccessDetails']
+    except (KeyError, IndexError, TypeError):
+        access = {}
+    principal = access.get('principal') or {}
+    principal_type = next(iter(principal), None)
+    is_public = access.get('isPublic')
+
+    return (
+        finding['id'],
+        finding.get('status'),
+        finding.get('resourceType'),
+        finding.get('resource'),
+        finding.get('resourceOwnerAccount'),
+        finding.get('findingType'),
+        None if is_public is None else int(bool(is_public)),
+        principal_type,
+        str(principal[principal_type]) if principal_type else None,
+        none_or_str(finding.get('createdAt')),
+        none_or_str(finding.get('updatedAt')),
+        none_or_str(finding.get('analyzedAt')),
+        json.dumps(finding, default=str),
+    )
+
+
+def none_or_str(value):
+    return None if value is None else str(value)
+
+
+def is_store(filename):
+    return filename.endswith(".db") or filename.endswith(".sqlite")
@@ -1,20 +1,43 @@
 #!/usr/bin/env python3
 
 import json
-import boto3
-import botocore
 import argparse
+import glob
 import os
+import threading
 import time
+from concurrent.futures import as_completed
 from datetime import datetime
+from itertools import islice
+from finding_model import Finding
+from findings_fetch import WORKERS, build_filter, fetch_in_order, filter_suffix, list_all_findings, list_findings_pipelined, new_client, trim_response_metadata
+from findings_io import SHARDS_EXTENSION, iter_findings, open_writer, snapshot_size
+from findings_store import FindingsStore
+from rate_limiter import MAX_RATE, RateLimiter
+from run_metrics import RunMetrics
+from summarise_findings import Summary, write_sidecar
 
 NOW = datetime.now().strftime("%Y%m%d-%H%M")
 DEBUG = False
+CHECKPOINT_SECONDS = 30 # How often to save progress for --resume
+
+
+def main(arn,limit,workers=WORKERS,previous_file=None,filters=None,ndjson=False,resume=None,store_path=None,pipeline=False,metrics_path=None,prometheus_path=None,shards=None,rate=None,max_rate=None):
+    checkpoint = None
+    if resume:
+        # Carry on with the settings of the interrupted run
+        checkpoint = Checkpoint.load(resume)
+        arn = checkpoint.state['arn']
+        limit = checkpoint.state['limit']
+        previous_file = checkpoint.state['previous_file']
+        filters = checkpoint.state['filters']
+        store_path = checkpoint.state.get('store_path')
+        pipeline = checkpoint.state.get('pipeline', False)
+        shards = checkpoint.state.get('shards')
+        checkpoint.state.setdefault('listed_from', 0)
+        print(f"Resuming from {resume}\n")
+    limited = limit != "None"
 
-accessanalyzer = boto3.client('accessanalyzer')
-
-
-def main(arn,limit):
     if not arn.startswith("arn:aws:access-analyzer:"):
         print("No valid ARN provided")
         usage()
@@ -26,85 +49,539 @@ def main(arn,limit):
     d_print(f"Account ID: {account_id}")
     d_print(f"Analyzer:   {analyzer}")
 
-    suffix = ""
-    results_file_path = f"{NOW}-{account_id}-{analyzer}{suffix}.details.json"
+    filters = filters or {}
+    suffix = filter_suffix(filters)
+    extension = "ndjson" if ndjson else "json"
+    results_file_path = f"{NOW}-{account_id}-{analyzer}{suffix}.details.{extension}"
+    if shards:
+        # Shards are ndjson files, listed in a manifest that stands in for the details file
+        results_file_path = f"{NOW}-{account_id}-{analyzer}{suffix}.details{SHARDS_EXTENSION}"
+
+    if previous_file == "latest":
+        previous_file = find_previous(account_id, analyzer, suffix)
+
+    if checkpoint:
+        results_file_path = checkpoint.state['results_file_path']
+    else:
+        checkpoint = Checkpoint(f"{results_file_path}.checkpoint", {
+            "arn": arn,
+            "limit": limit,
+            "previous_file": previous_file,
+            "filters": filters,
+            "results_file_path": results_file_path,
+            "store_path": store_path,
+            "pipeline": pipeline,
+            "shards": shards,
+            "listed": [],
+            "listed_from": 0,
+            "next_token": None,
+            "listing_complete": False,
+            "done": 0,
+            "written": 0,
+            "offset": None,
+            "failed": [],
+            "summary": None,
+        })
 
     d_print(f"results_file_path: {results_file_path}")
 
     print (f"Getting all findings for {analyzer} (account {account_id})\n")
 
-    data = list_all_findings(arn)
-
-    total_findings = len(data['findings'])
-    print(f"Total findings:    {total_findings}")
-
-    # Iterate over the full findings, storing the results in the list
-    full_findings_list = []
-    for finding in data['findings']:
-        full_findings_list.append(finding['id'])
-
-    full_findings_details = []
-    full_findings_list_len = len(full_findings_list)
-    limit = full_findings_list_len if limit == "None" else int(limit)
+    metrics = RunMetrics("get_all_findings")
+    accessanalyzer = new_client(workers, arn.split(":")[3])
+    limiter = RateLimiter(rate=rate, max_rate=max_rate, workers=workers, metrics=metrics)
+
+    try:
+        if filters:
+            print(f"Filters:           {filters}")
+        with metrics.phase("load_previous"):
+            previous = load_previous(previous_file) if previous_file else {}
+        removed = None
+
+        if pipeline:
+            # Start fetching as soon as the first page is listed
+            # Only what's listed but not yet written is kept (see Checkpoint.drop_written)
+            listed = list_findings_pipelined(accessanalyzer, arn, limiter, build_filter(filters), checkpoint)
+            if limit != "None":
+                listed = islice(listed, int(limit) - checkpoint.state['listed_from'])
+            total = None
+        else:
+            with metrics.phase("list"):
+                data = list_all_findings(accessanalyzer, arn, limiter, build_filter(filters), checkpoint)
+
+            total_findings = len(data['findings'])
+            print(f"Total findings:    {total_findings}")
+
+            listed = data['findings']
+            limit = len(listed) if limit == "None" else int(limit)
+            if limit != len(listed):
+                print(f"Limiting to {limit}\n")
+                listed = listed[:limit]
+
+            # Incremental: only fetch findings that are new or changed since the previous run
+            if previous_file:
+                to_fetch, unchanged, removed = diff_listing(listed, previous)
+                print_incremental(previous_file, previous, len(unchanged), len(to_fetch), removed)
+            total = len(listed)
+
+        # When resuming, skip the findings already written
+        done = checkpoint.state['done']
+        if done:
+            print(f"Already done:      {done}\n")
+        remaining = islice(listed, done - checkpoint.state['listed_from'], None)
+
+        # Pair each listed finding with the previous version of it if unchanged, or None to fetch it
+        counts = {"listed": done, "unchanged": 0}
+        seen = set()
+        def with_previous(listed):
+            for finding in listed:
+                counts["listed"] += 1
+                if previous:
+                    seen.add(finding['id'])
+                if is_unchanged(finding, previous):
+                    counts["unchanged"] += 1
+                    yield finding['id'], previous_finding(previous, finding['id'])
+                else:
+                    yield finding['id'], None
+
+        findings = fetch_in_order(accessanalyzer, arn, with_previous(remaining), limiter, workers, total=None if total is None else total - done)
+
+        # Count everything summarise_findings.py shows as we go, rather than reading the file back later
+        summary = Summary.from_dict(checkpoint.state['summary']) if checkpoint.state.get('summary') else Summary()
+        store = FindingsStore(store_path) if store_path else None
+        with metrics.phase("fetch"):
+            failed = write_results(findings, results_file_path, checkpoint, store, metrics=metrics, summary=summary, shards=shards, index=True)
+        print(f"Summary written to {write_sidecar(summary, results_file_path)}")
+
+        # A complete, unfiltered listing is everything the analyzer has: drop the rest from the store
+        if store_path and not filters and not limited and checkpoint.state['listing_complete']:
+            if pipeline:
+                # The listing wasn't kept, but everything listed was written or failed
+                listed_ids = [finding['id'] for finding in iter_findings(results_file_path)] + failed
+            else:
+                listed_ids = [finding['id'] for finding in checkpoint.state['listed']]
+            prune_store(store_path, listed_ids)
+    except BaseException:
+        checkpoint.save(force=True)
+        print(f"\n\nStopped. To carry on from here: ./get_all_findings.py --resume {checkpoint.path}")
+        raise
+
+    if pipeline:
+        print(f"Total findings:    {counts['listed']}")
+        if previous_file and not done:
+            removed = [finding_id for finding_id in previous if finding_id not in seen]
+            print_incremental(previous_file, previous, counts["unchanged"], counts["listed"] - counts["unchanged"], removed)
+    if removed is not None:
+        print(f"Removed written to {write_removed(removed, previous, previous_file, results_file_path)}")
+        metrics.count("findings_removed", len(removed))
+
+    checkpoint.remove()
+    print_api_stats(limiter)
+
+    metrics.count("findings_listed", counts["listed"])
+    metrics.count("findings_unchanged", counts["unchanged"])
+    metrics.count("findings_failed", len(failed))
+    metrics.count("bytes_written", snapshot_size(results_file_path))
+    metrics.add_api_stats(limiter.stats())
+    write_metrics(metrics, metrics_path, prometheus_path)
+
+    if failed:
+        print(f"\nFailed to get {len(failed)} findings:")
+        for finding_id in failed:
+            print(f"  {finding_id}")
+        exit(1)
 
-    position = 0
-    for finding_id in full_findings_list:
-        position += 1
 
-        # Print progress over the same line
-        print(f"Getting finding {position} of {full_findings_list_len}\r", end="") # \r is carriage return, end="" to avoid newline
+def fan_out(arns, regions=None, limit="None", workers=WORKERS, filters=None, ndjson=False, store_path=None, processes=None, metrics_path=None, prometheus_path=None, shards=None, rate=None, max_rate=None):
+    # Get the findings of several analyzers at once, one process per analyzer,
+    # and merge them into one file with each finding tagged by analyzerArn and region
+    from concurrent.futures import ProcessPoolExecutor # imported here, as it's slow to import and only needed for this
+    filters = filters or {}
+    suffix = filter_suffix(filters)
+    extension = "ndjson" if ndjson else "json"
+    results_file_path = f"{NOW}-combined{suffix}.details.{extension}"
+    if shards:
+        results_file_path = f"{NOW}-combined{suffix}.details{SHARDS_EXTENSION}"
+    metrics = RunMetrics("get_all_findings")
+
+    if regions:
+        with metrics.phase("discover"):
+            arns = arns + discover_analyzers(regions)
+    arns = list(dict.fromkeys(arn for arn in arns if arn)) # de-duplicate, keeping order
+    for arn in arns:
+        if not arn.startswith("arn:aws:access-analyzer:"):
+            print(f"Not a valid ARN: {arn}")
+            usage()
+            exit(1)
+    if not arns:
+        print("No analyzers found")
+        exit(1)
 
+    print(f"Getting all findings for {len(arns)} analyzers\n")
+    if filters:
+        print(f"Filters:           {filters}")
+
+    results = {}
+    errors = {}
+    failed = []
+    listed = []
+    part_paths = {arn: part_file_path(arn, filters) for arn in arns}
+    try:
+        with metrics.phase("fetch"), ProcessPoolExecutor(max_workers=processes or len(arns)) as executor:
+            futures = {executor.submit(collect_analyzer, arn, part_paths[arn], limit, workers, filters, rate, max_rate): arn for arn in arns}
+            for future in as_completed(futures):
+                arn = futures[future]
+                name = f"{arn.split('/')[1]} ({arn.split(':')[3]}, account {arn.split(':')[4]})"
+                try:
+                    results[arn] = future.result()
+                except Exception as e:
+                    errors[arn] = e
+                    print(f"  {name}: failed: {e}")
+                    continue
+                stats = results[arn]['stats']
+                print(f"  {name}: {results[arn]['written']} findings, {stats['calls']} API calls in {stats['elapsed']}s")
+                metrics.merge(results[arn]['metrics'])
+                metrics.add_api_stats(stats)
+
+        # Merge, in the order the analyzers were given
+        print()
+        writer = open_writer(results_file_path, shards=shards, index=True)
+        store = FindingsStore(store_path) if store_path else None
+        summary = Summary()
         try:
-            result = accessanalyzer.get_finding_v2(id=finding_id, analyzerArn=arn)
-        except botocore.exceptions.ClientError as e:
-            print(f"Error at position {position}: {e}")
-            print("Waiting 10 seconds and trying again")
-            time.sleep(10)
-            try:
-                result = accessanalyzer.get_finding_v2(id=finding_id, analyzerArn=arn)
-            except botocore.exceptions.ClientError as e:
-                print(f"Error at position {position}: {e}")
-                break
-        full_findings_details.append(result)
+            with metrics.phase("merge"):
+                for arn in arns:
+                    if arn not in results:
+                        continue
+                    for finding in iter_findings(results[arn]['path']):
+                        listed.append(finding['id'])
+                        writer.write(finding)
+                        summary.add(finding)
+                        if store:
+                            store.upsert(finding)
+                    failed += results[arn]['failed']
+        finally:
+            writer.close()
+            if store:
+                store.close()
+    finally:
+        # Including those of analyzers that failed part way through, or of a merge that did
+        for part_path in part_paths.values():
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    if store_path and not errors and not filters and limit == "None":
+        prune_store(store_path, listed + failed) # Findings that failed to fetch are still listed
+
+    print(f"Total findings:    {writer.count}")
+    print(f"Results written to {results_file_path}")
+    print(f"Summary written to {write_sidecar(summary, results_file_path)}")
+    if store:
+        print(f"Store updated:     {store.path}")
+
+    metrics.count("findings_failed", len(failed))
+    metrics.count("bytes_written", snapshot_size(results_file_path))
+    write_metrics(metrics, metrics_path, prometheus_path)
+
+    if failed or errors:
+        print(f"\nFailed to get {len(failed)} findings and {len(errors)} analyzers:")
+        for finding_id in failed:
+            print(f"  {finding_id}")
+        for arn in errors:
+            print(f"  {arn}")
+        exit(1)
 
-        # If counter at position limit, exit
-        if position == limit and limit != full_findings_list_len:
-            print(f"\nBreaking at {limit}\n")
-            break
 
-    write_results(full_findings_details, results_file_path)
+def prune_store(store_path, listed):
+    # Remove the findings no longer listed from the store
+    store = FindingsStore(store_path)
+    try:
+        removed = store.remove_unlisted(listed)
+    finally:
+        store.close()
+    print(f"Removed from store: {len(removed)}")
+    d_print(f"Removed from store: {removed}")
+    return removed
 
 
-def list_all_findings(arn):
-    # List all findings, with pagination
-    findings = accessanalyzer.list_findings(analyzerArn=arn)
-    next_token = findings.get("nextToken")
-    while next_token:
-        next_page = accessanalyzer.list_findings(analyzerArn=arn, nextToken=next_token)
-        findings["findings"] += next_page["findings"]
-        next_token = next_page.get("nextToken")
-    return findings
+def part_file_path(arn, filters):
+    # The temporary ndjson file collect_analyzer writes an analyzer's findings to
+    region = arn.split(":")[3]
+    account_id = arn.split(":")[4]
+    analyzer = arn.split("/")[1]
+    return f"{NOW}-{account_id}-{analyzer}-{region}{filter_suffix(filters)}.part.ndjson"
+
+
+def collect_analyzer(arn, part_path, limit, workers, filters, rate=None, max_rate=None):
+    # Run in a worker process: get all findings for one analyzer into part_path (see part_file_path)
+    region = arn.split(":")[3]
+
+    metrics = RunMetrics("get_all_findings")
+    accessanalyzer = new_client(workers, region)
+    limiter = RateLimiter(rate=rate, max_rate=max_rate, workers=workers, metrics=metrics)
+
+    with metrics.phase("list"):
+        data = list_all_findings(accessanalyzer, arn, limiter, build_filter(filters))
+    finding_ids = [finding['id'] for finding in data['findings']]
+    if limit != "None":
+        finding_ids = finding_ids[:int(limit)]
+
+    findings = fetch_in_order(accessanalyzer, arn, ((finding_id, None) for finding_id in finding_ids), limiter, workers, progress=False)
+    findings = ((finding_id, tag_finding(result, arn, region)) for finding_id, result in findings)
+    failed = write_results(findings, part_path, quiet=True, metrics=metrics)
+
+    return {
+        "path": part_path,
+        "written": len(finding_ids) - len(failed),
+        "failed": failed,
+        "stats": limiter.stats(),
+        "metrics": metrics.to_dict(),
+    }
+
+
+def tag_finding(finding, arn, region):
+    if finding is not None:
+        finding['analyzerArn'] = arn
+        finding['region'] = region
+    return finding
+
+
+def discover_analyzers(regions):
+    # ARNs of the active external access analyzers in each region
+    arns = []
+    for region in regions:
+        accessanalyzer = new_client(1, region)
+        limiter = RateLimiter()
+        kwargs = {}
+        while True:
+            page = limiter.call(accessanalyzer.list_analyzers, **kwargs)
+            for analyzer in page['analyzers']:
+                if analyzer.get('status') == 'ACTIVE' and analyzer.get('type') in ['ACCOUNT', 'ORGANIZATION']:
+                    arns.append(analyzer['arn'])
+            if not page.get('nextToken'):
+                break
+            kwargs['nextToken'] = page['nextToken']
+        d_print(f"{region}: {arns}")
+    return arns
+
+
+def find_previous(account_id, analyzer, suffix=""):
+    # Latest details file for this analyzer (and filters) in the current directory, if any
+    files = glob.glob(f"*-{account_id}-{analyzer}{suffix}.details.json") + glob.glob(f"*-{account_id}-{analyzer}{suffix}.details.ndjson")
+    files += glob.glob(f"*-{account_id}-{analyzer}{suffix}.details{SHARDS_EXTENSION}")
+    files = sorted(files)
+    return files[-1] if files else None
+
+
+def load_previous(previous_file):
+    # Index a previous details file by finding id, as compact Findings.
+    # The full finding is only needed again if it's unchanged, so keep it as a compact json string
+    previous = {}
+    for finding in iter_findings(previous_file):
+        model = Finding.from_dict(finding)
+        model.data = json.dumps(finding, separators=(",", ":"))
+        previous[model.id] = model
+    return previous
+
+
+def previous_finding(previous, finding_id):
+    return json.loads(previous[finding_id].data)
+
+
+def is_unchanged(finding, previous):
+    # updatedAt changes whenever a finding is re-evaluated or its status changes.
+    # Previous details were written with default=str, so compare as strings.
+    old = previous.get(finding['id'])
+    return old is not None and old.updated_at == str(finding.get('updatedAt')) and old.status == finding.get('status')
+
+
+def diff_listing(listed, previous):
+    # Split listed findings into ids to fetch (new or changed) and ids to carry over (unchanged).
+    to_fetch = []
+    unchanged = set()
+    for finding in listed:
+        if is_unchanged(finding, previous):
+            unchanged.add(finding['id'])
+        else:
+            to_fetch.append(finding['id'])
+    listed_ids = set(finding['id'] for finding in listed)
+    removed = [finding_id for finding_id in previous if finding_id not in listed_ids]
+    return to_fetch, unchanged, removed
+
+
+def print_incremental(previous_file, previous, unchanged, changed, removed):
+    print(f"Previous findings: {len(previous)} ({previous_file})")
+    print(f"Unchanged:         {unchanged}")
+    print(f"New or changed:    {changed}")
+    print(f"Removed:           {len(removed)}")
+    for finding_id in removed:
+        d_print(f"Removed: {finding_id}")
+    print()
 
 
-def write_results(findings_details, results_file_path):
+def removed_path(results_file_path):
+    return f"{results_file_path}.removed.json"
+
+
+def write_removed(removed, previous, previous_file, results_file_path):
+    # Save the findings in the previous details file that the analyzer no longer lists, next to the new details file,
+    # as they were last seen (id, status, resource, updatedAt)
+    findings = [
+        {"id": finding_id, "status": previous[finding_id].status, "resourceType": previous[finding_id].resource_type,
+         "resource": previous[finding_id].resource, "updatedAt": previous[finding_id].updated_at}
+        for finding_id in removed
+    ]
+    path = removed_path(results_file_path)
+    with open(path, "w") as file:
+        json.dump({"previous_file": previous_file, "removed": findings}, file, indent=4)
+    return path
+
+
+class Checkpoint:
+    '''
+    Progress of a run: the listed findings, the list_findings token, and how much of the
+    results file has been written. Saved periodically so an interrupted run can be resumed.
+    With --pipeline only the findings listed but not yet written are kept in "listed", and
+    "listed_from" is how many have been dropped from the front of it, so neither the state
+    nor the saved checkpoint grow with the listing.
+    '''
+
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+        self.saved_at = time.monotonic()
+        self.lock = threading.Lock() # Held while the state is saved or listing progress is recorded
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as file:
+            return cls(path, json.load(file))
+
+    def due(self):
+        return time.monotonic() - self.saved_at >= CHECKPOINT_SECONDS
+
+    def save(self, force=False):
+        if not force and not self.due():
+            return
+        # Write to a temporary file first, so a crash mid-write doesn't lose the last checkpoint.
+        # With --pipeline the listing and writing threads both save: the whole save is under the lock,
+        # and a save that's no longer due once the other thread has saved is skipped
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            if not force and not self.due():
+                return
+            with open(tmp_path, "w") as file:
+                json.dump(self.state, file)
+            os.replace(tmp_path, self.path)
+            self.saved_at = time.monotonic()
+        d_print(f"Checkpoint saved to {self.path}")
+
+    def drop_written(self, done):
+        # Drop the listed findings written so far (up to done), with --pipeline
+        with self.lock:
+            del self.state["listed"][:done - self.state["listed_from"]]
+            self.state["listed_from"] = done
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def print_api_stats(limiter):
+    stats = limiter.stats()
+    print(f"API calls:         {stats['calls']} ({stats['calls_per_second']} calls/s)")
+    print(f"Throttled:         {stats['throttles']} (retries: {stats['retries']}, final rate: {stats['rate']}/s)")
+
+
+def write_metrics(metrics, metrics_path=None, prometheus_path=None):
+    # Only written when asked for, as by the other scripts
+    if metrics_path:
+        print(f"Metrics written to {metrics.write_json(metrics_path)}")
+    if prometheus_path:
+        print(f"Prometheus metrics {metrics.write_prometheus(prometheus_path)}")
+
+
+def write_results(findings, results_file_path, checkpoint=None, store=None, quiet=False, metrics=None, summary=None, shards=None, index=False):
+    # Write (finding_id, result) pairs as they arrive. Returns the ids that could not be fetched.
+    # With a checkpoint, carry on from where the results file was cut off and record progress as we go.
+    # With a store, also add each finding to it. With metrics, time the writing separately from fetching.
+    # With a summary (summarise_findings.Summary), add each finding to that too.
+    # With shards, results_file_path is a manifest (.shards.json) and the findings are split across that many files.
+    # With index, also write the position of each finding to <details file>.idx, for lookups by id (lookup_findings.py).
     trimmed = True # set to False to include ResponseMetadata
-    findings_details = trim_response_metadata(findings_details) if trimmed else findings_details
 
-    findings_details_json = json.dumps(findings_details, indent=4, default=str)
-    output_file = open(results_file_path, "w")
-    output_file.write(findings_details_json)
-    output_file.close()
+    state = checkpoint.state if checkpoint else {"done": 0, "written": 0, "offset": None, "failed": []}
+    done = state["done"]
+    failed = list(state["failed"])
+    writer = open_writer(results_file_path, state["offset"], state["written"], shards, index)
+
+    def record():
+        writer.flush()
+        if store:
+            store.commit()
+        state.update(done=done, written=writer.count, offset=writer.offset, failed=failed)
+        if summary:
+            state.update(summary=summary.to_dict())
+        if checkpoint and state.get("pipeline"):
+            checkpoint.drop_written(done)
+
+    try:
+        for finding_id, result in findings:
+            if result is None:
+                failed.append(finding_id)
+            else:
+                result = trim_response_metadata(result) if trimmed else result
+                if metrics:
+                    with metrics.phase("write"):
+                        writer.write(result)
+                else:
+                    writer.write(result)
+                if store:
+                    store.upsert(result)
+                if summary:
+                    summary.add(result)
+            done += 1
+            if checkpoint and checkpoint.due():
+                record()
+                checkpoint.save()
+    finally:
+        record()
+        writer.close()
+        if store:
+            store.close()
+    if quiet:
+        return failed
     print(f"Results written to {results_file_path}")
+    if store:
+        print(f"Store updated:     {store.path}")
+    return failed
 
 
 def usage():
     print()
-    print("Usage: python get_findings_details.py --arn <arn> --resource_type <resource_type> --status <status> --limit <limit>")
+    print("Usage: python get_findings_details.py --arn <arn>[,<arn>...] --regions <regions> --processes <processes> --resource_type <resource_type> --status <status> --owner_account <account> --is_public <true|false> --limit <limit> --workers <workers> --rate <calls/s> --max-rate <calls/s> --pipeline --ndjson --shards <n> --store <db> --incremental [<details file>] --resume <checkpoint> --metrics <file> --prometheus <file>")
     print()
-    print("    --arn:  ** REQUIRED ** The ARN of the analyzer to use")
+    print("    --arn:  ** REQUIRED ** The ARN of the analyzer to use, or a comma separated list of ARNs")
+    print("    --regions: Also find the active analyzers in these regions (e.g. eu-west-1,us-east-1)")
+    print("    --processes: With several analyzers, how many to get at once (default=all of them)")
     print("    --resource_type: The resource type to filter by (e.g. 'AWS::S3::Bucket')")
     print("    --status: The status to filter by (e.g. 'ACTIVE')")
+    print("    --owner_account: The resource owner account to filter by (e.g. '112233445566')")
+    print("    --is_public: Only public (true) or non-public (false) findings")
+    print("    Filters accept comma separated values (e.g. --status ACTIVE,ARCHIVED) and are applied by Access Analyzer")
     print("    --limit: The limit to use (e.g. 20, default=no limit)")
+    print("    --workers: The number of findings to fetch concurrently (e.g. 16, default=1)")
+    print("    --rate: API calls per second to start at (default=workers / latency of the first call)")
+    print(f"    --max-rate: API calls per second never to go above (default={MAX_RATE:g})")
+    print("    --pipeline: Start fetching details while findings are still being listed")
+    print("    --ndjson: Write one finding per line (.details.ndjson) as each is fetched")
+    print("    --shards: Split the findings across this many ndjson files by id, listed in a manifest (.details.shards.json),")
+    print("              so summarise_findings.py and extract_findings.py can process them on several cores")
+    print("    --store: Also add the findings to a SQLite findings store (e.g. findings.db), see query_findings.py")
+    print("    --resume: Carry on an interrupted run from its checkpoint file (<details file>.checkpoint)")
+    print("    --incremental: Only fetch new or changed findings, reusing the rest from a previous details file")
+    print("                   (e.g. --incremental 20240715-1030-112233445566-My-Analyzer.details.json, default=latest)")
+    print("    --metrics: Where to write the run metrics (phase timings, API latencies, throttling) as json (default: not written)")
+    print("    --prometheus: Also write the run metrics in Prometheus textfile format (e.g. /var/lib/node_exporter/iaa.prom)")
     print()
     print("Possible values for resource_type:")
     print("    AWS::S3::Bucket, AWS::IAM::Role, AWS::SQS::Queue, AWS::Lambda::Function, AWS::Lambda::LayerVersion, ")
@@ -117,14 +594,6 @@ def usage():
     print()
 
 
-def trim_response_metadata(findings_details):
-    for key in findings_details:
-        if "ResponseMetadata" in key:
-            del key["ResponseMetadata"]
-
-    return findings_details
-
-
 def d_print(message):
     if DEBUG:
         print(f"DEBUG: {message}")
@@ -136,7 +605,45 @@ if __name__ == "__main__":
         '--arn',
             dest='arn',
             default='None',
-            help='The ARN to use (default: None)'
+            help='The ARN to use, or a comma separated list of ARNs to get them all at once (default: None)'
+        )
+    parser.add_argument(
+        '--regions',
+            dest='regions',
+            default=None,
+            help='Also find the active analyzers in these regions, comma separated (e.g. eu-west-1,us-east-1) (default: None)'
+        )
+    parser.add_argument(
+        '--processes',
+            dest='processes',
+            type=int,
+            default=None,
+            help='With several analyzers, how many to get at once (default: all of them)'
+        )
+    parser.add_argument(
+        '--resource_type',
+            dest='resource_type',
+            default=None,
+            help='The resource type(s) to filter by, comma separated (e.g. AWS::S3::Bucket) (default: None)'
+        )
+    parser.add_argument(
+        '--status',
+            dest='status',
+            default=None,
+            help='The status(es) to filter by, comma separated (e.g. ACTIVE) (default: None)'
+        )
+    parser.add_argument(
+        '--owner_account',
+            dest='owner_account',
+            default=None,
+            help='The resource owner account(s) to filter by, comma separated (default: None)'
+        )
+    parser.add_argument(
+        '--is_public',
+            dest='is_public',
+            choices=['true', 'false'],
+            default=None,
+            help='Only public (true) or non-public (false) findings (default: None)'
         )
     parser.add_argument(
         '--limit',
@@ -144,6 +651,78 @@ if __name__ == "__main__":
             default='None',
             help='The limit to use for testing (e.g. 20) (default: "None")'
         )
+    parser.add_argument(
+        '--workers',
+            dest='workers',
+            type=int,
+            default=WORKERS,
+            help=f'The number of findings to fetch concurrently (default: {WORKERS})'
+        )
+    parser.add_argument(
+        '--rate',
+            dest='rate',
+            type=float,
+            default=None,
+            help='API calls per second to start at (default: workers / latency of the first call)'
+        )
+    parser.add_argument(
+        '--max-rate',
+            dest='max_rate',
+            type=float,
+            default=None,
+            help=f'API calls per second never to go above (default: {MAX_RATE})'
+        )
+    parser.add_argument(
+        '--pipeline',
+            dest='pipeline',
+            action='store_true',
+            help='Start fetching details while findings are still being listed'
+        )
+    parser.add_argument(
+        '--ndjson',
+            dest='ndjson',
+            action='store_true',
+            help='Write one finding per line (.details.ndjson) as each is fetched, instead of a JSON array'
+        )
+    parser.add_argument(
+        '--shards',
+            dest='shards',
+            type=int,
+            default=None,
+            help='Split the findings across this many ndjson files by finding id, listed in a manifest (.details.shards.json) (default: None)'
+        )
+    parser.add_argument(
+        '--store',
+            dest='store',
+            default=None,
+            help='Also add the findings to this SQLite findings store (e.g. findings.db) (default: None)'
+        )
+    parser.add_argument(
+        '--resume',
+            dest='resume',
+            default=None,
+            help='Carry on an interrupted run from its checkpoint file (e.g. <details file>.checkpoint)'
+        )
+    parser.add_argument(
+        '--incremental',
+            dest='previous',
+            nargs='?',
+            const='latest',
+            default=None,
+            help='Only fetch new or changed findings, reusing the rest from a previous details file (default: the latest one for this analyzer)'
+        )
+    parser.add_argument(
+        '--metrics',
+            dest='metrics',
+            default=None,
+            help='Write the run metrics (timings, API calls) here as json'
+        )
+    parser.add_argument(
+        '--prometheus',
+            dest='prometheus',
+            default=None,
+            help='Also write the run metrics in Prometheus textfile format, e.g. for the node exporter (default: None)'
+        )
 
     args = parser.parse_args()
 
@@ -163,4 +742,23 @@ if __name__ == "__main__":
     arn = args.arn if args.arn != "None" else os.getenv("ANALYZER_ARN")
     d_print(f"arn: {arn}")
 
-    main(arn=arn, limit=args.limit)
+    filters = {
+        "status": args.status.upper() if args.status else None,
+        "resourceType": args.resource_type,
+        "resourceOwnerAccount": args.owner_account,
+        "isPublic": args.is_public,
+    }
+    filters = {key: value for key, value in filters.items() if value is not None}
+    d_print(f"filters: {filters}")
+
+    # Several analyzers: get them all at once and merge the results
+    arns = arn.split(",") if arn else []
+    regions = args.regions.split(",") if args.regions else []
+    if len(arns) > 1 or regions:
+        if args.previous or args.resume or args.pipeline:
+            print("--incremental, --resume and --pipeline are not supported with several analyzers")
+            exit(1)
+        fan_out(arns, regions=regions, limit=args.limit, workers=args.workers, filters=filters, ndjson=args.ndjson, store_path=args.store, processes=args.processes, metrics_path=args.metrics, prometheus_path=args.prometheus, shards=args.shards, rate=args.rate, max_rate=args.max_rate)
+        exit(0)
+
+    main(arn=arn, limit=args.limit, workers=args.workers, previous_file=args.previous, filters=filters, ndjson=args.ndjson, resume=args.resume, store_path=args.store, pipeline=args.pipeline, metrics_path=args.metrics, prometheus_path=args.prometheus, shards=args.shards, rate=args.rate, max_rate=args.max_rate)
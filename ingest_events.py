@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from findings_index import index_path, open_index
+from findings_io import JsonWriter, NdjsonWriter, changes_path, has_changes, is_sharded, iter_findings, read_changes
+from findings_store import FindingsStore, is_store
+from get_all_findings import fetch_in_order, new_client, tag_finding, trim_response_metadata
+from rate_limiter import RateLimiter
+from run_metrics import RunMetrics
+from summarise_findings import Summary, write_sidecar
+
+MAX_LEN = 20 # Max title length
+WORKERS = 4 # Number of concurrent get_finding_v2 calls, for events without full details
+BATCH_SIZE = 500 # Apply the events once this many have arrived...
+BATCH_SECONDS = 5 # ...or this many seconds after the first of them, whichever comes first
+COMPACT_RATIO = 0.1 # Write the logged changes into a details file once the log is this fraction of its size
+METRICS_FILE = None # Write the run metrics here as json
+PROMETHEUS_FILE = None # Write the run metrics here in Prometheus textfile format
+
+EVENT_SOURCE = "aws.access-analyzer"
+# What an event's detail needs for the finding to be built from it, without calling get_finding_v2
+FULL_DETAILS = ["id", "status", "resourceType", "resource", "accountId", "updatedAt", "principal", "action", "isPublic"]
+
+
+def main(events_path, target, arn=None, workers=WORKERS, batch_size=BATCH_SIZE, batch_seconds=BATCH_SECONDS):
+    e = "Events"
+    print(f"{e.ljust(MAX_LEN)} : {'stdin' if events_path == '-' else events_path}")
+    t = "Target"
+    print(f"{t.ljust(MAX_LEN)} : {target}\n")
+
+    metrics = RunMetrics("ingest_events")
+    limiter = RateLimiter(workers=workers, metrics=metrics)
+    clients = {}
+    totals = Counter()
+    snapshot = None if is_store(target) else SnapshotLog(target, metrics)
+
+    try:
+        for events in batches(read_events(events_path, totals), batch_size, batch_seconds):
+            with metrics.phase("apply"):
+                counts = apply_events(events, target, snapshot, arn, workers, limiter, clients, metrics)
+            totals.update(counts)
+            print(f"{datetime.now().strftime('%H:%M:%S')} {len(events)} events: {counts['updated']} updated, {counts['added']} new, "
+                  f"{counts['deleted']} deleted, {counts['unchanged']} already up to date, {counts['fetched']} fetched, {counts['failed']} failed")
+    finally:
+        # Leave the details file with every change written into it
+        if snapshot:
+            snapshot.close()
+
+    print()
+    for name, title in [("events", "Events"), ("ignored", "Ignored"), ("invalid", "Invalid"), ("updated", "Updated"),
+                        ("added", "New"), ("deleted", "Deleted"), ("unchanged", "Already up to date"), ("fetched", "Fetched"), ("failed", "Failed")]:
+        print(f"{title.ljust(MAX_LEN)} : {totals[name]}")
+        metrics.count(f"events_{name}" if name in ("events", "ignored", "invalid") else f"findings_{name}", totals[name])
+    metrics.add_api_stats(limiter.stats())
+
+    if METRICS_FILE:
+        metrics.write_json(METRICS_FILE)
+    if PROMETHEUS_FILE:
+        metrics.write_prometheus(PROMETHEUS_FILE)
+
+
+def read_events(path, totals):
+    # Yield event documents from a directory of files, a file, or stdin ("-", one event per line).
+    # A file holds one event, a JSON array of them, or one per line
+    if path == "-":
+        yield from read_lines(sys.stdin, totals)
+    elif os.path.isdir(path):
+        for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+            if entry.is_file() and not entry.name.startswith("."):
+                yield from read_file(entry.path, totals)
+    else:
+        yield from read_file(path, totals)
+
+
+def read_file(filename, totals):
+    with open(filename, "r") as file:
+        text = file.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        yield from read_lines(text.splitlines(), totals)
+        return
+    yield from data if isinstance(data, list) else [data]
+
+
+def read_lines(lines, totals):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            totals["invalid"] += 1
+
+
+def batches(events, size=BATCH_SIZE, seconds=BATCH_SECONDS):
+    # Group events into lists of up to `size`, ending a batch early `seconds` after its first event,
+    # so a slow stream (e.g. stdin) is applied as it arrives rather than when it ends
+    pending = queue.Queue(maxsize=size * 2)
+    end = object()
+    errors = []
+
+    def read():
+        try:
+            for event in events:
+                pending.put(event)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            pending.put(end)
+
+    threading.Thread(target=read, daemon=True).start()
+    batch = []
+    deadline = None
+    while True:
+        try:
+            event = pending.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            yield batch
+            batch, deadline = [], None
+            continue
+        if event is end:
+            break
+        batch.append(event)
+        if deadline is None:
+            deadline = time.monotonic() + seconds
+        if len(batch) >= size:
+            yield batch
+            batch, deadline = [], None
+    if batch:
+        yield batch
+    if errors:
+        raise errors[0]
+
+
+def apply_events(events, target, snapshot, arn, workers, limiter, clients, metrics):
+    # Upsert the findings in a batch of events into a details file (through its SnapshotLog) or findings store,
+    # and remove those of deleted resources. Returns the counts
+    counts = Counter(events=len(events))
+    changes = {}
+    for event in events:
+        change = parse_event(event, arn)
+        if change is None:
+            counts["ignored"] += 1
+        else:
+            # Keep the latest event for each finding; of two as new, the later one
+            previous = changes.get(change["id"])
+            if previous is None or not (previous["updated_at"] and change["updated_at"] and previous["updated_at"] > change["updated_at"]):
+                changes[change["id"]] = change
+
+    store = FindingsStore(target) if is_store(target) else None
+    try:
+        # Only call get_finding_v2 for events without full details, and not for ones we already have
+        to_fetch = [change for change in changes.values() if change["finding"] is None and not change["deleted"]]
+        if to_fetch:
+            with metrics.phase("lookup"):
+                existing = current_findings(store, snapshot, [change["id"] for change in to_fetch])
+            wanted = len(to_fetch)
+            to_fetch = [change for change in to_fetch if is_newer(change, existing.get(change["id"]))]
+            counts["unchanged"] += wanted - len(to_fetch)
+            with metrics.phase("fetch"):
+                fetch_details(to_fetch, workers, limiter, clients, counts)
+        updates = {finding_id: change for finding_id, change in changes.items() if change["finding"] is not None}
+        deletions = {finding_id: change for finding_id, change in changes.items() if change["deleted"]}
+
+        with metrics.phase("write"):
+            if store:
+                write_store(store, updates, deletions, counts)
+            else:
+                write_snapshot(snapshot, updates, deletions, counts)
+    finally:
+        if store:
+            store.close()
+    return counts
+
+
+def parse_event(event, arn=None):
+    # An Access Analyzer finding event (or just its detail) as a change to apply, or None for anything else:
+    # {"id", "status", "updated_at", "finding" (None if the event hasn't the full details, or is for a deleted resource),
+    # "deleted", "arn", "region"}
+    if not isinstance(event, dict):
+        return None
+    if "detail" in event:
+        if event.get("source") != EVENT_SOURCE:
+            return None
+        detail = event["detail"]
+    else:
+        detail = event
+    if not isinstance(detail, dict) or not detail.get("id"):
+        return None
+
+    analyzer_arn = next((r for r in event.get("resources", []) if str(r).startswith("arn:aws:access-analyzer:")), arn)
+    region = event.get("region") or detail.get("region") or (analyzer_arn.split(":")[3] if analyzer_arn else None)
+    # The finding of a resource that's been deleted is dropped, rather than kept as it was
+    deleted = detail.get("isDeleted") in (True, "true")
+    return {
+        "id": detail["id"],
+        "status": detail.get("status"),
+        "updated_at": parse_time(detail.get("updatedAt")),
+        "finding": None if deleted else to_finding(detail),
+        "deleted": deleted,
+        "arn": analyzer_arn,
+        "region": region,
+    }
+
+
+def to_finding(detail):
+    # The finding as get_finding_v2 would return it, if the event's detail has everything needed
+    if "findingDetails" in detail:
+        finding = dict(detail)
+        finding.pop("version", None)
+        finding.pop("isDeleted", None)
+        return finding
+    if any(key not in detail for key in FULL_DETAILS):
+        return None
+
+    access = {
+        "action": detail["action"],
+        "condition": detail.get("condition") or {},
+        "isPublic": detail["isPublic"],
+        "principal": detail["principal"],
+    }
+    if detail.get("sources"):
+        access["sources"] = detail["sources"]
+    return {
+        "analyzedAt": format_time(detail.get("analyzedAt")),
+        "createdAt": format_time(detail.get("createdAt")),
+        "id": detail["id"],
+        "resource": detail["resource"],
+        "resourceType": detail["resourceType"],
+        "resourceOwnerAccount": detail["accountId"],
+        "status": detail["status"],
+        "updatedAt": format_time(detail["updatedAt"]),
+        "findingDetails": [{"externalAccessDetails": access}],
+        "findingType": "ExternalAccess",
+    }
+
+
+def parse_time(value):
+    # Events have "2024-07-15T10:30:00Z"; details files have str(datetime), "2024-07-15 10:30:00+00:00"
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        value = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def format_time(value):
+    # As get_all_findings.py writes timestamps, so they compare equal to a listed finding's
+    time_value = parse_time(value)
+    return value if time_value is None else str(time_value)
+
+
+def is_newer(change, existing):
+    # Whether a change is newer than the finding (or change) we have: a later updatedAt, or a different status
+    if existing is None:
+        return True
+    if isinstance(existing, dict) and "updated_at" not in existing:
+        existing = {"updated_at": parse_time(existing.get("updatedAt")), "status": existing.get("status")}
+    if change["updated_at"] is None or existing["updated_at"] is None:
+        return True
+    if change["updated_at"] != existing["updated_at"]:
+        return change["updated_at"] > existing["updated_at"]
+    return change["status"] != existing["status"]
+
+
+def current_findings(store, snapshot, finding_ids):
+    # {id: finding} of the findings we already have, of those asked for
+    if store:
+        return {finding_id: finding for finding_id in finding_ids if (finding := store.get(finding_id)) is not None}
+    return snapshot.get_many(finding_ids)
+
+
+def fetch_details(changes, workers, limiter, clients, counts):
+    # Get the full details of each change with get_finding_v2, analyzer by analyzer
+    by_arn = {}
+    for change in changes:
+        if change["arn"]:
+            by_arn.setdefault(change["arn"], []).append(change)
+        else:
+            print(f"No analyzer ARN for {change['id']}: use --arn")
+            counts["failed"] += 1
+
+    for analyzer_arn, arn_changes in by_arn.items():
+        region = analyzer_arn.split(":")[3]
+        if region not in clients:
+            clients[region] = new_client(workers, region)
+        by_id = {change["id"]: change for change in arn_changes}
+        listed = ((change["id"], None) for change in arn_changes)
+        for finding_id, result in fetch_in_order(clients[region], analyzer_arn, listed, limiter, workers, progress=False):
+            if result is None:
+                counts["failed"] += 1
+                continue
+            by_id[finding_id]["finding"] = trim_response_metadata(result)
+            counts["fetched"] += 1
+
+
+def updated_finding(change, existing):
+    # The finding to write for a change, or None if the one we have is as new.
+    # Findings from several analyzers (get_all_findings.py --regions) keep their analyzerArn and region tags
+    if not is_newer(change, existing):
+        return None
+    finding = change["finding"]
+    if existing is not None and "analyzerArn" in existing and "analyzerArn" not in finding:
+        tag_finding(finding, change["arn"], change["region"])
+    return finding
+
+
+def is_deleted(change, existing):
+    # Whether a deletion event removes the finding we have: unless it's been updated since
+    if existing is None:
+        return False
+    updated_at = parse_time(existing.get("updatedAt"))
+    return change["updated_at"] is None or updated_at is None or updated_at <= change["updated_at"]
+
+
+def changed_findings(findings, updates, deletions, counts):
+    # The findings to write and the ids to remove, of those we have (findings: a store or SnapshotLog)
+    updated = []
+    for finding_id, change in updates.items():
+        existing = findings.get(finding_id)
+        finding = updated_finding(change, existing)
+        if finding is None:
+            counts["unchanged"] += 1
+            continue
+        counts["added" if existing is None else "updated"] += 1
+        updated.append(finding)
+    deleted = []
+    for finding_id, change in deletions.items():
+        if is_deleted(change, findings.get(finding_id)):
+            counts["deleted"] += 1
+            deleted.append(finding_id)
+        else:
+            counts["unchanged"] += 1
+    return updated, deleted
+
+
+def write_store(store, updates, deletions, counts):
+    updated, deleted = changed_findings(store, updates, deletions, counts)
+    store.upsert_many(updated)
+    store.delete_many(deleted)
+
+
+def write_snapshot(snapshot, updates, deletions, counts):
+    updated, deleted = changed_findings(snapshot, updates, deletions, counts)
+    snapshot.append(updated, deleted)
+    if snapshot.due():
+        snapshot.compact()
+
+
+class SnapshotLog:
+    '''
+    Changes to a details file, applied without rewriting it for every batch: changed and new findings, and the ids
+    of deleted ones, are appended to <details file>.changes.ndjson, which iter_findings and the index apply over
+    the file (findings_io.read_changes). Once the log is COMPACT_RATIO of the file's size, and when ingesting stops,
+    the file is rewritten with the changes in it (compacted), along with its index and summary, and the log removed.
+    '''
+
+    def __init__(self, filename, metrics=None):
+        self.filename = filename
+        self.metrics = metrics
+        self.changes = read_changes(filename) # id -> finding, or None if deleted
+        self.index = None
+
+    def get(self, finding_id):
+        # The finding as it is now, or None
+        return self.get_many([finding_id]).get(finding_id)
+
+    def get_many(self, finding_ids):
+        # {id: finding} as they are now, of those we have
+        found = {finding_id: self.changes[finding_id] for finding_id in finding_ids if finding_id in self.changes}
+        unlogged = [finding_id for finding_id in finding_ids if finding_id not in self.changes]
+        if unlogged and os.path.exists(self.filename):
+            if self.index is None:
+                self.index = open_index(self.filename)
+            found.update(self.index.get_many(unlogged))
+        return {finding_id: finding for finding_id, finding in found.items() if finding is not None}
+
+    def append(self, findings, deleted):
+        if not findings and not deleted:
+            return
+        lines = [json.dumps(finding, default=str) for finding in findings] + [json.dumps({"id": finding_id, "deleted": True}) for finding_id in deleted]
+        with open(changes_path(self.filename), "a") as file:
+            file.write("\n".join(lines) + "\n")
+        for finding in findings:
+            self.changes[finding['id']] = finding
+        for finding_id in deleted:
+            self.changes[finding_id] = None
+
+    def due(self):
+        if not has_changes(self.filename):
+            return False
+        if not os.path.exists(self.filename):
+            return True
+        return os.path.getsize(changes_path(self.filename)) >= COMPACT_RATIO * os.path.getsize(self.filename)
+
+    def compact(self):
+        # Rewrite the details file with the logged changes (same order, new findings at the end), then replace it.
+        # Its summary sidecar is written again as we go, so summarise_findings.py stays instant
+        if not has_changes(self.filename):
+            return
+        if self.metrics:
+            with self.metrics.phase("compact"):
+                self.write()
+        else:
+            self.write()
+
+    def write(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if os.path.exists(self.filename):
+            findings = iter_findings(self.filename)
+        else:
+            findings = (finding for finding in self.changes.values() if finding is not None)
+        writer = (NdjsonWriter if self.filename.endswith(".ndjson") else JsonWriter)(f"{self.filename}.ingest.tmp", index=True)
+        summary = Summary()
+        try:
+            try:
+                for finding in findings:
+                    writer.write(finding)
+                    summary.add(finding)
+            finally:
+                writer.close()
+        except BaseException:
+            # Leave the details file and its log as they were
+            for path in [writer.path, index_path(writer.path)]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        # Renaming keeps the modification time, so the index stays current
+        os.replace(writer.path, self.filename)
+        os.replace(index_path(writer.path), index_path(self.filename))
+        write_sidecar(summary, self.filename)
+        os.remove(changes_path(self.filename))
+        self.changes = {}
+
+    def close(self):
+        self.compact()
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+
+def usage(message):
+    print(message)
+    print("Usage: python ingest_events.py -e <directory, file or -> -f <details file or store> [--arn <analyzer arn>] [--workers <n>] [--batch <n>]")
+    exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply Access Analyzer finding events (from EventBridge) to a details file or findings store.')
+    parser.add_argument( '-e', dest='events', help='A directory of event files, an event file, or - for stdin (one event per line)')
+    parser.add_argument( '-f', dest='target', help='The details file (json or ndjson) or findings store (.db) to update')
+    parser.add_argument( '--arn', dest='arn', help='The analyzer, for events that don\'t name theirs and lack full details')
+    parser.add_argument( '--workers', dest='workers', type=int, default=WORKERS, help=f'The number of findings to fetch concurrently (default: {WORKERS})')
+    parser.add_argument( '--batch', dest='batch', type=int, default=BATCH_SIZE, help=f'Apply the events this many at a time (default: {BATCH_SIZE})')
+    parser.add_argument( '--batch-seconds', dest='batch_seconds', type=float, default=BATCH_SECONDS, help=f'...or this many seconds after the first of a batch arrives (default: {BATCH_SECONDS})')
+    parser.add_argument( '--metrics', dest='metrics', help='Write the run metrics (timings, API calls) here as json')
+    parser.add_argument( '--prometheus', dest='prometheus', help='Write the run metrics here in Prometheus textfile format')
+    args = parser.parse_args()
+
+    # Unset env vars - read from .env file
+    os.environ.pop('FINDINGS_FILE', None)
+    os.environ.pop('FINDINGS_STORE', None)
+    os.environ.pop('ANALYZER_ARN', None)
+
+    # Load dotenv
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    target = args.target or os.getenv("FINDINGS_STORE") or os.getenv("FINDINGS_FILE")
+    if not args.events:
+        usage("No events provided")
+    if not target:
+        usage("No details file or findings store provided")
+    if is_sharded(target):
+        usage("Sharded snapshots can't be updated in place; use a details file or findings store")
+    if args.events != "-" and not os.path.exists(args.events):
+        usage(f"No such file or directory: {args.events}")
+
+    METRICS_FILE = args.metrics or METRICS_FILE
+    PROMETHEUS_FILE = args.prometheus or PROMETHEUS_FILE
+
+    main(args.events, target, args.arn or os.getenv("ANALYZER_ARN"), args.workers, args.batch, args.batch_seconds)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+import json
+import os
+from datetime import datetime
+
+# Only the standard library is imported up front. boto3, findings_fetch and rate_limiter are imported
+# on first use (not the rest of get_all_findings), and the clients are kept for later (warm) invocations.
+
+PART_SIZE = int(os.getenv("PART_SIZE", 8 * 1024 * 1024)) # Multipart upload part size (S3 needs at least 5 MiB for all but the last part)
+TIME_MARGIN_MS = int(os.getenv("TIME_MARGIN_MS", 60 * 1000)) # Hand over to the next invocation when less than this is left
+WORKERS = int(os.getenv("WORKERS", "8")) # Concurrent get_finding_v2 calls
+OUTPUT = os.getenv("OUTPUT", "") # Default output, e.g. s3://my-bucket/findings/ or file:///tmp/findings/
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") # For an S3 compatible store (e.g. MinIO) instead of S3
+SELF_INVOKE = os.getenv("SELF_INVOKE") == "true" # Invoke the next run ourselves, rather than leaving it to the caller
+
+_modules = {}
+_clients = {} # Reused across warm invocations
+_timings = {} # Cold start costs, reported by the first invocation
+
+
+def handler(event, context):
+    '''
+    Get all findings for an analyzer into an ndjson details file in S3 (or a local directory).
+
+    event: {"analyzer_arn": ..., "output": "s3://bucket/prefix/", "filters": {...}, "workers": 8}
+    or, to carry on, the "continuation" returned by the previous invocation: {"continuation": {...}}
+
+    Returns {"status": "COMPLETE", "output": ..., ...}, or {"status": "CONTINUE", "continuation": {...}}
+    when the invocation was about to time out. Pass that back in as the event to carry on.
+    If it fails, the upload and the listing are removed before the error is raised, so nothing is
+    left behind (or billed); run it again with the original event.
+    '''
+    cold = not _modules
+    fetch, RateLimiter = fetch_modules()
+    state = event.get("continuation") or start(event, fetch)
+    store = object_store(state["output"])
+    accessanalyzer = client("accessanalyzer", state["arn"].split(":")[3], state["workers"])
+    limiter = RateLimiter(workers=state["workers"])
+    writer = None
+    try:
+        # The listing is saved next to the output on the first invocation, so later ones fetch the same findings in the same order
+        if state["listing_key"] is None:
+            listed = fetch.list_all_findings(accessanalyzer, state["arn"], limiter, fetch.build_filter(state["filters"]))
+            state["listing_key"] = f"{state['key']}.listing.json"
+            state["total"] = len(listed["findings"])
+            store.put_object(Bucket=state["bucket"], Key=state["listing_key"], Body=json.dumps([f["id"] for f in listed["findings"]]).encode())
+        listing = json.loads(read_object(store, state["bucket"], state["listing_key"]))
+
+        writer = MultipartWriter(store, state["bucket"], state["key"], state["upload"])
+        ids = listing[state["done"]:]
+        findings = fetch.fetch_in_order(accessanalyzer, state["arn"], within_budget(ids, context), limiter, state["workers"], progress=False)
+        try:
+            # Once the time is nearly up no more calls are started, but those in flight are waited for and written
+            for finding_id, result in findings:
+                if result is None:
+                    state["failed"].append(finding_id)
+                else:
+                    writer.write(fetch.trim_response_metadata(result))
+                state["done"] += 1
+        finally:
+            findings.close()
+
+        finished = state["done"] == len(listing)
+        if finished:
+            writer.close()
+            store.delete_object(Bucket=state["bucket"], Key=state["listing_key"])
+        else:
+            state["upload"] = writer.suspend()
+    except BaseException:
+        abort(store, state, writer)
+        raise
+
+    response = {
+        "cold_start": cold,
+        "timings": dict(_timings) if cold else {},
+        "api": limiter.stats(),
+    }
+    if not finished:
+        state["invocation"] += 1
+        print(f"Handing over after {state['done']} of {state['total']} findings (invocation {state['invocation'] - 1})")
+        response.update(status="CONTINUE", continuation=state)
+        if SELF_INVOKE:
+            invoke_next(context, {"continuation": state})
+        return response
+
+    response.update(
+        status="COMPLETE",
+        output=f"s3://{state['bucket']}/{state['key']}" if state["bucket"] else f"file://{state['key']}",
+        findings=state["done"] - len(state["failed"]),
+        failed=state["failed"],
+        invocations=state["invocation"],
+    )
+    return response
+
+
+def start(event, fetch):
+    # State of a new run, passed from invocation to invocation
+    arn = event.get("analyzer_arn") or os.getenv("ANALYZER_ARN")
+    if not arn or not arn.startswith("arn:aws:access-analyzer:"):
+        raise ValueError(f"No valid analyzer ARN: {arn}")
+    filters = event.get("filters") or {}
+    output = event.get("output") or OUTPUT
+    if not output:
+        raise ValueError("No output given (e.g. s3://my-bucket/findings/)")
+    bucket, prefix = split_url(output)
+
+    account_id = arn.split(":")[4]
+    analyzer = arn.split("/")[1]
+    now = datetime.now().strftime("%Y%m%d-%H%M")
+    return {
+        "arn": arn,
+        "filters": filters,
+        "workers": int(event.get("workers") or WORKERS),
+        "output": output,
+        "bucket": bucket,
+        "key": f"{prefix}{now}-{account_id}-{analyzer}{fetch.filter_suffix(filters)}.details.ndjson",
+        "listing_key": None,
+        "total": None,
+        "done": 0,
+        "failed": [],
+        "upload": None,
+        "invocation": 1,
+    }
+
+
+def within_budget(ids, context):
+    # (finding_id, None) pairs for fetch_in_order, until less than TIME_MARGIN_MS is left (but at least one)
+    for i, finding_id in enumerate(ids):
+        if i and context.get_remaining_time_in_millis() < TIME_MARGIN_MS:
+            return
+        yield finding_id, None
+
+
+def fetch_modules():
+    # Import findings_fetch and rate_limiter (and with them boto3) on first use only
+    if "findings_fetch" not in _modules:
+        started = time.perf_counter()
+        import findings_fetch
+        from rate_limiter import RateLimiter
+        _modules["findings_fetch"] = findings_fetch
+        _modules["RateLimiter"] = RateLimiter
+        _timings["lazy_import"] = round(time.perf_counter() - started, 4)
+        _timings["module_import"] = IMPORT_SECONDS
+    return _modules["findings_fetch"], _modules["RateLimiter"]
+
+
+def client(service, region=None, workers=1):
+    # boto3 client, created once per execution environment
+    key = (service, region, workers)
+    if key not in _clients:
+        started = time.perf_counter()
+        if service == "accessanalyzer":
+            _clients[key] = fetch_modules()[0].new_client(workers, region)
+        else:
+            import boto3
+            _clients[key] = boto3.client(service, region_name=region, endpoint_url=S3_ENDPOINT_URL if service == "s3" else None)
+        _timings[f"{service}_client"] = round(time.perf_counter() - started, 4)
+    return _clients[key]
+
+
+def object_store(output):
+    # s3://bucket/prefix/ goes to S3 (or S3_ENDPOINT_URL); file:///path/ to a local directory
+    if output.startswith("s3://"):
+        return client("s3")
+    if output.startswith("file://"):
+        return LocalObjectStore()
+    raise ValueError(f"Unknown output: {output}")
+
+
+def split_url(output):
+    # ("bucket", "prefix/") for s3://bucket/prefix/; ("", "/path/") for file:///path/
+    scheme, path = output.split("://", 1)
+    if scheme == "file":
+        return "", path
+    bucket, _, prefix = path.partition("/")
+    return bucket, prefix
+
+
+def read_object(store, bucket, key):
+    body = store.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        return body.read()
+    finally:
+        body.close()
+
+
+def abort(store, state, writer):
+    # Remove what a failed run has uploaded, best effort, so the original error is the one raised
+    try:
+        if writer is None:
+            writer = MultipartWriter(store, state["bucket"], state["key"], state["upload"])
+        writer.abort()
+        if state["listing_key"]:
+            store.delete_object(Bucket=state["bucket"], Key=state["listing_key"])
+    except Exception as e:
+        print(f"Could not clean up {state['key']}: {e}")
+
+
+def invoke_next(context, event):
+    client("lambda").invoke(FunctionName=context.invoked_function_arn, InvocationType="Event", Payload=json.dumps(event).encode())
+
+
+class MultipartWriter:
+    '''
+    Writes findings as ndjson to an object with a multipart upload, a part at a time.
+    suspend() saves what's buffered (less than a part) as a small object and returns the upload state;
+    pass that state back in to carry on in another invocation. Small outputs are written with one put_object.
+    '''
+
+    def __init__(self, store, bucket, key, state=None, part_size=PART_SIZE):
+        self.store = store
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        state = state or {"upload_id": None, "parts": [], "tail_key": None}
+        self.upload_id = state["upload_id"]
+        self.parts = list(state["parts"])
+        self.buffer = []
+        self.size = 0
+        if state["tail_key"]:
+            tail = read_object(self.store, bucket, state["tail_key"])
+            self.store.delete_object(Bucket=bucket, Key=state["tail_key"])
+            self.buffer.append(tail)
+            self.size = len(tail)
+
+    def write(self, finding):
+        line = (json.dumps(finding, default=str) + "\n").encode()
+        self.buffer.append(line)
+        self.size += len(line)
+        if self.size >= self.part_size:
+            self.upload_part()
+
+    def upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.store.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        number = len(self.parts) + 1
+        response = self.store.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=b"".join(self.buffer))
+        self.parts.append({"PartNumber": number, "ETag": response["ETag"]})
+        self.buffer = []
+        self.size = 0
+
+    def suspend(self):
+        tail_key = None
+        if self.buffer:
+            tail_key = f"{self.key}.tail"
+            self.store.put_object(Bucket=self.bucket, Key=tail_key, Body=b"".join(self.buffer))
+        return {"upload_id": self.upload_id, "parts": self.parts, "tail_key": tail_key}
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.store.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = []
+        self.size = 0
+
+    def close(self):
+        if self.upload_id is None:
+            self.store.put_object(Bucket=self.bucket, Key=self.key, Body=b"".join(self.buffer))
+            return
+        if self.buffer:
+            self.upload_part()
+        self.store.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts})
+
+
+class LocalObjectStore:
+    '''
+    Stand-in for an S3 client that keeps objects as files (file:///path/), with just enough of the API
+    (put, get and delete object, and multipart uploads) to run the handler locally.
+    '''
+
+    def put_object(self, Bucket, Key, Body):
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(Body)
+        return {}
+
+    def get_object(self, Bucket, Key):
+        return {"Body": open(self.path(Bucket, Key), "rb")}
+
+    def delete_object(self, Bucket, Key):
+        path = self.path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"{os.getpid()}-{time.time_ns()}"
+        os.makedirs(self.path(Bucket, f"{Key}.uploads/{upload_id}"))
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.put_object(Bucket, f"{Key}.uploads/{UploadId}/{PartNumber:05d}", Body)
+        return {"ETag": f'"{PartNumber}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        uploads = self.path(Bucket, f"{Key}.uploads")
+        for name in os.listdir(os.path.join(uploads, UploadId)):
+            os.remove(os.path.join(uploads, UploadId, name))
+        os.rmdir(os.path.join(uploads, UploadId))
+        if not os.listdir(uploads):
+            os.rmdir(uploads)
+        return {}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with open(self.path(Bucket, Key), "wb") as target:
+            for part in MultipartUpload["Parts"]:
+                part_path = self.path(Bucket, f"{Key}.uploads/{UploadId}/{part['PartNumber']:05d}")
+                with open(part_path, "rb") as source:
+                    target.write(source.read())
+                os.remove(part_path)
+        os.rmdir(self.path(Bucket, f"{Key}.uploads/{UploadId}"))
+        os.rmdir(self.path(Bucket, f"{Key}.uploads"))
+        return {}
+
+    def path(self, Bucket, Key):
+        return os.path.join(Bucket, Key) if Bucket else Key
+
+
+class LocalContext:
+    '''
+    Stand-in for the Lambda context: a time budget per invocation.
+    '''
+
+    invoked_function_arn = "local"
+
+    def __init__(self, timeout_ms):
+        self.deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+IMPORT_SECONDS = round(time.perf_counter() - IMPORT_STARTED, 4)
+
+
+if __name__ == "__main__":
+    # Run the handler locally, invocation after invocation, as Lambda (or Step Functions) would
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the Lambda handler locally.')
+    parser.add_argument('--arn', dest='arn', default=os.getenv("ANALYZER_ARN"), help='The ARN of the analyzer to use (default: ANALYZER_ARN env var)')
+    parser.add_argument('--output', dest='output', default=OUTPUT or "file://./", help='Where to write the details file: s3://bucket/prefix/ or file:///path/ (default: file://./)')
+    parser.add_argument('--workers', dest='workers', type=int, default=WORKERS, help=f'The number of findings to fetch concurrently (default: {WORKERS})')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=900, help='Seconds each simulated invocation may run (default: 900, the Lambda maximum)')
+    args = parser.parse_args()
+
+    print(f"Module import:     {IMPORT_SECONDS}s")
+    event = {"analyzer_arn": args.arn, "output": args.output, "workers": args.workers}
+    while True:
+        response = handler(event, LocalContext(args.timeout * 1000))
+        if response["timings"]:
+            print(f"Cold start:        {response['timings']}")
+        if response["status"] == "COMPLETE":
+            break
+        event = {"continuation": response["continuation"]}
+    print(f"Results written to {response['output']}")
+    print(f"Findings:          {response['findings']} in {response['invocations']} invocations")
+    if response["failed"]:
+        print(f"Failed:            {len(response['failed'])}")
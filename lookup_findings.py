@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import os
+import sys
+import time
+from findings_index import index_path, open_index
+from findings_io import is_sharded
+from findings_store import FindingsStore, is_store
+
+MAX_LEN = 20 # Max title length
+
+
+def main(filename, finding_ids, as_json=False, rebuild=False):
+    if not os.path.exists(filename):
+        usage(f"File not found: {filename}")
+
+    start = time.perf_counter()
+    if is_store(filename):
+        # A store is already indexed by id
+        index = FindingsStore(filename)
+        built = False
+    else:
+        index = open_index(filename, rebuild)
+        built = index.built
+    opened_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    try:
+        findings = {}
+        for finding_id in finding_ids:
+            finding = index.get(finding_id)
+            if finding is not None:
+                findings[finding_id] = finding
+    finally:
+        index.close()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if as_json:
+        print(json.dumps([findings[finding_id] for finding_id in finding_ids if finding_id in findings], indent=4, default=str))
+        return
+
+    for finding_id in finding_ids:
+        finding = findings.get(finding_id)
+        if finding is None:
+            print(f"{finding_id}  not found")
+        else:
+            print(f"{finding_id}  {finding.get('status', '').ljust(8)}  {finding.get('resourceType', '').ljust(MAX_LEN + 6)}  {finding.get('resource', '')}")
+    print()
+
+    t = "Filename"
+    print(f"{t.ljust(MAX_LEN)} : {filename}")
+    if not is_store(filename):
+        t = "Index"
+        where = "one per shard" if is_sharded(filename) else index_path(filename)
+        print(f"{t.ljust(MAX_LEN)} : {where} ({'built' if built else 'loaded'} in {opened_ms:.1f} ms)")
+    t = "Found"
+    print(f"{t.ljust(MAX_LEN)} : {len(findings)} of {len(finding_ids)} ({elapsed_ms:.1f} ms)")
+
+
+def usage(message):
+    print(message)
+    print("Usage: python lookup_findings.py -f <details file or store> --id <id>[,<id>...] [--ids-file <file>] [--json] [--rebuild]")
+    print("       ids can also be piped in, one per line, with --ids-file -")
+    exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Get findings by id from a details file, through its index.')
+    parser.add_argument('-f', dest='filename', help='The details file (json, ndjson or a sharded manifest) or findings store to use')
+    parser.add_argument('--id', dest='ids', help='Comma separated finding ids')
+    parser.add_argument('--ids-file', dest='ids_file', help='A file of finding ids, one per line, or - for stdin')
+    parser.add_argument('--json', dest='json', action='store_true', help='Print the findings found as JSON')
+    parser.add_argument('--rebuild', dest='rebuild', action='store_true', help='Build the index again, even if it is up to date')
+    args = parser.parse_args()
+
+    # Unset env vars - read from .env file
+    os.environ.pop('FINDINGS_FILE', None)
+
+    # Load dotenv
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    filename = args.filename or os.getenv("FINDINGS_FILE")
+    if not filename:
+        usage("No filename provided")
+
+    finding_ids = [finding_id.strip() for finding_id in args.ids.split(",")] if args.ids else []
+    if args.ids_file:
+        with (sys.stdin if args.ids_file == "-" else open(args.ids_file, "r")) as file:
+            finding_ids += [line.strip() for line in file]
+    finding_ids = [finding_id for finding_id in dict.fromkeys(finding_ids) if finding_id]
+    if not finding_ids:
+        usage("No finding ids provided")
+
+    main(filename, finding_ids, args.json, args.rebuild)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import os
+import time
+from findings_store import FindingsStore
+
+MAX_LEN = 20 # Max title length
+DEBUG = False
+
+
+def main(store_path, filters, updated_since=None, limit=None, count_only=False, as_json=False):
+    if not os.path.exists(store_path):
+        usage(f"Store not found: {store_path}")
+
+    store = FindingsStore(store_path)
+
+    start = time.perf_counter()
+    findings = list(store.query(updated_since=updated_since, limit=limit, **filters))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    store.close()
+
+    if as_json:
+        print(json.dumps(findings, indent=4, default=str))
+        return
+
+    if not count_only:
+        for finding in findings:
+            print(f"{finding['id']}  {finding.get('status', '').ljust(8)}  {finding.get('resourceType', '').ljust(MAX_LEN + 6)}  {finding.get('resource', '')}")
+        print()
+
+    t = "Store"
+    print(f"{t.ljust(MAX_LEN)} : {store_path}")
+    for key, value in filters.items():
+        if value is not None:
+            print(f"{key.ljust(MAX_LEN)} : {value}")
+    if updated_since:
+        t = "updated_since"
+        print(f"{t.ljust(MAX_LEN)} : {updated_since}")
+    t = "Findings"
+    print(f"{t.ljust(MAX_LEN)} : {len(findings)} ({elapsed_ms:.1f} ms)")
+
+
+def d_print(message):
+    print(f"DEBUG: {message}") if DEBUG else None
+
+
+def usage(message):
+    print(message)
+    print("Usage: python query_findings.py -s <store> [--status <status>] [--resource_type <type>] [--owner_account <account>]")
+    print("           [--is_public <true|false>] [--principal <principal>] [--updated_since <date>] [--limit <n>] [--count] [--json]")
+    print("       or set the FINDINGS_STORE env var")
+    exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query a findings store written by get_all_findings.py --store.')
+    parser.add_argument('-s', dest='store', help='The findings store to use (e.g. findings.db)')
+    parser.add_argument('--status', dest='status', help='e.g. ACTIVE')
+    parser.add_argument('--resource_type', dest='resource_type', help='e.g. AWS::S3::Bucket')
+    parser.add_argument('--owner_account', dest='owner_account', help='e.g. 112233445566')
+    parser.add_argument('--is_public', dest='is_public', choices=['true', 'false'], help='Only public (true) or non-public (false) findings')
+    parser.add_argument('--principal', dest='principal', help='External principal, e.g. 999988887777 or an IdP ARN')
+    parser.add_argument('--finding_type', dest='finding_type', help='e.g. ExternalAccess')
+    parser.add_argument('--updated_since', dest='updated_since', help='Only findings updated at or after this date (e.g. 2024-07-01)')
+    parser.add_argument('--limit', dest='limit', type=int, help='Maximum number of findings to return')
+    parser.add_argument('--count', dest='count', action='store_true', help='Only print the number of findings')
+    parser.add_argument('--json', dest='json', action='store_true', help='Print the matching findings as JSON')
+    args = parser.parse_args()
+
+    # Unset env vars - read from .env file
+    os.environ.pop('DEBUG', None)
+    os.environ.pop('FINDINGS_STORE', None)
+
+    # Load dotenv
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    DEBUG = bool(os.getenv("DEBUG")) if os.getenv("DEBUG") != None else DEBUG
+    d_print(f"DEBUG {DEBUG}, {type(DEBUG)}")
+
+    store_path = args.store if args.store != None else os.getenv("FINDINGS_STORE")
+    if not store_path:
+        usage("No store provided")
+
+    filters = {
+        "status": args.status.upper() if args.status else None,
+        "resource_type": args.resource_type,
+        "owner_account": args.owner_account,
+        "is_public": None if args.is_public is None else args.is_public == "true",
+        "principal": args.principal,
+        "finding_type": args.finding_type,
+    }
+
+    main(store_path, filters, updated_since=args.updated_since, limit=args.limit, count_only=args.count, as_json=args.json)
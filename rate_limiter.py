@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+import botocore
+import botocore.exceptions
+
+INITIAL_RATE = 10.0 # Starting request rate (calls per second), until the latency of the first call is known
+MIN_RATE = 1.0 # Never go slower than this
+MAX_RATE = 1000.0 # Never go faster than this
+RATE_INCREASE = 1.1 # Rate is multiplied by this after each window of successful calls (a second's worth at the current rate)
+RATE_DECREASE = 0.5 # Rate is multiplied by this on throttling
+DECREASE_INTERVAL = 1.0 # Seconds: throttles this close together (e.g. of calls already in flight) only cut the rate once
+
+BASE_BACKOFF = 0.5 # Seconds, doubled on each retry of the same error class
+MAX_BACKOFF = 20.0 # Seconds, upper bound for a single backoff
+
+# Retries allowed per call, per error class. Anything not listed is not retried
+RETRY_BUDGET = {
+    "throttling": 8,
+    "transient": 4,
+    "connection": 3,
+}
+
+# Errors raised before there's a response: connection failures, and read timeouts or dropped connections (HTTPClientError).
+# botocore's own retries are turned off (see get_all_findings.new_client), so these are retried here
+CONNECTION_ERRORS = (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)
+RETRIED_ERRORS = (botocore.exceptions.ClientError,) + CONNECTION_ERRORS
+
+THROTTLING_ERRORS = ["ThrottlingException", "TooManyRequestsException", "Throttling", "RequestLimitExceeded"]
+TRANSIENT_ERRORS = ["InternalServerException", "ServiceUnavailableException", "InternalFailure", "RequestTimeout"]
+
+
+class RateLimiter:
+    '''
+    Token bucket shared by every thread making Access Analyzer calls.
+    The rate halves on throttling (once a second at most) and grows by 10% for each second's worth of successful calls.
+    Without a starting rate, it starts at workers / latency of the first call: what the workers can
+    keep up with, so the limiter doesn't hold back the concurrency until it's throttled.
+    With metrics (a RunMetrics), the latency of every call is recorded per operation.
+    '''
+
+    def __init__(self, rate=None, min_rate=MIN_RATE, max_rate=None, workers=1, metrics=None):
+        self.max_rate = max_rate or max(MAX_RATE, rate or 0)
+        self.rate = min(self.max_rate, rate or INITIAL_RATE)
+        self.min_rate = min_rate
+        self.workers = workers
+        self.calibrate = rate is None # Set the rate from the first call's latency
+        self.successes = 0 # Successful calls since the rate last changed
+        self.decreased = None # When the rate was last cut
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.started = self.last
+        self.lock = threading.Lock()
+        self.metrics = metrics
+
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self.waited = 0.0 # Seconds spent waiting for a token
+        self.backed_off = 0.0 # Seconds spent backing off before retries
+
+    def acquire(self):
+        # Block until a token is available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+    def on_success(self, latency):
+        with self.lock:
+            if self.calibrate:
+                self.calibrate = False
+                self.rate = min(self.max_rate, max(self.rate, self.workers / max(latency, 0.001)))
+                return
+            self.successes += 1
+            if self.successes >= self.rate:
+                self.successes = 0
+                self.rate = min(self.max_rate, self.rate * RATE_INCREASE)
+
+    def on_throttle(self):
+        with self.lock:
+            self.throttles += 1
+            self.calibrate = False
+            self.successes = 0
+            self.tokens = 0.0
+            now = time.monotonic()
+            if self.decreased is None or now - self.decreased >= DECREASE_INTERVAL:
+                self.decreased = now
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+
+    def call(self, fn, **kwargs):
+        # Call fn(**kwargs) at the governed rate, retrying with exponential backoff and full jitter
+        attempts = {}
+        while True:
+            self.acquire()
+            start = time.perf_counter()
+            try:
+                result = fn(**kwargs)
+            except RETRIED_ERRORS as e:
+                self.observe(fn, start)
+                error_class = classify_error(e)
+                if error_class == "throttling":
+                    self.on_throttle()
+                attempt = attempts.get(error_class, 0) + 1
+                attempts[error_class] = attempt
+                if attempt > RETRY_BUDGET.get(error_class, 0):
+                    raise
+                wait = backoff(attempt)
+                with self.lock:
+                    self.retries += 1
+                    self.backed_off += wait
+                time.sleep(wait)
+                continue
+            self.observe(fn, start)
+            self.on_success(time.perf_counter() - start)
+            return result
+
+    def observe(self, fn, start):
+        if self.metrics:
+            self.metrics.observe(getattr(fn, "__name__", "call"), time.perf_counter() - start)
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "calls": self.calls,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "elapsed": round(elapsed, 3),
+                "calls_per_second": round(self.calls / elapsed, 2) if elapsed > 0 else 0.0,
+                "rate": round(self.rate, 2),
+                "waited": round(self.waited, 3),
+                "backed_off": round(self.backed_off, 3),
+            }
+
+
+def classify_error(e):
+    if isinstance(e, CONNECTION_ERRORS):
+        return "connection"
+    code = e.response.get("Error", {}).get("Code", "")
+    if code in THROTTLING_ERRORS:
+        return "throttling"
+    if code in TRANSIENT_ERRORS:
+        return "transient"
+    return code
+
+
+def backoff(attempt):
+    # Full jitter: sleep a random time between 0 and the exponential cap
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
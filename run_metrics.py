@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Upper bounds (seconds) of the API latency histogram buckets, as in Prometheus
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+PROMETHEUS_PREFIX = "access_analyzer_findings"
+
+
+class RunMetrics:
+    '''
+    Timings and counts for one run of a script: wall and CPU time per phase, a latency histogram
+    per API operation, and counters (API calls, throttles, retries, bytes written...).
+    Phases can be entered many times and from several threads; their times add up.
+    CPU time is that of the thread running the phase.
+    '''
+
+    def __init__(self, script):
+        self.script = script
+        self.started = time.time()
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+        self.lock = threading.Lock()
+        self.phases = {} # name -> {"wall", "cpu", "count"}
+        self.latencies = {} # operation -> {"buckets", "count", "sum"}
+        self.counters = Counter()
+
+    @contextmanager
+    def phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add_phase(self, name, wall, cpu, count=1):
+        with self.lock:
+            phase = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "count": 0})
+            phase["wall"] += wall
+            phase["cpu"] += cpu
+            phase["count"] += count
+
+    def observe(self, operation, seconds):
+        # Record the latency of one API call
+        with self.lock:
+            latency = self.latencies.get(operation)
+            if latency is None:
+                latency = self.latencies[operation] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0}
+            latency["buckets"][bucket_index(seconds)] += 1
+            latency["count"] += 1
+            latency["sum"] += seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def add_api_stats(self, stats):
+        # Counters from RateLimiter.stats()
+        self.count("api_calls", stats["calls"])
+        self.count("api_throttles", stats["throttles"])
+        self.count("api_retries", stats["retries"])
+        self.count("api_rate_limit_wait_seconds", stats["waited"])
+        self.count("api_backoff_seconds", stats["backed_off"])
+
+    def merge(self, other):
+        # Add in the to_dict() of another run, e.g. from a worker process
+        for name, phase in other["phases"].items():
+            self.add_phase(name, phase["wall"], phase["cpu"], phase["count"])
+        with self.lock:
+            for operation, other_latency in other["api_latency"].items():
+                latency = self.latencies.setdefault(operation, {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0})
+                latency["buckets"] = [a + b for a, b in zip(latency["buckets"], other_latency["buckets"])]
+                latency["count"] += other_latency["count"]
+                latency["sum"] += other_latency["sum"]
+            self.counters.update(other["counters"])
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "script": self.script,
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                "wall": round(time.perf_counter() - self.started_wall, 4),
+                "cpu": round(time.process_time() - self.started_cpu, 4),
+                "phases": {
+                    name: {"wall": round(phase["wall"], 4), "cpu": round(phase["cpu"], 4), "count": phase["count"]}
+                    for name, phase in self.phases.items()
+                },
+                "api_latency": {
+                    operation: {
+                        "buckets": list(latency["buckets"]),
+                        "le": LATENCY_BUCKETS + ["+Inf"],
+                        "count": latency["count"],
+                        "sum": round(latency["sum"], 4),
+                    }
+                    for operation, latency in self.latencies.items()
+                },
+                "counters": {name: round(value, 4) for name, value in self.counters.items()},
+            }
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.to_dict(), indent=4))
+        return path
+
+    def write_prometheus(self, path):
+        # Textfile collector format for the node exporter; written atomically so it's never read half written
+        write_atomically(path, to_prometheus(self.to_dict()))
+        return path
+
+
+def bucket_index(seconds):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+def to_prometheus(metrics):
+    p = PROMETHEUS_PREFIX
+    script = f'script="{metrics["script"]}"'
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f"# HELP {p}_{name} {help_text}")
+        lines.append(f"# TYPE {p}_{name} {kind}")
+
+    metric("run_timestamp_seconds", "gauge", "When the run started")
+    lines.append(f"{p}_run_timestamp_seconds{{{script}}} {datetime.fromisoformat(metrics['started']).timestamp():.0f}")
+    metric("run_wall_seconds", "gauge", "Wall time of the run")
+    lines.append(f"{p}_run_wall_seconds{{{script}}} {metrics['wall']}")
+    metric("run_cpu_seconds", "gauge", "CPU time of the run")
+    lines.append(f"{p}_run_cpu_seconds{{{script}}} {metrics['cpu']}")
+
+    metric("phase_wall_seconds", "gauge", "Wall time spent in each phase")
+    for name, phase in metrics["phases"].items():
+        lines.append(f'{p}_phase_wall_seconds{{{script},phase="{name}"}} {phase["wall"]}')
+    metric("phase_cpu_seconds", "gauge", "CPU time spent in each phase")
+    for name, phase in metrics["phases"].items():
+        lines.append(f'{p}_phase_cpu_seconds{{{script},phase="{name}"}} {phase["cpu"]}')
+
+    metric("api_latency_seconds", "histogram", "Latency of each API call, by operation")
+    for operation, latency in metrics["api_latency"].items():
+        labels = f'{script},operation="{operation}"'
+        cumulative = 0
+        for bound, count in zip(latency["le"], latency["buckets"]):
+            cumulative += count
+            lines.append(f'{p}_api_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{p}_api_latency_seconds_sum{{{labels}}} {latency['sum']}")
+        lines.append(f"{p}_api_latency_seconds_count{{{labels}}} {latency['count']}")
+
+    for name, value in metrics["counters"].items():
+        metric(name, "gauge", name.replace("_", " ").capitalize())
+        lines.append(f"{p}_{name}{{{script}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+def eta(done, total, elapsed):
+    # " (12.3/s, ETA 1:05)" from progress so far; just the rate if the total isn't known
+    if not done or elapsed <= 0:
+        return ""
+    rate = done / elapsed
+    if total is None:
+        return f" ({rate:.1f}/s)"
+    remaining = max(0, total - done) / rate
+    minutes, seconds = divmod(int(remaining), 60)
+    hours, minutes = divmod(minutes, 60)
+    left = f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+    return f" ({rate:.1f}/s, ETA {left})"
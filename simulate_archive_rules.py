@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import os
+import time
+from finding_filter import RuleSet
+from findings_io import iter_findings
+
+MAX_LEN = 20 # Max title length
+SHOW_IDS = 10 # How many finding ids to show per rule with --ids
+
+
+class Simulation:
+    '''
+    What a set of archive rules would do to a snapshot: for each rule, the active findings it would archive,
+    the archived findings it matches (already archived, by it or by hand) and the active findings no other rule
+    would archive. Resolved findings are left alone, as archive rules don't apply to them.
+    '''
+
+    def __init__(self, rules):
+        self.rules = RuleSet(rules)
+        self.total = 0
+        self.active = 0
+        self.archives = [[] for _ in self.rules.names] # Ids of the active findings each rule would archive
+        self.matches_archived = [0] * len(self.rules)
+        self.only = [0] * len(self.rules)
+        self.archived = [] # Ids of the active findings any rule would archive
+
+    def add(self, finding):
+        self.total += 1
+        status = finding.get('status')
+        if status == "RESOLVED":
+            return
+        matched = self.rules.matches(finding)
+        if status == "ARCHIVED":
+            for i in matched:
+                self.matches_archived[i] += 1
+            return
+        self.active += 1
+        if not matched:
+            return
+        self.archived.append(finding['id'])
+        for i in matched:
+            self.archives[i].append(finding['id'])
+        if len(matched) == 1:
+            self.only[matched[0]] += 1
+
+    def report(self):
+        return {
+            "findings": self.total,
+            "active": self.active,
+            "archived": len(self.archived),
+            "rules": [
+                {
+                    "ruleName": name,
+                    "archives": len(self.archives[i]),
+                    "alreadyArchived": self.matches_archived[i],
+                    "onlyThisRule": self.only[i],
+                    "ids": self.archives[i],
+                }
+                for i, name in enumerate(self.rules.names)
+            ],
+            "ids": self.archived,
+        }
+
+
+def main(filename, rules, output=None, show_ids=0):
+    f = "Filename"
+    print(f"{f.ljust(MAX_LEN)} : {filename}")
+    t = "Rules"
+    print(f"{t.ljust(MAX_LEN)} : {len(rules)}")
+
+    start = time.perf_counter()
+    simulation = Simulation(rules)
+    for finding in iter_findings(filename):
+        simulation.add(finding)
+    elapsed = time.perf_counter() - start
+
+    t = "Findings"
+    print(f"{t.ljust(MAX_LEN)} : {simulation.total} ({simulation.active} active, in {elapsed:.2f}s)")
+    t = "Would archive"
+    print(f"{t.ljust(MAX_LEN)} : {len(simulation.archived)} of {simulation.active} active findings")
+    print()
+
+    width = max([MAX_LEN] + [len(name) for name in simulation.rules.names])
+    print(f"{'Rule'.ljust(width)} : archives, already archived, only this rule")
+    for i, name in enumerate(simulation.rules.names):
+        print(f"{name.ljust(width)} : {len(simulation.archives[i])}, {simulation.matches_archived[i]}, {simulation.only[i]}")
+        for finding_id in simulation.archives[i][:show_ids]:
+            print(f"  {finding_id}")
+        if show_ids and len(simulation.archives[i]) > show_ids:
+            print(f"  ... {len(simulation.archives[i]) - show_ids} more")
+    print()
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(simulation.report(), file, indent=4)
+        t = "Report"
+        print(f"{t.ljust(MAX_LEN)} : {output}")
+
+
+def load_rules(filename):
+    # {ruleName: filter} from a rules file: a list_archive_rules response ({"archiveRules": [...]}),
+    # a list of {"ruleName": ..., "filter": ...} or {ruleName: filter}
+    with open(filename, "r") as file:
+        rules = json.load(file)
+    if isinstance(rules, dict) and "archiveRules" in rules:
+        rules = rules["archiveRules"]
+    if isinstance(rules, list):
+        return {rule.get('ruleName', f"rule-{i + 1}"): rule['filter'] for i, rule in enumerate(rules)}
+    return rules
+
+
+def analyzer_rules(arn):
+    # {ruleName: filter} of the archive rules the analyzer has now.
+    # Paged through the rate limiter, as new_client leaves retrying throttled calls to it
+    from findings_fetch import new_client
+    from rate_limiter import RateLimiter
+    accessanalyzer = new_client(1, arn.split(":")[3])
+    limiter = RateLimiter()
+    kwargs = {"analyzerName": arn.split("/")[-1]}
+    rules = {}
+    while True:
+        page = limiter.call(accessanalyzer.list_archive_rules, **kwargs)
+        for rule in page['archiveRules']:
+            rules[rule['ruleName']] = rule['filter']
+        if not page.get('nextToken'):
+            return rules
+        kwargs["nextToken"] = page['nextToken']
+
+
+def usage(message):
+    print(message)
+    print("Usage: python simulate_archive_rules.py -f <filename> [--rules <rules file>] [--filter '<filter json>'] [--arn <analyzer ARN>] [--ids [N]] [-o <report file>]")
+    print("       e.g. --filter '{\"resourceType\": {\"eq\": [\"AWS::S3::Bucket\"]}, \"isPublic\": {\"eq\": [\"false\"]}}'")
+    exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show which findings a set of archive rules would archive, without creating them.')
+    parser.add_argument( '-f', dest='filename', help='The filename to use (json, ndjson, a sharded manifest or findings store)')
+    parser.add_argument( '--rules', dest='rules', help='A json file of archive rules: a list_archive_rules response, a list of {ruleName, filter} or {ruleName: filter}')
+    parser.add_argument( '--filter', dest='filters', action='append', default=[], help='An archive rule filter as json, in the API syntax (eq, neq, contains, exists). Can be repeated')
+    parser.add_argument( '--arn', dest='arn', help='Also simulate the archive rules this analyzer has now')
+    parser.add_argument( '--ids', dest='ids', type=int, nargs='?', const=SHOW_IDS, default=0, help=f'Show the ids of the findings each rule would archive (default: {SHOW_IDS})')
+    parser.add_argument( '-o', dest='output', help='Write the report, with all the finding ids, here as json')
+    args = parser.parse_args()
+
+    # Unset env vars - read from .env file
+    os.environ.pop('FINDINGS_FILE', None)
+
+    # Load dotenv
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    filename = args.filename or os.getenv("FINDINGS_FILE")
+    if not filename:
+        usage("No filename provided")
+    if not os.path.exists(filename):
+        usage(f"File not found: {filename}")
+
+    rules = {}
+    if args.arn:
+        rules.update(analyzer_rules(args.arn))
+    if args.rules:
+        rules.update(load_rules(args.rules))
+    for i, criteria in enumerate(args.filters):
+        try:
+            rules[f"filter-{i + 1}"] = json.loads(criteria)
+        except json.JSONDecodeError as e:
+            usage(f"Filter {i + 1} isn't valid json: {e}")
+    if not rules:
+        usage("No rules provided")
+
+    try:
+        RuleSet(rules)
+    except ValueError as e:
+        usage(f"Invalid rule: {e}")
+
+    main(filename, rules, args.output, args.ids)
@@ -3,228 +3,234 @@
 import json
 import argparse
 import os
+from collections import Counter
+from finding_model import external_access, principal_of
+from findings_io import has_changes, is_sharded, iter_findings, shard_paths
+from run_metrics import RunMetrics
 
 TRIMMED = True # Set to True to exclude metadata (get_all_findings.py)
 MAX_LEN = 20 # Max title length
 DEBUG = False
+STATUSES = ['ACTIVE', 'ARCHIVED', 'RESOLVED']
+METRICS_FILE = None # Write the run metrics here as json
+PROMETHEUS_FILE = None # Write the run metrics here in Prometheus textfile format
+RESCAN = False # Set to True to always read the whole file, even if it has an up to date summary sidecar
+PROCESSES = None # Processes used to summarise a sharded snapshot (default: one per CPU)
+SIDECAR_VERSION = 2 # Version 1 counted principals from the wrong place
 
 
 def main(filename):
     f = "Filename"
     print(f"{f.ljust(MAX_LEN)}   : {filename}\n")
 
-    # Open json file for reading
-    with open(filename, 'r') as file:
-        data = json.load(file)
+    metrics = RunMetrics("summarise_findings")
 
-    # External
-    by_external(data)
-
-    # Public
-    by_public(data)
-
-    # By owner
-    by_owner(data)
-
-    # By principal
-    by_principal(data)
+    # Use the summary get_all_findings.py wrote alongside the file, if it's still up to date
+    with metrics.phase("read_sidecar"):
+        summary = None if RESCAN else read_sidecar(filename)
+    if summary:
+        f = "Summary"
+        print(f"{f.ljust(MAX_LEN)}   : {sidecar_path(filename)}\n")
+    else:
+        # Read json or ndjson one finding at a time, counting everything in one pass;
+        # the shards of a sharded snapshot are summarised in parallel and the summaries added up
+        with metrics.phase("summarise"):
+            if is_sharded(filename):
+                summary = summarise_shards(shard_paths(filename), PROCESSES)
+            else:
+                summary = summarise(iter_findings(filename))
+        metrics.count("findings_read", summary.total)
 
-    # By status
-    status_loop(data)
+    with metrics.phase("print"):
+        print_summary(summary)
 
-    # By resource type
-    resource_type_loop(data)
+    if METRICS_FILE:
+        metrics.write_json(METRICS_FILE)
+    if PROMETHEUS_FILE:
+        metrics.write_prometheus(PROMETHEUS_FILE)
 
 
 def d_print(message):
     print(f"DEBUG: {message}") if DEBUG else None
 
 
-def status_loop(data):
-    statuses = ['ACTIVE', 'ARCHIVED', 'RESOLVED']
-    sstatus_title = "Status"
-    print(f"{sstatus_title}:")
-    status_types = []
-    for status in statuses:
-        r = by_status(data, status)
-        status_types.append({"status": r[0], "len_status": r[1]})
-    # Sort status_types by len_status
-    status_types = sorted(status_types, key=lambda x: x['len_status'], reverse=True)
-
-    for status_type in status_types:
-        status = status_type['status']
-        len_status = status_type['len_status']
-        print(f"  {status.ljust(MAX_LEN)} : {len_status}")
-    print()
-
+class Summary:
+    '''
+    Every count the summary prints, built up one finding at a time.
+    '''
 
-def by_public(data):
-    findings_details = []
-    findings_details_resolved = []
-    findings_details_archived = []
-    findings_details_active = []
+    def __init__(self):
+        self.total = 0
+        self.external = Counter() # ExternalAccess findings by status
+        self.public = Counter() # Public findings by status
+        self.status = Counter()
+        self.owners = set()
+        self.principals = set()
+        self.resource_types = Counter()
 
-    for finding in data:
+    def add(self, finding):
         finding = finding['finding'] if not TRIMMED else finding
-        try:
-            if finding['findingDetails'][0]['externalAccessDetails']['isPublic']:
-                findings_details.append(finding)
-                if finding['status'] == 'RESOLVED':
-                    findings_details_resolved.append(finding)
-                if finding['status'] == 'ARCHIVED':
-                    findings_details_archived.append(finding)
-                if finding['status'] == 'ACTIVE':
-                    findings_details_active.append(finding)
-        except:
-            pass
+        status = finding.get('status')
 
-    len_all = len(findings_details)
-    len_res = len(findings_details_resolved)
-    len_arc = len(findings_details_archived)
-    len_act = len(findings_details_active)
-
-    print("isPublic:")
-    t = "  Total"
-    print(f"{t.ljust(MAX_LEN)}   : {len_all}")
-    t = "  ACTIVE"
-    print(f"{t.ljust(MAX_LEN)}   : {len_act}")
-    t = "  ARCHIVED"
-    print(f"{t.ljust(MAX_LEN)}   : {len_arc}")
-    t = "  RESOLVED"
-    print(f"{t.ljust(MAX_LEN)}   : {len_res}")
-    print()
+        self.total += 1
+        self.status[status] += 1
+        self.owners.add(finding.get('resourceOwnerAccount'))
+        self.resource_types[finding.get('resourceType')] += 1
 
+        if finding.get('findingType') == 'ExternalAccess':
+            self.external[status] += 1
 
-def by_external(data):
-    findings_details = []
-    findings_details_resolved = []
-    findings_details_archived = []
-    findings_details_active = []
-
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
         try:
-            if finding['findingType'] == 'ExternalAccess':
-                findings_details.append(finding)
-                if finding['status'] == 'RESOLVED':
-                    findings_details_resolved.append(finding)
-                if finding['status'] == 'ARCHIVED':
-                    findings_details_archived.append(finding)
-                if finding['status'] == 'ACTIVE':
-                    findings_details_active.append(finding)
-        except:
+            if finding['findingDetails'][0]['externalAccessDetails']['isPublic']:
+                self.public[status] += 1
+        except (KeyError, IndexError, TypeError):
             pass
-    len_all = len(findings_details)
-    len_res = len(findings_details_resolved)
-    len_arc = len(findings_details_archived)
-    len_act = len(findings_details_active)
-
-    print("ExternalAccess:")
-    t = "  Total"
-    print(f"{t.ljust(MAX_LEN)}   : {len_all}")
-    t = "  ACTIVE"
-    print(f"{t.ljust(MAX_LEN)}   : {len_act}")
-    t = "  ARCHIVED"
-    print(f"{t.ljust(MAX_LEN)}   : {len_arc}")
-    t = "  RESOLVED"
-    print(f"{t.ljust(MAX_LEN)}   : {len_res}")
-    print()
-
 
-def by_status(data, status):
-    findings_details = []
+        # The principal is in the finding details, e.g. {"AWS": "999988887777"}
+        principal_type, principal = principal_of(external_access(finding))
+        self.principals.add(principal)
+
+    def merge(self, other):
+        # Add in the counts of another Summary, e.g. of another shard
+        self.total += other.total
+        self.external.update(other.external)
+        self.public.update(other.public)
+        self.status.update(other.status)
+        self.owners |= other.owners
+        self.principals |= other.principals
+        self.resource_types.update(other.resource_types)
+        return self
+
+    def to_dict(self):
+        # Counters as [key, count] pairs and sets as lists, so None keys survive json
+        return {
+            "total": self.total,
+            "external": list(self.external.items()),
+            "public": list(self.public.items()),
+            "status": list(self.status.items()),
+            "owners": list(self.owners),
+            "principals": list(self.principals),
+            "resource_types": list(self.resource_types.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls()
+        summary.total = data["total"]
+        summary.external = Counter(dict(data["external"]))
+        summary.public = Counter(dict(data["public"]))
+        summary.status = Counter(dict(data["status"]))
+        summary.owners = set(data["owners"])
+        summary.principals = set(data["principals"])
+        summary.resource_types = Counter(dict(data["resource_types"]))
+        return summary
+
+
+def summarise(data):
+    summary = Summary()
     for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        if finding['status'] == status:
-            findings_details.append(finding)
-    len_status = len(findings_details)
-    return status, len_status
-
-
-def by_owner(data):
-    findings_details = []
-    owner_list = []
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        owner_value = finding['resourceOwnerAccount']
-        owner_list.append(owner_value)
-        findings_details.append(finding)
-    owner_list = list(set(owner_list))
-    len_owner_list = len(owner_list)
+        summary.add(finding)
+    return summary
+
+
+def summarise_file(filename):
+    # Run in a worker process: the summary of one shard, as a dict to send back
+    return summarise(iter_findings(filename)).to_dict()
+
+
+def summarise_shards(paths, processes=None):
+    summary = Summary()
+    processes = min(processes or os.cpu_count() or 1, len(paths))
+    if processes <= 1:
+        for path in paths:
+            summary.merge(summarise(iter_findings(path)))
+        return summary
+    from concurrent.futures import ProcessPoolExecutor # imported here, as get_all_findings imports this module and doesn't need it
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for data in executor.map(summarise_file, paths):
+            summary.merge(Summary.from_dict(data))
+    return summary
+
+
+def sidecar_path(filename):
+    return f"{filename}.summary.json"
+
+
+def write_sidecar(summary, filename):
+    # Save the summary of a details file next to it, stamped with the file's size and modification time
+    stat = os.stat(filename)
+    sidecar = {
+        "version": SIDECAR_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "summary": summary.to_dict(),
+    }
+    path = sidecar_path(filename)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(sidecar, file)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def read_sidecar(filename):
+    # The Summary saved next to filename, or None if there isn't one, the file has changed since or it has changes logged
+    try:
+        with open(sidecar_path(filename), "r") as file:
+            sidecar = json.load(file)
+        stat = os.stat(filename)
+    except (OSError, ValueError):
+        return None
+    if sidecar.get("version") != SIDECAR_VERSION or sidecar.get("size") != stat.st_size or sidecar.get("mtime_ns") != stat.st_mtime_ns or has_changes(filename):
+        d_print(f"Summary sidecar is stale: {sidecar_path(filename)}")
+        return None
+    return Summary.from_dict(sidecar["summary"])
+
+
+def print_summary(summary):
+    print_by_status("ExternalAccess", summary.external)
+    print_by_status("isPublic", summary.public)
 
     t = "Unique owners"
-    print(f"{t.ljust(MAX_LEN)}   : {len_owner_list}")
+    print(f"{t.ljust(MAX_LEN)}   : {len(summary.owners)}")
     print()
 
-
-def by_principal(data):
-    findings_details = []
-    principal_list = []
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        p = None
-        p_value = None
-        try:
-            p = finding['principal']
-        except:
-            pass
-        try:
-            p_value = p['AWS']
-            key = "aws"
-        except:
-            pass
-        try:
-            p_value = p['Federated']
-            key = "federated"
-        except:
-            pass
-        principal_list.append(p_value)
-        findings_details.append(finding)
-    principal_list = list(set(principal_list))
-    len_principal_list = len(principal_list)
     t = "Unique principals"
-    print(f"{t.ljust(MAX_LEN)}   : {len_principal_list}")
+    print(f"{t.ljust(MAX_LEN)}   : {len(summary.principals)}")
     print()
 
+    print_status(summary.status)
+    print_resource_types(summary.resource_types)
 
-def by_resource_type(data, resource_type):
-    findings_details = []
-    resource_type_list = []
-    for finding in data:
-        finding = finding['finding'] if not TRIMMED else finding
-        resource_type_value = finding['resourceType']
-        resource_type_list.append(resource_type_value)
-
-        if resource_type_value == resource_type:
-            findings_details.append(finding)
-    resource_type_list = list(set(resource_type_list))
-    len_resource_type_list = len(resource_type_list)
-    len_resource_type = len(findings_details)
 
-    return len_resource_type_list, resource_type, len_resource_type
+def print_by_status(title, counts):
+    print(f"{title}:")
+    t = "  Total"
+    print(f"{t.ljust(MAX_LEN)}   : {sum(counts.values())}")
+    for status in STATUSES:
+        t = f"  {status}"
+        print(f"{t.ljust(MAX_LEN)}   : {counts[status]}")
+    print()
 
 
-def resource_type_loop(data):
-    resource_types = ["AWS::S3::Bucket", "AWS::IAM::Role", "AWS::SQS::Queue", "AWS::Lambda::Function", "AWS::Lambda::LayerVersion", "AWS::KMS::Key", "AWS::SecretsManager::Secret", "AWS::EFS::FileSystem", "AWS::EC2::Snapshot", "AWS::ECR::Repository", "AWS::RDS::DBSnapshot", "AWS::RDS::DBClusterSnapshot", "AWS::SNS::Topic", "AWS::S3Express::DirectoryBucket", "AWS::DynamoDB::Table", "AWS::DynamoDB::Stream"]
+def print_status(status_counts):
+    sstatus_title = "Status"
+    print(f"{sstatus_title}:")
+    # Always show the known statuses, plus any others found
+    statuses = STATUSES + [status for status in status_counts if status not in STATUSES]
+    # Sort by count
+    statuses = sorted(statuses, key=lambda status: status_counts[status], reverse=True)
+    for status in statuses:
+        print(f"  {str(status).ljust(MAX_LEN)} : {status_counts[status]}")
+    print()
 
-    r_types = []
-    for r_type in resource_types:
-        response = by_resource_type(data, r_type) #if resource_type else None
-        len_resource_type_list = response[0]
-        resource_type = response[1]
-        len_resource_type = response[2]
-        r_types.append({"resource_type": resource_type, "len_resource_type" : len_resource_type})
 
+def print_resource_types(resource_type_counts):
     t = "Resource Types"
-    print(f"{t.ljust(MAX_LEN)}   : {len_resource_type_list} types")
-
-    # Sort r_types by len_resource_type
-    r_types = sorted(r_types, key=lambda x: x['len_resource_type'], reverse=True)
+    print(f"{t.ljust(MAX_LEN)}   : {len(resource_type_counts)} types")
 
-    # Remove empty resource types
-    r_types = [r_type for r_type in r_types if r_type['len_resource_type'] > 0]
-    for r_type in r_types:
-        print(f"  {r_type['resource_type'].ljust(MAX_LEN)} : {r_type['len_resource_type']}")
+    # Sort by count; only types that were found are counted, so none are empty
+    for resource_type, count in resource_type_counts.most_common():
+        print(f"  {str(resource_type).ljust(MAX_LEN)} : {count}")
 
 
 def usage(message):
@@ -236,6 +242,10 @@ def usage(message):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process some variables.')
     parser.add_argument( '-f', dest='filename', help='The filename to use')
+    parser.add_argument( '--rescan', dest='rescan', action='store_true', help='Read the whole file, even if get_all_findings.py saved an up to date summary of it')
+    parser.add_argument( '--processes', dest='processes', type=int, help='Processes used to summarise a sharded snapshot (default: one per CPU)')
+    parser.add_argument( '--metrics', dest='metrics', help='Write the run metrics (timings) here as json')
+    parser.add_argument( '--prometheus', dest='prometheus', help='Write the run metrics here in Prometheus textfile format')
     args = parser.parse_args()
 
     # Unset env vars - read from .env file
@@ -250,6 +260,11 @@ if __name__ == "__main__":
     DEBUG = bool(os.getenv("DEBUG")) if os.getenv("DEBUG") != None else DEBUG
     d_print(f"DEBUG {DEBUG}, {type(DEBUG)}")
 
+    RESCAN = args.rescan or RESCAN
+    PROCESSES = args.processes or PROCESSES
+    METRICS_FILE = args.metrics or METRICS_FILE
+    PROMETHEUS_FILE = args.prometheus or PROMETHEUS_FILE
+
     if args.filename != None:
         filename = args.filename
     elif bool(os.getenv("FINDINGS_FILE")) != None:
@@ -0,0 +1,169 @@
+import json
+import os
+import pytest
+import get_all_findings
+import ingest_events
+from benchmark_findings import ARN, StubAccessAnalyzer, generate_findings
+from findings_index import open_index
+from findings_io import JsonWriter, iter_findings
+from findings_store import FindingsStore
+
+# Runs get_all_findings.py and ingest_events.py against benchmark_findings.StubAccessAnalyzer: python -m pytest -q
+
+COUNT = 250 # Findings served by the stub, a few list_findings pages
+
+
+class Interrupted(StubAccessAnalyzer):
+    '''
+    StubAccessAnalyzer that's stopped (as by Ctrl-C) at the nth get_finding_v2 call
+    '''
+
+    def __init__(self, findings, stop_at):
+        super().__init__(findings, latency=0)
+        self.gets = 0
+        self.stop_at = stop_at
+
+    def get_finding_v2(self, id, analyzerArn):
+        self.gets += 1
+        if self.gets == self.stop_at:
+            raise KeyboardInterrupt
+        return super().get_finding_v2(id, analyzerArn)
+
+
+def as_written(findings):
+    # Findings as get_all_findings.py writes them (timestamps with default=str)
+    return [json.loads(json.dumps(finding, default=str)) for finding in findings]
+
+
+@pytest.fixture
+def findings():
+    return as_written(generate_findings(COUNT))
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    # Run get_all_findings.main in a temporary directory against a stub, as of a given NOW
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(get_all_findings, "CHECKPOINT_SECONDS", 0)
+
+    def run(stub, now="20240101-0000", **kwargs):
+        monkeypatch.setattr(get_all_findings, "new_client", lambda workers, region=None: stub)
+        monkeypatch.setattr(get_all_findings, "NOW", now)
+        arn = None if kwargs.get("resume") else ARN
+        get_all_findings.main(arn, kwargs.pop("limit", "None"), **kwargs)
+        return results_path(now, kwargs.get("ndjson"), kwargs.get("shards"))
+    return run
+
+
+def results_path(now, ndjson=False, shards=None):
+    extension = ".shards.json" if shards else ".ndjson" if ndjson else ".json"
+    return f"{now}-112233445566-Benchmark.details{extension}"
+
+
+@pytest.mark.parametrize("options", [{}, {"ndjson": True}, {"pipeline": True}, {"shards": 3}], ids=["json", "ndjson", "pipeline", "shards"])
+def test_resume(run, findings, options):
+    stub = Interrupted(findings, stop_at=120)
+    with pytest.raises(KeyboardInterrupt):
+        run(stub, workers=4, **options)
+    path = results_path("20240101-0000", options.get("ndjson"), options.get("shards"))
+    assert os.path.exists(f"{path}.checkpoint")
+
+    # Findings written before the interruption aren't fetched again
+    stub.stop_at = None
+    gets = stub.gets
+    run(stub, workers=4, resume=f"{path}.checkpoint")
+    assert not os.path.exists(f"{path}.checkpoint")
+    written = list(iter_findings(path))
+    if options.get("shards"):
+        # Each shard is in listing order, but they're read one after the other
+        written.sort(key=lambda finding: findings.index(finding))
+    assert written == findings
+    assert stub.gets - gets < COUNT
+
+
+@pytest.mark.parametrize("options", [{}, {"pipeline": True}], ids=["listed", "pipeline"])
+def test_incremental_matches_full(run, findings, options):
+    previous = run(StubAccessAnalyzer(findings, latency=0), now="20240101-0000", **options)
+
+    # Some findings change, some go and some are new
+    current = [dict(finding) for finding in findings[10:]] + as_written(generate_findings(20, seed=1))
+    for finding in current[:5]:
+        finding["status"] = "RESOLVED"
+        finding["updatedAt"] = "2025-01-01 00:00:00+00:00"
+    stub = StubAccessAnalyzer(current, latency=0)
+    incremental = run(stub, now="20240102-0000", previous_file=previous, **options)
+    full = run(StubAccessAnalyzer(current, latency=0), now="20240103-0000", **options)
+
+    assert list(iter_findings(incremental)) == list(iter_findings(full)) == current
+    with open(f"{incremental}.removed.json") as file:
+        removed = json.load(file)
+    assert removed["previous_file"] == previous
+    assert [finding["id"] for finding in removed["removed"]] == [finding["id"] for finding in findings[:10]]
+    # Only the changed and new findings are fetched, after the three list_findings pages
+    assert stub.calls == 3 + 25
+
+
+@pytest.mark.parametrize("options", [{}, {"ndjson": True}, {"shards": 3}], ids=["json", "ndjson", "shards"])
+def test_index_lookup(run, findings, options):
+    path = run(StubAccessAnalyzer(findings, latency=0), **options)
+    with open_index(path) as index:
+        for finding in findings[::25]:
+            assert index.get(finding["id"]) == finding
+        assert index.get("00000000-0000-0000-0000-000000000000") is None
+
+
+def event(finding, **detail):
+    # An EventBridge finding event, with the finding's full details unless detail says otherwise
+    access = finding["findingDetails"][0]["externalAccessDetails"]
+    detail = {
+        "id": finding["id"], "status": finding["status"], "resourceType": finding["resourceType"],
+        "resource": finding["resource"], "accountId": finding["resourceOwnerAccount"], "updatedAt": "2025-01-01T00:00:00Z",
+        "principal": access["principal"], "action": access["action"], "isPublic": access["isPublic"], **detail,
+    }
+    return {"source": "aws.access-analyzer", "detail-type": "Access Analyzer Finding", "region": "eu-west-1",
+            "resources": [ARN], "detail": detail}
+
+
+@pytest.mark.parametrize("target", ["findings.json", "findings.db"])
+def test_ingest_merge(tmp_path, monkeypatch, findings, target):
+    monkeypatch.chdir(tmp_path)
+    if target.endswith(".db"):
+        store = FindingsStore(target)
+        store.upsert_many(findings)
+        store.close()
+    else:
+        writer = JsonWriter(target, index=True)
+        for finding in findings:
+            writer.write(finding)
+        writer.close()
+
+    new = as_written(generate_findings(1, seed=1))[0]
+    fetched = {**findings[3], "status": "ARCHIVED", "updatedAt": "2025-01-01 00:00:00+00:00"}
+    stub = StubAccessAnalyzer([fetched], latency=0)
+    monkeypatch.setattr(ingest_events, "new_client", lambda workers, region=None: stub)
+    events = [
+        event(findings[0], status="RESOLVED"),
+        event(findings[1], isDeleted=True),
+        event(findings[2], updatedAt="2020-01-01T00:00:00Z", status="RESOLVED"), # older than what we have
+        {"source": "aws.access-analyzer", "resources": [ARN], "detail": {"id": fetched["id"], "status": "ARCHIVED", "updatedAt": "2025-01-01T00:00:00Z"}},
+        event(new),
+    ]
+    with open("events.json", "w") as file:
+        json.dump(events, file)
+    monkeypatch.setattr(ingest_events, "COMPACT_RATIO", 0) # compact after every batch
+    ingest_events.main("events.json", target, batch_size=2)
+
+    expected = {finding["id"]: finding for finding in findings}
+    expected[findings[0]["id"]] = {**findings[0], "status": "RESOLVED", "updatedAt": "2025-01-01 00:00:00+00:00"}
+    del expected[findings[1]["id"]]
+    expected[fetched["id"]] = fetched
+    expected[new["id"]] = {**new, "updatedAt": "2025-01-01 00:00:00+00:00"}
+    versions = [(finding["id"], finding["status"], finding["updatedAt"]) for finding in expected.values()]
+    if target.endswith(".db"):
+        store = FindingsStore(target)
+        assert store.count() == len(expected)
+        assert sorted((finding["id"], finding["status"], finding["updatedAt"]) for finding in store.iter_findings()) == sorted(versions)
+        store.close()
+    else:
+        assert [(finding["id"], finding["status"], finding["updatedAt"]) for finding in iter_findings(target)] == versions
+        assert not os.path.exists(f"{target}.changes.ndjson")